@@ -47,10 +47,15 @@ def main():
             continue
 
         try:
-            result = rag.smart_query(query)
             print("\n===================================")
             print("\nOdpowiedź:")
-            print(result['answer'])
+            for event in rag.smart_query(query, stream=True):
+                if event["type"] == "token":
+                    print(event["text"], end="", flush=True)
+                elif event["type"] == "done":
+                    if not event["time_to_first_token"]:
+                        print(event["answer"], end="")
+                    print()
         except Exception as e:
             print(f"Błąd podczas przetwarzania zapytania: {e}")
 
@@ -0,0 +1,65 @@
+"""
+Przepustowość LegalTextStructureAnalyzer w liniach na sekundę.
+
+Mierzy analizę (markery, końce sekcji i hierarchię) dla dokumentów
+z data/documents oraz dla syntetycznego kodeksu o rozmiarze zbliżonym do
+Kodeksu cywilnego (ok. 1100 artykułów z paragrafami i punktami).
+
+Przykład:
+    python -m scripts.benchmark_analyzer --documents data/documents --articles 1100 --repeat 5
+"""
+import argparse
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+from src.analyzers.legal_text_structure_analyzer import LegalTextStructureAnalyzer
+
+
+def synthetic_code(articles: int, paragraphs: int = 3, points: int = 4) -> str:
+    """Kodeks o strukturze rozdziały > artykuły > paragrafy > punkty."""
+    lines = []
+    for art in range(1, articles + 1):
+        if art % 25 == 1:
+            lines.append(f"Rozdział {art // 25 + 1}")
+        lines.append(f"Art. {art}. Przepis ogólny dotyczący zobowiązań stron umowy.")
+        for par in range(1, paragraphs + 1):
+            lines.append(f"§ {par}. Strona obowiązana jest do świadczenia zgodnie z treścią zobowiązania.")
+            for point in range(1, points + 1):
+                lines.append(f"{point}) w terminie określonym w umowie lub wynikającym z właściwości świadczenia;")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def measure(text: str, repeat: int) -> Tuple[float, int]:
+    """Zwraca (najlepszy czas analizy w sekundach, liczba markerów)."""
+    best, markers = float("inf"), 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        analyzer = LegalTextStructureAnalyzer(text)
+        best = min(best, time.perf_counter() - start)
+        markers = len(analyzer.section_markers)
+    return best, markers
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Przepustowość analizatora struktury tekstu prawnego")
+    parser.add_argument("--documents", default="data/documents")
+    parser.add_argument("--articles", type=int, default=1100, help="Liczba artykułów kodeksu syntetycznego")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    corpus: List[Tuple[str, str]] = [
+        (path.name, path.read_text(encoding="utf-8")) for path in sorted(Path(args.documents).glob("*.txt"))
+    ]
+    corpus.append((f"kodeks syntetyczny ({args.articles} art.)", synthetic_code(args.articles)))
+
+    print(f"{'dokument':<36}{'linie':>10}{'markery':>10}{'czas [ms]':>12}{'linie/s':>14}")
+    for name, text in corpus:
+        lines = len(text.splitlines())
+        seconds, markers = measure(text, args.repeat)
+        print(f"{name:<36}{lines:>10}{markers:>10}{seconds * 1000:>12.1f}{lines / seconds:>14,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Porównanie przybliżonych indeksów (IVF, kwantyzacja) z wyszukiwaniem dokładnym.
+
+Raportuje recall@k, opóźnienia p50/p99 i pamięć indeksu dla kolejnych
+wartości nprobe oraz wariantów kwantyzacji (int8/float16, opcjonalnie z PCA,
+z rescore float32 i bez). Domyślnie używa embeddingów z cache'u, a gdy jest
+ich mało - syntetycznego korpusu o strukturze klastrów.
+
+Przykład:
+    python -m scripts.benchmark_ann --synthetic 200000 --nprobe 4 8 16 32
+    python -m scripts.benchmark_ann --quantization int8 float16 int8:256 --rescore-k 100
+"""
+import argparse
+import time
+from typing import List
+
+import numpy as np
+
+from src.cache import MemmapVectorStore
+from src.retrieval import DenseIndex, IVFIndex, QuantizedIndex
+
+
+def synthetic_corpus(n: int, dim: int, clusters: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=n)
+    return centers[labels] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+
+
+def load_corpus(args) -> np.ndarray:
+    if not args.synthetic:
+        store = MemmapVectorStore(f"{args.cache_dir}/vectors")
+        if len(store) >= args.min_corpus:
+            print(f"Korpus: {len(store)} embeddingów z {store.vectors_path}")
+            return np.asarray(store.matrix)
+        print(f"W cache'u jest tylko {len(store)} embeddingów - używam korpusu syntetycznego")
+    n = args.synthetic or 100000
+    print(f"Korpus syntetyczny: {n} x {args.dim}")
+    return synthetic_corpus(n, args.dim, args.clusters)
+
+
+def percentile_ms(latencies: List[float], q: float) -> float:
+    return float(np.percentile(latencies, q) * 1000)
+
+
+def top_k(rows: np.ndarray, scores: np.ndarray, k: int) -> np.ndarray:
+    if len(scores) <= k:
+        return rows
+    return rows[np.argpartition(-scores, k - 1)[:k]]
+
+
+def measure(index, queries: np.ndarray, truth: List[set], k: int):
+    """Zwraca (recall@k, opóźnienia) indeksu względem wyników dokładnych."""
+    latencies, hits = [], 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        rows, scores = index.search(query)
+        found = top_k(rows, scores, k)
+        latencies.append(time.perf_counter() - start)
+        hits += len(expected & set(found.tolist()))
+    return hits / (k * len(queries)), latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Recall@k, opóźnienia i pamięć indeksów przybliżonych względem wyszukiwania dokładnego")
+    parser.add_argument("--cache-dir", default="cache")
+    parser.add_argument("--synthetic", type=int, default=0, help="Liczba wektorów korpusu syntetycznego")
+    parser.add_argument("--min-corpus", type=int, default=10000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--clusters", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32, 64])
+    parser.add_argument("--quantization", nargs="*", default=["int8", "float16", "int8:256"],
+                        help="Warianty kwantyzacji: typ[:wymiar PCA], np. int8 albo int8:256")
+    parser.add_argument("--rescore-k", type=int, default=100)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args)
+    rng = np.random.default_rng(1)
+    queries = corpus[rng.choice(len(corpus), size=args.queries, replace=False)]
+    queries = queries + 0.3 * rng.standard_normal(queries.shape).astype(np.float32)
+
+    exact = DenseIndex()
+    exact.add(corpus)
+
+    start = time.perf_counter()
+    ivf = IVFIndex(nlist=args.nlist, min_train_size=1)
+    ivf.add(corpus)
+    print(f"Trening IVF ({len(ivf.centroids)} list): {time.perf_counter() - start:.2f}s")
+
+    latencies, truth = [], []
+    for query in queries:
+        start = time.perf_counter()
+        rows, scores = exact.search(query)
+        truth.append(set(top_k(rows, scores, args.k).tolist()))
+        latencies.append(time.perf_counter() - start)
+    exact_mb = exact.matrix.nbytes / 2**20
+    print(f"\n{'backend':<24}{'recall@' + str(args.k):>12}{'p50 [ms]':>12}{'p99 [ms]':>12}{'pamięć [MB]':>14}")
+    print(f"{'exact':<24}{1.0:>12.3f}{percentile_ms(latencies, 50):>12.2f}"
+          f"{percentile_ms(latencies, 99):>12.2f}{exact_mb:>14.1f}")
+
+    for nprobe in args.nprobe:
+        ivf.nprobe = nprobe
+        recall, latencies = measure(ivf, queries, truth, args.k)
+        print(f"{'ivf nprobe=' + str(nprobe):<24}{recall:>12.3f}"
+              f"{percentile_ms(latencies, 50):>12.2f}{percentile_ms(latencies, 99):>12.2f}{exact_mb:>14.1f}")
+
+    for variant in args.quantization:
+        dtype, _, dim = variant.partition(":")
+        for rescore_k in (None, args.rescore_k):
+            index = QuantizedIndex(dtype=dtype, dim=int(dim) if dim else None, rescore_k=rescore_k)
+            index.add(corpus)
+            recall, latencies = measure(index, queries, truth, args.k)
+            name = variant + (f" +rescore {rescore_k}" if rescore_k else "")
+            print(f"{name:<24}{recall:>12.3f}{percentile_ms(latencies, 50):>12.2f}"
+                  f"{percentile_ms(latencies, 99):>12.2f}{index.memory_bytes / 2**20:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Strumieniowe dodawanie katalogu dokumentów do cache'u LegalRAGPipeline.
+
+Przerwane dodawanie (np. Ctrl+C) można uruchomić ponownie tym samym
+poleceniem - zapisane już dokumenty zostaną pominięte.
+
+Przykład:
+    python -m scripts.embed_documents data/documents --pattern "*.txt" --workers 8
+"""
+import argparse
+
+from src.chunking.hierarchical_chunker import HierarchicalLegalChunker
+from src.rag.LegalRAGPipeline import LegalRAGPipeline
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dodaje dokumenty z katalogu do cache'u embeddingów")
+    parser.add_argument("directory", nargs="?", default="data/documents")
+    parser.add_argument("--pattern", default="*.txt")
+    parser.add_argument("--no-recursive", action="store_true", help="Nie przeszukuj podkatalogów")
+    parser.add_argument("--cache-dir", default="cache")
+    parser.add_argument("--workers", type=int, default=None, help="Liczba procesów chunkujących")
+    parser.add_argument("--commit-batch-size", type=int, default=512, help="Liczba chunków w zapisywanej paczce")
+    parser.add_argument("--batch-size", type=int, default=32, help="Rozmiar paczki embeddera")
+    parser.add_argument("--gpu", action="store_true")
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args()
+
+    rag = LegalRAGPipeline(
+        use_gpu=args.gpu,
+        cache_dir=args.cache_dir,
+        chunker=HierarchicalLegalChunker(),
+        embedding_batch_size=args.batch_size,
+        ingestion_workers=args.workers,
+        commit_batch_size=args.commit_batch_size,
+        debug_mode=args.debug
+    )
+
+    try:
+        stats = rag.add_directory(args.directory, pattern=args.pattern, recursive=not args.no_recursive)
+    except KeyboardInterrupt:
+        print(f"\nPrzerwano. Zapisano {len(rag.document_index)} dokumentów - "
+              f"uruchom ponownie to samo polecenie, aby kontynuować.")
+        return
+    except FileNotFoundError as e:
+        print(f"Błąd: {e}")
+        return
+
+    print(f"Dodano {stats['added_documents']} dokumentów ({stats['new_chunks']} chunków), "
+          f"pominięto {stats['skipped_documents']}, błędy odczytu: {stats['failed_files']}")
+    for name, stage in stats["stages"].items():
+        rate = stage.get("docs_per_s", stage.get("chunks_per_s", 0))
+        unit = "dok./s" if "docs_per_s" in stage else "chunków/s"
+        print(f"  {name:<10} {rate:10.1f} {unit}  (czas pracy {stage['busy_time']:.2f}s)")
+    print(f"Czas: {stats['total_time']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -49,6 +49,14 @@ class LegalTextStructureAnalyzer:
         'literowy_punkt': 3,
     }
     
+    # Jedno wyrażenie dla całej linii: alternatywy w kolejności sprawdzania,
+    # jedna nazwana grupa na alternatywę (numer/nazwa markera)
+    LINE_PATTERN = re.compile("|".join(
+        [re.sub(r"\((?!\?)", f"(?P<{name}>", pattern, count=1) for name, pattern in SECTION_PATTERNS.items()]
+        + [r'^(?P<punkt_numeryczny>\d+)\.\s*(?:.+)']
+        + [re.sub(r"\((?!\?)", f"(?P<{name}>", pattern, count=1) for pattern, name in POINT_PATTERNS]
+    ))
+    
     def __init__(self, text: str):
         """
         Inicjalizacja analizatora z tekstem.
@@ -60,8 +68,26 @@ class LegalTextStructureAnalyzer:
         self.lines = text.splitlines()
         self.section_markers = self._identify_all_section_markers()
         self.hierarchy = self._build_document_hierarchy()
+        
+        # Indeksy liczone raz: id -> pierwszy marker, id -> wszystkie markery, dziecko -> rodzic
+        self._markers_by_id: Dict[str, Dict] = {}
+        self._markers_with_id: Dict[str, List[Dict]] = defaultdict(list)
+        for marker in self.section_markers:
+            self._markers_by_id.setdefault(marker['id'], marker)
+            self._markers_with_id[marker['id']].append(marker)
+        self.child_to_parent = self.create_child_to_parent_map()
+        # Ścieżki kontekstu (od korzenia) współdzielone przez sekcje o wspólnych przodkach
+        self._context_paths: Dict[str, List[Dict[str, str]]] = {}
     
     def _identify_all_section_markers(self) -> List[Dict]:
+        """
+        Wyszukuje markery sekcji i punktów w jednym przebiegu po liniach.
+        
+        Każda linia dopasowywana jest raz, jednym wyrażeniem LINE_PATTERN;
+        alternatywy sprawdzane są w tej samej kolejności co SECTION_PATTERNS,
+        punkty numeryczne i POINT_PATTERNS. Końce sekcji wyznaczane są stosem
+        otwartych sekcji (patrz _resolve_section_ends).
+        """
         markers = []
         
         for line_idx, line in enumerate(self.lines):
@@ -69,99 +95,63 @@ class LegalTextStructureAnalyzer:
             if not line:
                 continue
             
-            # Najpierw sprawdzamy sekcje strukturalne
-            section_found = False
-            for section_type, pattern in self.SECTION_PATTERNS.items():
-                if match := re.match(pattern, line):
-                    section_name = match.group(1)
-                    section_id = f"{section_type}_{section_name}"
-                    
-                    # Upewniamy się, że używamy spójnego klucza do HIERARCHY
-                    # Jeśli section_type to 'rozdzial', konwertujemy na 'rozdział' dla zgodności z HIERARCHY
-                    hierarchy_key = 'rozdział' if section_type == 'rozdzial' else section_type
-                    
-                    markers.append({
-                        'type': section_type,
-                        'hierarchy_key': hierarchy_key,  # Dodajemy klucz do hierarchii
-                        'name': section_name,
-                        'id': section_id,
-                        'line': line_idx,
-                        'content_start': line_idx,
-                        'text': line
-                    })
-                    section_found = True
-                    break
+            match = self.LINE_PATTERN.match(line)
+            if match is None:
+                continue
             
-            # Jeśli nie znaleziono sekcji strukturalnej, sprawdzamy czy to punkt
-            if not section_found:
-                # Dodajemy obsługę punktów numerycznych jako domyślny typ
-                punkt_match = re.match(r'^(\d+)\.\s*(.+)', line)
-                if punkt_match:
-                    punkt_name = punkt_match.group(1)
-                    punkt_id = f"punkt_numeryczny_{punkt_name}_{line_idx}"
-                    
-                    markers.append({
-                        'type': 'punkt',
-                        'hierarchy_key': 'punkt',  # Dodajemy klucz do hierarchii
-                        'subtype': 'punkt_numeryczny',
-                        'name': punkt_name,
-                        'id': punkt_id,
-                        'line': line_idx,
-                        'content_start': line_idx,
-                        'text': line
-                    })
-                
-                # Zachowujemy istniejące wzorce punktów
-                elif not punkt_match:
-                    for pattern, punkt_type in self.POINT_PATTERNS:
-                        if punkt_match := re.match(pattern, line):
-                            punkt_name = punkt_match.group(1)
-                            punkt_id = f"{punkt_type}_{punkt_name}_{line_idx}"
-                            
-                            markers.append({
-                                'type': 'punkt',
-                                'hierarchy_key': punkt_type,  # Dodajemy klucz do hierarchii
-                                'subtype': punkt_type,
-                                'name': punkt_name,
-                                'id': punkt_id,
-                                'line': line_idx,
-                                'content_start': line_idx,
-                                'text': line
-                            })
-                            break
+            kind = match.lastgroup
+            name = match.group(kind)
+            if kind in self.SECTION_PATTERNS:
+                # 'rozdzial' ma w HIERARCHY klucz 'rozdział'
+                hierarchy_key = 'rozdział' if kind == 'rozdzial' else kind
+                marker = {
+                    'type': kind,
+                    'hierarchy_key': hierarchy_key,
+                    'name': name,
+                    'id': f"{kind}_{name}",
+                }
+            else:
+                hierarchy_key = 'punkt' if kind == 'punkt_numeryczny' else kind
+                marker = {
+                    'type': 'punkt',
+                    'hierarchy_key': hierarchy_key,
+                    'subtype': kind,
+                    'name': name,
+                    'id': f"{kind}_{name}_{line_idx}",
+                }
+            marker.update({
+                'line': line_idx,
+                'content_start': line_idx,
+                'text': line,
+                'hierarchy_level': self.HIERARCHY.get(hierarchy_key, 3)
+            })
+            markers.append(marker)
         
-        # Sortujemy markery według pozycji w tekście
-        markers = sorted(markers, key=lambda x: x['line'])
+        self._resolve_section_ends(markers)
+        return markers
+    
+    def _resolve_section_ends(self, markers: List[Dict]) -> None:
+        """
+        Ustawia content_end każdej sekcji w czasie O(M).
         
-        # Przypisujemy hierarchię do każdego markera
+        Sekcja kończy się (linię przed) pierwszym późniejszym markerem tego
+        samego typu albo poziomu równego lub wyższego (mniejsza liczba w
+        HIERARCHY). Sekcje otwarte trzymane są na stosie: nowy marker zamyka
+        wszystkie otwarte sekcje o poziomie >= swojemu, więc poziomy na stosie
+        rosną od dołu. Punkty mają najniższe poziomy, więc zamykany zbiór jest
+        zawsze wierzchołkiem stosu.
+        """
+        open_sections: List[Dict] = []
         for marker in markers:
-            # Używamy hierarchy_key do uzyskania poziomu hierarchii
-            hierarchy_key = marker.get('hierarchy_key', marker['type'])
-            marker['hierarchy_level'] = self.HIERARCHY.get(hierarchy_key, 3)
+            level = marker['hierarchy_level']
+            while open_sections and (open_sections[-1]['type'] == marker['type']
+                                     or level <= open_sections[-1]['hierarchy_level']):
+                open_sections.pop()['content_end'] = marker['line'] - 1
+            open_sections.append(marker)
         
-        # Dodajemy informacje o końcu zawartości każdej sekcji
-        for i, marker in enumerate(markers):
-            current_type = marker['type']
-            current_level = marker['hierarchy_level']
-            
-            # Znajdź koniec sekcji
-            for j in range(i + 1, len(markers)):
-                next_marker = markers[j]
-                next_type = next_marker['type']
-                next_level = next_marker['hierarchy_level']
-                
-                # Sekcja kończy się gdy:
-                # 1. Napotkamy sekcję tego samego typu (np. artykuł -> artykuł)
-                # 2. LUB napotkamy sekcję wyższego poziomu (np. artykuł -> rozdział)
-                # Mniejsza liczba w HIERARCHY oznacza wyższy poziom w hierarchii
-                if next_type == current_type or next_level <= current_level:
-                    marker['content_end'] = next_marker['line'] - 1
-                    break
-            else:
-                # Jeśli to ostatnia sekcja w dokumencie
-                marker['content_end'] = len(self.lines)
-        
-        return markers
+        # Sekcje niezamknięte trwają do końca dokumentu
+        for marker in open_sections:
+            marker['content_end'] = len(self.lines)
     
     def _build_document_hierarchy(self) -> Dict[str, List[str]]:
         """
@@ -232,13 +222,11 @@ class LegalTextStructureAnalyzer:
         return dict(hierarchy)
     
     def get_section_content(self, section_id: str) -> str:
-        for marker in self.section_markers:
-            if marker['id'] == section_id:
-                start = marker['content_start']
-                end = marker['content_end']
-                return "\n".join(self.lines[start:end])
+        marker = self._markers_by_id.get(section_id)
+        if marker is None:
+            return ""
         
-        return ""
+        return "\n".join(self.lines[marker['content_start']:marker['content_end']])
     
     def create_child_to_parent_map(self) -> Dict[str, str]:
         child_to_parent = {}
@@ -250,53 +238,59 @@ class LegalTextStructureAnalyzer:
         return child_to_parent
     
     def build_context_path(self, section_id: str) -> List[Dict[str, str]]:
-        path = []
-        current_id = section_id
-        
-        # Znajdź marker dla danej sekcji
-        marker = next((m for m in self.section_markers if m['id'] == section_id), None)
-        if marker:
-            path.append({
-                'type': marker['type'],
-                'id': marker['id'],
-                'name': marker['name'],
-                'subtype': marker.get('subtype', '')
-            })
+        """
+        Ścieżka kontekstu sekcji od korzenia do liścia w czasie O(głębokość).
         
-        # Budujemy ścieżkę w górę hierarchii
-        child_to_parent = self.create_child_to_parent_map()
-        while current_id in child_to_parent:
-            parent_id = child_to_parent[current_id]
-            if parent_id == 'dokument':
-                break
-            
-            parent_marker = next((m for m in self.section_markers if m['id'] == parent_id), None)
-            if parent_marker:
-                path.append({
-                    'type': parent_marker['type'],
-                    'id': parent_marker['id'],
-                    'name': parent_marker['name'],
-                    'subtype': parent_marker.get('subtype', '')
-                })
+        Args:
+            section_id: Identyfikator sekcji
             
+        Returns:
+            Lista słowników {type, id, name, subtype} (nowe kopie przy każdym wywołaniu)
+        """
+        return [dict(entry) for entry in self._context_entries(section_id)]
+    
+    def _context_entries(self, section_id: str) -> List[Dict[str, str]]:
+        # Idziemy w górę tylko do najbliższego przodka z zapamiętaną ścieżką
+        chain = []
+        current_id = section_id
+        path: List[Dict[str, str]] = []
+        while current_id not in self._context_paths:
+            chain.append(current_id)
+            parent_id = self.child_to_parent.get(current_id)
+            if parent_id is None or parent_id == 'dokument':
+                break
             current_id = parent_id
+        else:
+            path = self._context_paths[current_id]
         
-        # Odwracamy, żeby ścieżka była od korzenia do liścia
-        return list(reversed(path))
+        # Uzupełniamy ścieżki w dół łańcucha, od przodka do zadanej sekcji
+        for chain_id in reversed(chain):
+            marker = self._markers_by_id.get(chain_id)
+            if marker:
+                path = path + [{
+                    'type': marker['type'],
+                    'id': marker['id'],
+                    'name': marker['name'],
+                    'subtype': marker.get('subtype', '')
+                }]
+            self._context_paths[chain_id] = path
+        
+        return path
     
     def get_section_bounds(self, section_id: str) -> Optional[Tuple[int, int]]:
-        for marker in self.section_markers:
-            if marker['id'] == section_id:
-                return marker['line'], marker['content_end']
+        marker = self._markers_by_id.get(section_id)
+        if marker is None:
+            return None
         
-        return None
+        return marker['line'], marker['content_end']
     
     def get_children_for_section(self, section_id: str) -> List[Dict]:
         if section_id not in self.hierarchy:
             return []
         
-        child_ids = self.hierarchy[section_id]
-        return [marker for marker in self.section_markers if marker['id'] in child_ids]
+        child_ids = dict.fromkeys(self.hierarchy[section_id])
+        children = [marker for child_id in child_ids for marker in self._markers_with_id.get(child_id, [])]
+        return sorted(children, key=lambda marker: marker['line'])
     
     def get_sections_by_type(self, section_type: str) -> List[Dict]:
         return [marker for marker in self.section_markers if marker['type'] == section_type]
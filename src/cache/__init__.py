@@ -1,3 +1,7 @@
 from .base_cache import BaseCache
+from .memmap_cache import MemmapCache
+from .vector_store import MemmapVectorStore
+from .query_cache import QueryEmbeddingCache
+from .answer_cache import SemanticAnswerCache
 
-__all__ = ["BaseCache"]
\ No newline at end of file
+__all__ = ["BaseCache", "MemmapCache", "MemmapVectorStore", "QueryEmbeddingCache", "SemanticAnswerCache"]
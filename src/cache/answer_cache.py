@@ -0,0 +1,170 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+import itertools
+import threading
+import time
+from typing import Any, Dict, FrozenSet, Hashable, Iterable, Optional, Tuple
+import numpy as np
+
+
+@dataclass
+class _AnswerEntry:
+    query_embedding: Optional[np.ndarray]
+    answer: Any
+    created_at: float
+
+
+class SemanticAnswerCache:
+    """
+    Cache odpowiedzi LLM dla pytań o tym samym znaczeniu i tych samych źródłach.
+
+    Odpowiedź z cache'u zwracana jest tylko wtedy, gdy:
+    - embedding pytania jest wystarczająco podobny (similarity_threshold),
+    - retriever znalazł dokładnie ten sam zbiór chunków,
+    - odpowiedź powstała w tym samym trybie (np. query / query_large_context),
+    - wpis nie jest starszy niż ttl_seconds.
+
+    Wpisy bez embeddingu pytania (query_embedding=None) pasują wyłącznie dokładnie -
+    tylko do zapytań bez embeddingu z tym samym trybem i zbiorem chunków.
+
+    Po każdej zmianie korpusu cache należy unieważnić (invalidate).
+    """
+
+    def __init__(self,
+                 similarity_threshold: float = 0.95,
+                 ttl_seconds: Optional[float] = 24 * 3600,
+                 max_size: int = 512):
+        """
+        Args:
+            similarity_threshold: Minimalne podobieństwo kosinusowe pytań
+            ttl_seconds: Czas życia wpisu w sekundach (None - bez limitu)
+            max_size: Maksymalna liczba odpowiedzi w cache'u (0 wyłącza cache)
+        """
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+        # (tryb, zbiór chunków) -> {id wpisu: wpis}; kolejność LRU trzyma _lru
+        self._groups: Dict[Tuple[Hashable, FrozenSet], Dict[int, _AnswerEntry]] = {}
+        self._lru: "OrderedDict[int, Tuple[Hashable, FrozenSet]]" = OrderedDict()
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+    @staticmethod
+    def evidence_key(chunk_keys: Iterable[Tuple[str, Any]]) -> FrozenSet:
+        """Zbiór identyfikatorów (doc_id, chunk_id) znalezionych chunków."""
+        return frozenset(chunk_keys)
+
+    def get(self, query_embedding: Optional[np.ndarray], evidence: FrozenSet,
+            mode: Hashable = None) -> Optional[Any]:
+        """
+        Zwraca zapamiętaną odpowiedź albo None.
+
+        Args:
+            query_embedding: Embedding pytania albo None (dopasowanie dokładne po trybie i zbiorze chunków)
+            evidence: Zbiór identyfikatorów chunków (patrz evidence_key)
+            mode: Tryb i parametry generacji, od których zależy odpowiedź
+        """
+        if self.max_size <= 0:
+            return None
+
+        query = self._normalize(query_embedding) if query_embedding is not None else None
+        now = time.time()
+        with self._lock:
+            group = self._groups.get((mode, evidence), {})
+            best_id, best_score = None, self.similarity_threshold
+            for entry_id, entry in list(group.items()):
+                if self._expired(entry, now):
+                    self._remove(entry_id)
+                    self.expirations += 1
+                    continue
+                if query is None or entry.query_embedding is None:
+                    score = 1.0 if query is None and entry.query_embedding is None else -1.0
+                else:
+                    score = float(entry.query_embedding @ query)
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+
+            if best_id is None:
+                self.misses += 1
+                return None
+
+            self._lru.move_to_end(best_id)
+            self.hits += 1
+            return group[best_id].answer
+
+    def put(self, query_embedding: Optional[np.ndarray], evidence: FrozenSet, answer: Any,
+            mode: Hashable = None, generation: Optional[int] = None) -> None:
+        """
+        Zapamiętuje odpowiedź.
+
+        Args:
+            generation: Wartość self.generation z chwili wyszukiwania. Jeśli korpus
+                zmienił się w trakcie generacji, odpowiedź nie jest zapisywana.
+        """
+        if self.max_size <= 0:
+            return
+
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+
+            entry_id = next(self._ids)
+            key = (mode, evidence)
+            self._groups.setdefault(key, {})[entry_id] = _AnswerEntry(
+                query_embedding=self._normalize(query_embedding) if query_embedding is not None else None,
+                answer=answer,
+                created_at=time.time()
+            )
+            self._lru[entry_id] = key
+
+            while len(self._lru) > self.max_size:
+                self._remove(next(iter(self._lru)))
+                self.evictions += 1
+
+    def invalidate(self) -> None:
+        """Usuwa wszystkie odpowiedzi - wywoływane po zmianie korpusu."""
+        with self._lock:
+            self._groups = {}
+            self._lru = OrderedDict()
+            self.generation += 1
+            self.invalidations += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._lru),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations
+        }
+
+    def _expired(self, entry: _AnswerEntry, now: float) -> bool:
+        return self.ttl_seconds is not None and now - entry.created_at > self.ttl_seconds
+
+    def _remove(self, entry_id: int) -> None:
+        key = self._lru.pop(entry_id)
+        group = self._groups[key]
+        del group[entry_id]
+        if not group:
+            del self._groups[key]
+
+    @staticmethod
+    def _normalize(embedding: np.ndarray) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm >= 1e-10 else vector
@@ -2,8 +2,10 @@ from abc import ABC, abstractmethod
 from pathlib import Path
 import hashlib
 import json
+import threading
 import numpy as np
-from typing import List, Tuple, Dict, Optional, Any
+from typing import List, Tuple, Dict, Optional, Any, Set
+from src.cache.metadata_log import ChunkMetadataLog
 from src.chunking import Chunk
 from src.embeddings import PolishLegalEmbedder
 from src.chunking.hierarchical_chunker import LegalChunk
@@ -13,92 +15,183 @@ class BaseCache(ABC):
         self.cache_dir = Path(cache_dir)
         self.cache_dir.mkdir(exist_ok=True)
         self.embeddings_dir = self.cache_dir / "embeddings"
-        self.embeddings_dir.mkdir(exist_ok=True)
         self.chunks_info_path = self.cache_dir / "chunks_info.json"
+        self._init_storage()
+
+        # Magazyn i dziennik mogą być używane z wątków potoku ingestii
+        self._lock = threading.RLock()
+
+        # Metadane chunków: dziennik JSON Lines z okresowymi checkpointami
+        self.metadata_log = ChunkMetadataLog(self.cache_dir)
+        self._persisted_keys: Optional[Set[Tuple[str, Any]]] = None
+        self.document_hashes: Dict[str, str] = {}
+        self._migrate_chunks_info()
 
     def _text_hash(self, text: str) -> str:
         return hashlib.md5(text.encode()).hexdigest()
 
+    # Magazyn embeddingów: jeden plik .npy na hash tekstu.
+    # Podklasy (np. MemmapCache) nadpisują poniższe metody.
+
+    def _init_storage(self) -> None:
+        self.embeddings_dir.mkdir(exist_ok=True)
+
+    def _load_embedding(self, text_hash: str) -> Optional[np.ndarray]:
+        """Zwraca embedding o danym hashu albo None, jeśli go nie ma lub jest uszkodzony."""
+        embedding_path = self.embeddings_dir / f"{text_hash}.npy"
+        if not embedding_path.exists():
+            return None
+        try:
+            return np.load(embedding_path)
+        except Exception as e:
+            print(f"Błąd odczytu {embedding_path}: {e}, regeneruję...")
+            return None
+
+    def _store_embeddings(self, text_hashes: List[str], embeddings: List[np.ndarray]) -> None:
+        """Zapisuje embeddingi, których jeszcze nie ma w magazynie."""
+        for text_hash, embedding in zip(text_hashes, embeddings):
+            np_path = self.embeddings_dir / f"{text_hash}.npy"
+            if not np_path.exists():
+                np.save(np_path, embedding)
+
+    def _clear_embeddings(self) -> None:
+        for file in self.embeddings_dir.glob("*.npy"):
+            file.unlink()
+
+    def _compact_embeddings(self, keep: Set[str]) -> int:
+        """Usuwa embeddingi o hashach spoza keep. Zwraca liczbę usuniętych."""
+        removed = 0
+        for file in self.embeddings_dir.glob("*.npy"):
+            if file.stem not in keep:
+                file.unlink()
+                removed += 1
+        return removed
+
     def get_embedding(self, text: str, embedder: PolishLegalEmbedder) -> np.ndarray:
         """Get embedding for text, using cache if available."""
         text_hash = self._text_hash(text)
-        embedding_path = self.embeddings_dir / f"{text_hash}.npy"
-
-        if embedding_path.exists():
-            try:
-                return np.load(embedding_path)
-            except Exception as e:
-                print(f"Błąd odczytu {embedding_path}: {e}, regeneruję...")
+        embedding = self._load_embedding(text_hash)
+        if embedding is not None:
+            return embedding
 
         print(f"Generating new embedding for text: {text[:50]}...")
         embedding = embedder.get_embedding(text)
-        np.save(embedding_path, embedding)
+        self._store_embeddings([text_hash], [embedding])
         return embedding
 
-    def save_cache(self, documents: List[LegalChunk], embeddings: List[np.ndarray]) -> None:
+    def get_embeddings(self, texts: List[str], embedder: PolishLegalEmbedder,
+                       batch_size: int = 32) -> List[np.ndarray]:
+        """
+        Zwraca embeddingi dla listy tekstów. Z cache'u brane są trafienia,
+        a wszystkie braki liczone są razem przez embedder.get_embeddings.
+
+        Args:
+            texts: Lista tekstów
+            embedder: Embedder używany dla braków w cache'u
+            batch_size: Rozmiar paczki przekazywany do embeddera
+
+        Returns:
+            Lista embeddingów o kształcie (1, d) w kolejności wejściowej
+        """
+        hashes = [self._text_hash(text) for text in texts]
+        found: Dict[str, np.ndarray] = {}
+        missing: Dict[str, str] = {}
+
+        with self._lock:
+            for text, text_hash in zip(texts, hashes):
+                if text_hash in found or text_hash in missing:
+                    continue
+                embedding = self._load_embedding(text_hash)
+                if embedding is not None:
+                    found[text_hash] = embedding
+                else:
+                    missing[text_hash] = text
+
+        if missing:
+            # Model liczy embeddingi bez blokady - w tym czasie inny wątek może zapisywać cache
+            print(f"Generating {len(missing)} new embeddings ({len(found)} cached)...")
+            new_embeddings = embedder.get_embeddings(list(missing.values()), batch_size=batch_size)
+            new_embeddings = [embedding.reshape(1, -1) for embedding in new_embeddings]
+            with self._lock:
+                self._store_embeddings(list(missing.keys()), new_embeddings)
+            found.update(zip(missing.keys(), new_embeddings))
+
+        return [found[text_hash] for text_hash in hashes]
+
+    def save_cache(self, documents: List[LegalChunk], embeddings: List[np.ndarray],
+                   document_hashes: Optional[Dict[str, str]] = None,
+                   retired: Optional[List[Tuple[str, Any]]] = None) -> None:
         """
         Zapisuje chunki i ich embeddingi w cache z pełnym kontekstem strukturalnym.
+
+        Do dziennika metadanych dopisywane są tylko chunki, których jeszcze w nim
+        nie ma, więc koszt zależy od liczby nowych chunków, a nie od rozmiaru korpusu.
+
+        Args:
+            documents: Chunki do zapisania
+            embeddings: Embeddingi chunków
+            document_hashes: Opcjonalny słownik {doc_id: hash treści dokumentu}
+            retired: Opcjonalne klucze (doc_id, chunk_id) chunków wycofywanych w tym
+                samym zapisie (rekordy "drop" trafiają do dziennika przed nowymi chunkami);
+                ich embeddingi zostają w magazynie
         """
-        existing_chunk_ids = set()
-        chunks_info = []
+        with self._lock:
+            persisted = self._get_persisted_keys()
 
-        # Wczytaj istniejące dane (jeśli są)
-        if self.chunks_info_path.exists():
-            try:
-                with self.chunks_info_path.open('r', encoding='utf-8') as f:
-                    existing_chunks = json.load(f)
-                    for chunk_data in existing_chunks:
-                        existing_chunk_ids.add(chunk_data['chunk_id'])
-                        chunks_info.append(chunk_data)
-            except Exception as e:
-                print(f"Error reading existing cache: {e}")
-                self.clear_cache()
-                chunks_info = []
+            retired_keys = [key for key in dict.fromkeys(retired or []) if key in persisted]
+            persisted.difference_update(retired_keys)
+            records = [{"op": "drop", "doc_id": doc_id, "chunk_id": chunk_id} for doc_id, chunk_id in retired_keys]
 
-        # Dodaj nowe
-        for chunk, embedding in zip(documents, embeddings):
-            if chunk.chunk_id in existing_chunk_ids:
-                continue  # Pomijamy duplikaty
+            new_keys = set()
+            new_hashes, new_embeddings = [], []
+            for chunk, embedding in zip(documents, embeddings):
+                key = (chunk.doc_id, chunk.chunk_id)
+                if key in persisted or key in new_keys:
+                    continue  # Pomijamy duplikaty
 
-            text_hash = self._text_hash(chunk.text)
-            np_path = self.embeddings_dir / f"{text_hash}.npy"
-            if not np_path.exists():
-                np.save(np_path, embedding)
+                text_hash = self._text_hash(chunk.text)
+                new_keys.add(key)
+                new_hashes.append(text_hash)
+                new_embeddings.append(embedding)
+                records.append(self._chunk_record(chunk, text_hash))
 
-            chunk_info = {
-                "text": chunk.text,
-                "doc_id": chunk.doc_id,
-                "chunk_id": chunk.chunk_id,
-                "embedding_hash": text_hash,
-                "section_type": chunk.section_type,
-                "section_id": chunk.section_id,
-                "line_start": chunk.line_start,
-                "line_end": chunk.line_end,
-                "context_path": chunk.context_path,
-            }
-            chunks_info.append(chunk_info)
+            document_hashes = document_hashes or {}
+            records.extend({"op": "doc", "doc_id": doc_id, "content_hash": content_hash}
+                           for doc_id, content_hash in document_hashes.items())
 
-        try:
-            with self.chunks_info_path.open('w', encoding='utf-8') as f:
-                json.dump(chunks_info, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"Error saving cache: {e}")
-            self.clear_cache()
+            if not records:
+                return
+
+            self._store_embeddings(new_hashes, new_embeddings)
+            try:
+                self.metadata_log.append(records)
+            except Exception as e:
+                print(f"Error saving cache: {e}")
+                persisted.update(retired_keys)
+                return
+            persisted.update(new_keys)
+            self.document_hashes.update(document_hashes)
+
+            if self.metadata_log.needs_compaction():
+                self.compact_metadata()
 
     def load_cache(self) -> Tuple[List[LegalChunk], List[np.ndarray]]:
         """
         Ładuje chunki i ich embeddingi z cache.
         """
-        if not self.chunks_info_path.exists():
+        if not self.metadata_log.exists():
+            self._persisted_keys = set()
+            self.document_hashes = {}
             return [], []
 
-        try:
-            with self.chunks_info_path.open('r', encoding='utf-8') as f:
-                chunks_data = json.load(f)
+        chunks_data, docs_data = self._replay(self.metadata_log.read())
+        self._persisted_keys = set(chunks_data.keys())
+        self.document_hashes = {doc_id: record["content_hash"] for doc_id, record in docs_data.items()}
 
-            documents = []
-            embeddings = []
-            for chunk_data in chunks_data:
+        documents = []
+        embeddings = []
+        for chunk_data in chunks_data.values():
+            try:
                 chunk = LegalChunk(
                     text=chunk_data['text'],
                     doc_id=chunk_data['doc_id'],
@@ -109,28 +202,142 @@ class BaseCache(ABC):
                     line_start=chunk_data.get('line_start', 0),
                     line_end=chunk_data.get('line_end', 0)
                 )
+            except KeyError as e:
+                print(f"Niekompletny rekord chunka, brak pola {e}, pomijam")
+                continue
 
-                embedding_path = self.embeddings_dir / f"{chunk_data['embedding_hash']}.npy"
-                if embedding_path.exists():
-                    try:
-                        embedding = np.load(embedding_path)
-                        documents.append(chunk)
-                        embeddings.append(embedding)
-                        print(f"Loaded cached chunk and embedding for doc_id: {chunk.doc_id}, chunk_id: {chunk.chunk_id}")
-                    except Exception as e:
-                        print(f"Nie można załadować embeddingu {embedding_path}: {e}")
-                else:
-                    print(f"Brak embeddingu: {embedding_path}, pomijam chunk {chunk.chunk_id}")
+            embedding = self._load_embedding(chunk_data['embedding_hash'])
+            if embedding is not None:
+                documents.append(chunk)
+                embeddings.append(embedding)
+            else:
+                print(f"Brak embeddingu {chunk_data['embedding_hash']}, pomijam chunk {chunk.chunk_id}")
 
-            return documents, embeddings
-        except Exception as e:
-            print(f"Error loading cache: {e}")
-            self.clear_cache()
-            return [], []
+        print(f"Loaded {len(documents)} cached chunks from {self.cache_dir}")
+        return documents, embeddings
+
+    def remove_document(self, doc_id: str) -> int:
+        """
+        Usuwa dokument z dziennika metadanych: rekordy "drop" dla jego chunków
+        i "drop_doc" dla hasha treści. Embeddingi zostają w magazynie do
+        kompaktowania (compact).
+
+        Returns:
+            Liczba wycofanych chunków
+        """
+        with self._lock:
+            persisted = self._get_persisted_keys()
+            retired = [key for key in persisted if key[0] == doc_id]
+            if not retired and doc_id not in self.document_hashes:
+                return 0
+
+            records = [{"op": "drop", "doc_id": key[0], "chunk_id": key[1]} for key in retired]
+            records.append({"op": "drop_doc", "doc_id": doc_id})
+            try:
+                self.metadata_log.append(records)
+            except Exception as e:
+                print(f"Error saving cache: {e}")
+                return 0
+            persisted.difference_update(retired)
+            self.document_hashes.pop(doc_id, None)
+
+            if self.metadata_log.needs_compaction():
+                self.compact_metadata()
+            return len(retired)
+
+    def compact(self) -> Dict[str, int]:
+        """
+        Przepisuje dziennik metadanych do checkpointu i usuwa z magazynu embeddingi,
+        do których nie odwołuje się już żaden chunk (usunięte i zastąpione wersje).
+
+        Returns:
+            Słownik {chunks: liczba chunków, removed_embeddings: liczba usuniętych embeddingów}
+        """
+        with self._lock:
+            chunks_data, docs_data = self._replay(self.metadata_log.read())
+            self.metadata_log.checkpoint(list(docs_data.values()) + list(chunks_data.values()))
+            self._persisted_keys = set(chunks_data.keys())
+            keep = {record["embedding_hash"] for record in chunks_data.values() if "embedding_hash" in record}
+            removed = self._compact_embeddings(keep)
+        return {"chunks": len(chunks_data), "removed_embeddings": removed}
+
+    def compact_metadata(self) -> None:
+        """Przepisuje aktualny stan dziennika do nowego checkpointu."""
+        chunks_data, docs_data = self._replay(self.metadata_log.read())
+        self.metadata_log.checkpoint(list(docs_data.values()) + list(chunks_data.values()))
+        self._persisted_keys = set(chunks_data.keys())
 
     def clear_cache(self) -> None:
         print("Clearing cache...")
+        self.metadata_log.clear()
         if self.chunks_info_path.exists():
             self.chunks_info_path.unlink()
-        for file in self.embeddings_dir.glob("*.npy"):
-            file.unlink()
+        self._persisted_keys = set()
+        self.document_hashes = {}
+        self._clear_embeddings()
+
+    def _get_persisted_keys(self) -> Set[Tuple[str, Any]]:
+        if self._persisted_keys is None:
+            self._persisted_keys = set(self._replay(self.metadata_log.read())[0].keys())
+        return self._persisted_keys
+
+    def _chunk_record(self, chunk: Chunk, text_hash: str) -> Dict[str, Any]:
+        return {
+            "op": "add",
+            "text": chunk.text,
+            "doc_id": chunk.doc_id,
+            "chunk_id": chunk.chunk_id,
+            "embedding_hash": text_hash,
+            "section_type": getattr(chunk, 'section_type', ''),
+            "section_id": getattr(chunk, 'section_id', ''),
+            "line_start": getattr(chunk, 'line_start', 0),
+            "line_end": getattr(chunk, 'line_end', 0),
+            "context_path": getattr(chunk, 'context_path', []),
+        }
+
+    def _replay(self, records: List[Dict[str, Any]]) -> Tuple[Dict[Tuple[str, Any], Dict[str, Any]],
+                                                               Dict[str, Dict[str, Any]]]:
+        """
+        Odtwarza stan z rekordów dziennika. Klucz (doc_id, chunk_id) sprawia,
+        że powtórzone rekordy (np. po przerwanym kompaktowaniu) są nieszkodliwe.
+
+        Returns:
+            Krotka (rekordy chunków według (doc_id, chunk_id), rekordy dokumentów według doc_id)
+        """
+        chunks_data: Dict[Tuple[str, Any], Dict[str, Any]] = {}
+        docs_data: Dict[str, Dict[str, Any]] = {}
+        for record in records:
+            op = record.get("op", "add")
+            if "doc_id" not in record:
+                continue
+            if op == "add":
+                chunks_data[(record["doc_id"], record.get("chunk_id"))] = record
+            elif op == "drop":
+                chunks_data.pop((record["doc_id"], record.get("chunk_id")), None)
+            elif op == "doc":
+                docs_data[record["doc_id"]] = record
+            elif op == "drop_doc":
+                docs_data.pop(record["doc_id"], None)
+        return chunks_data, docs_data
+
+    def _migrate_chunks_info(self) -> None:
+        """Jednorazowo przenosi stary chunks_info.json do dziennika metadanych."""
+        if not self.chunks_info_path.exists() or self.metadata_log.exists():
+            return
+
+        try:
+            with self.chunks_info_path.open('r', encoding='utf-8') as f:
+                chunks_data = json.load(f)
+        except Exception as e:
+            print(f"Nie można przenieść {self.chunks_info_path}: {e}")
+            return
+
+        records = [{"op": "add", **chunk_data} for chunk_data in chunks_data]
+        self.metadata_log.checkpoint(list(self._replay(records)[0].values()))
+        self.chunks_info_path.unlink()
+        print(f"Przeniesiono {len(records)} chunków z {self.chunks_info_path} do {self.metadata_log.checkpoint_path}")
+
+    def get_cache_size(self) -> float:
+        """Zwraca łączny rozmiar plików cache'u w MB."""
+        total = sum(f.stat().st_size for f in self.cache_dir.rglob("*") if f.is_file())
+        return total / (1024 * 1024)
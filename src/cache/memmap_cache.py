@@ -0,0 +1,40 @@
+import numpy as np
+from typing import List, Optional, Set
+from src.cache.base_cache import BaseCache
+from src.cache.vector_store import MemmapVectorStore
+
+class MemmapCache(BaseCache):
+    """
+    Cache z embeddingami w jednym pliku mapowanym do pamięci (MemmapVectorStore)
+    zamiast osobnego pliku .npy dla każdego chunka.
+
+    Start sprowadza się do zmapowania pliku - load_cache zwraca widoki na wiersze
+    macierzy, bez czytania pojedynczych wektorów. Przy pierwszym otwarciu
+    istniejący katalog embeddings/ jest jednorazowo przenoszony do magazynu.
+    """
+
+    def __init__(self, cache_dir: str = "cache", vector_dtype: str = "float32"):
+        """
+        Args:
+            cache_dir: Katalog cache'u
+            vector_dtype: Typ zapisu embeddingów nowego magazynu ("float32" albo "float16")
+        """
+        self.vector_dtype = vector_dtype
+        super().__init__(cache_dir)
+
+    def _init_storage(self) -> None:
+        self.store = MemmapVectorStore(self.cache_dir / "vectors", dtype=self.vector_dtype)
+        if self.embeddings_dir.is_dir() and any(self.embeddings_dir.glob("*.npy")):
+            self.store.migrate_from_directory(self.embeddings_dir)
+
+    def _load_embedding(self, text_hash: str) -> Optional[np.ndarray]:
+        return self.store.get(text_hash)
+
+    def _store_embeddings(self, text_hashes: List[str], embeddings: List[np.ndarray]) -> None:
+        self.store.add(text_hashes, embeddings)
+
+    def _clear_embeddings(self) -> None:
+        self.store.clear()
+
+    def _compact_embeddings(self, keep: Set[str]) -> int:
+        return self.store.compact(keep)
@@ -0,0 +1,118 @@
+from pathlib import Path
+import json
+import os
+from typing import Any, Dict, Iterable, List
+
+
+class ChunkMetadataLog:
+    """
+    Dziennik metadanych chunków w formacie JSON Lines, tylko do dopisywania.
+
+    Stan = checkpoint (chunks_checkpoint.jsonl) + rekordy dopisane po nim
+    (chunks_log.jsonl). Dodanie dokumentu dopisuje tylko jego rekordy, a
+    kompaktowanie przepisuje stan do nowego checkpointu przez atomowe
+    os.replace. Przerwany zapis psuje co najwyżej ostatnią linię dziennika,
+    która jest obcinana przy otwarciu.
+    """
+
+    def __init__(self, cache_dir: Path, compact_min_records: int = 1000):
+        self.cache_dir = Path(cache_dir)
+        self.checkpoint_path = self.cache_dir / "chunks_checkpoint.jsonl"
+        self.log_path = self.cache_dir / "chunks_log.jsonl"
+        self.compact_min_records = compact_min_records
+        self.checkpoint_records = self._count_lines(self.checkpoint_path)
+        self.log_records = 0
+        self._repair_log()
+
+    def exists(self) -> bool:
+        return self.checkpoint_path.exists() or self.log_path.exists()
+
+    def read(self) -> List[Dict[str, Any]]:
+        """Zwraca wszystkie rekordy: najpierw z checkpointu, potem z dziennika."""
+        return self._read_file(self.checkpoint_path) + self._read_file(self.log_path)
+
+    def append(self, records: Iterable[Dict[str, Any]]) -> int:
+        """
+        Dopisuje rekordy na koniec dziennika i wymusza ich zapis na dysk.
+
+        Returns:
+            Liczba dopisanych rekordów
+        """
+        lines = [json.dumps(record, ensure_ascii=False) + "\n" for record in records]
+        if not lines:
+            return 0
+
+        with self.log_path.open('a', encoding='utf-8') as f:
+            f.write("".join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.log_records += len(lines)
+        return len(lines)
+
+    def needs_compaction(self) -> bool:
+        """Kompaktujemy, gdy dziennik urósł do rozmiaru checkpointu (koszt zamortyzowany O(1) na rekord)."""
+        return self.log_records >= max(self.compact_min_records, self.checkpoint_records)
+
+    def checkpoint(self, records: List[Dict[str, Any]]) -> None:
+        """
+        Zapisuje pełny stan jako nowy checkpoint i czyści dziennik.
+
+        Checkpoint trafia najpierw do pliku tymczasowego i jest podmieniany
+        atomowo. Jeśli proces przerwie się przed usunięciem dziennika,
+        rekordy zostaną odtworzone dwa razy - odtwarzanie stanu musi być
+        idempotentne.
+        """
+        tmp_path = self.checkpoint_path.with_suffix(".tmp")
+        with tmp_path.open('w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+        if self.log_path.exists():
+            self.log_path.unlink()
+        self.checkpoint_records = len(records)
+        self.log_records = 0
+
+    def clear(self) -> None:
+        for path in (self.checkpoint_path, self.log_path, self.checkpoint_path.with_suffix(".tmp")):
+            if path.exists():
+                path.unlink()
+        self.checkpoint_records = 0
+        self.log_records = 0
+
+    def _repair_log(self) -> None:
+        """Obcina niedokończoną ostatnią linię dziennika (przerwany zapis)."""
+        if not self.log_path.exists():
+            return
+
+        with self.log_path.open('rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+                print(f"Obcięto niedokończony rekord w {self.log_path}")
+        self.log_records = self._count_lines(self.log_path)
+
+    def _read_file(self, path: Path) -> List[Dict[str, Any]]:
+        records = []
+        if not path.exists():
+            return records
+
+        with path.open('r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError as e:
+                    print(f"Pomijam uszkodzony rekord {path}:{line_no}: {e}")
+        return records
+
+    @staticmethod
+    def _count_lines(path: Path) -> int:
+        if not path.exists():
+            return 0
+        with path.open('rb') as f:
+            return sum(1 for _ in f)
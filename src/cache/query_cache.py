@@ -0,0 +1,169 @@
+from collections import OrderedDict
+from pathlib import Path
+import hashlib
+import threading
+import unicodedata
+from typing import Any, Callable, Dict, List, Optional
+import numpy as np
+
+from src.cache.vector_store import MemmapVectorStore
+
+
+class QueryEmbeddingCache:
+    """
+    Cache LRU embeddingów zapytań, kluczowany nazwą modelu i znormalizowanym tekstem.
+
+    Powtórzone pytanie nie wymaga ponownego przejścia przez model. Opcjonalnie
+    wpisy trafiają do MemmapVectorStore w store_dir, więc cache przetrwa restart;
+    magazyn jest przepisywany, gdy urośnie ponad dwukrotność max_size.
+
+    Magazyn zna tylko kolejność dodania, dlatego trafienia dopisywane są do
+    dziennika recency.log - po restarcie wczytywane są ostatnio używane wpisy,
+    a nie ostatnio dodane. Dziennik jest zerowany przy przepisaniu magazynu
+    (w kolejności LRU).
+    """
+
+    RECENCY_LINE_LENGTH = 33  # hash md5 i znak nowej linii
+
+    def __init__(self, max_size: int = 1024, store_dir: Optional[Path] = None):
+        """
+        Args:
+            max_size: Maksymalna liczba embeddingów w pamięci (0 wyłącza cache)
+            store_dir: Opcjonalny katalog do zapisu embeddingów na dysku
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.store: Optional[MemmapVectorStore] = None
+        self._recency_path: Optional[Path] = None
+        self._recency_records = 0
+        if store_dir is not None and max_size > 0:
+            self.store = MemmapVectorStore(store_dir)
+            self._recency_path = Path(store_dir) / "recency.log"
+            # Ostatnio używane wpisy są na końcu
+            for key in self._stored_keys_by_recency()[-max_size:]:
+                self._entries[key] = np.array(self.store.get(key))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        """Ujednolica zapis zapytania: normalizacja Unicode (NFC) i pojedyncze spacje."""
+        return " ".join(unicodedata.normalize("NFC", query).split())
+
+    @staticmethod
+    def make_key(model_name: str, normalized_query: str) -> str:
+        return hashlib.md5(f"{model_name}\x00{normalized_query}".encode()).hexdigest()
+
+    def get_or_compute(self, query: str, model_name: str,
+                       compute: Callable[[str], np.ndarray]) -> np.ndarray:
+        """
+        Zwraca embedding zapytania z cache'u albo liczy go funkcją compute.
+
+        Args:
+            query: Tekst zapytania
+            model_name: Nazwa modelu embeddera (część klucza)
+            compute: Funkcja liczona dla znormalizowanego zapytania przy braku w cache'u
+
+        Returns:
+            Embedding zapytania
+        """
+        normalized = self.normalize(query)
+        if self.max_size <= 0:
+            return compute(normalized)
+
+        key = self.make_key(model_name, normalized)
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self._touch(key)
+                return embedding
+            self.misses += 1
+
+        # Model liczy embedding poza blokadą
+        embedding = np.asarray(compute(normalized), dtype=np.float32)
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._persist(key, embedding)
+        return embedding
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            if self.store is not None:
+                self.store.clear()
+                self._reset_recency()
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "persistent": self.store is not None
+        }
+
+    def _persist(self, key: str, embedding: np.ndarray) -> None:
+        if self.store is None:
+            return
+        try:
+            if len(self.store) >= 2 * self.max_size:
+                self._rewrite_store()
+            else:
+                self.store.add([key], [embedding])
+        except Exception as e:
+            print(f"Nie można zapisać embeddingu zapytania: {e}")
+
+    def _touch(self, key: str) -> None:
+        """Dopisuje trafienie do dziennika recency.log (wywoływane pod blokadą)."""
+        if self.store is None:
+            return
+        try:
+            if self._recency_records >= 2 * self.max_size:
+                self._rewrite_store()
+                return
+            with self._recency_path.open('a', encoding='ascii') as f:
+                f.write(key + "\n")
+            self._recency_records += 1
+        except Exception as e:
+            print(f"Nie można zapisać użycia embeddingu zapytania: {e}")
+
+    def _rewrite_store(self) -> None:
+        """Przepisuje magazyn, zostawiając tylko wpisy z pamięci (w kolejności LRU)."""
+        self.store.clear()
+        self.store.add(list(self._entries.keys()), list(self._entries.values()))
+        self._reset_recency()
+
+    def _reset_recency(self) -> None:
+        if self._recency_path.exists():
+            self._recency_path.unlink()
+        self._recency_records = 0
+
+    def _stored_keys_by_recency(self) -> List[str]:
+        """Klucze magazynu od najdawniej do ostatnio użytego (kolejność dodania poprawiona trafieniami)."""
+        order = dict.fromkeys(self.store.hashes)
+        if self._recency_path.exists():
+            with self._recency_path.open('r', encoding='ascii') as f:
+                for line in f:
+                    # Ucięta ostatnia linia oznacza przerwany zapis - pomijamy ją
+                    if len(line) != self.RECENCY_LINE_LENGTH or not line.endswith("\n"):
+                        break
+                    self._recency_records += 1
+                    key = line[:-1]
+                    if key in order:
+                        del order[key]
+                        order[key] = None
+        return list(order)
@@ -0,0 +1,269 @@
+from pathlib import Path
+import json
+import os
+import shutil
+import numpy as np
+from typing import Dict, Iterable, List, Optional
+
+
+class MemmapVectorStore:
+    """
+    Magazyn embeddingów w jednym pliku: macierz float32 (albo float16)
+    dopisywana na końcu i mapowana do pamięci przez np.memmap.
+
+    Pliki w katalogu magazynu:
+    - vectors.f32 / vectors.f16 - surowe wiersze (count x dim)
+    - vectors.hashes - hash tekstu dla każdego wiersza, jeden na linię
+    - vectors.meta.json - wymiar i typ wektorów
+
+    Hash w linii i odpowiada wierszowi i macierzy, więc indeks hash -> wiersz
+    odtwarzany jest przy starcie z jednego małego pliku, bez czytania wektorów.
+
+    Kompaktowanie zapisuje nowy magazyn w katalogu obok (<katalog>.compact)
+    i podmienia katalogi przez <katalog>.old; przy starcie niedokończona
+    podmiana jest wycofywana.
+    """
+
+    COMPACT_BLOCK_ROWS = 65536
+
+    HASH_LINE_LENGTH = 33  # 32 znaki md5 + znak nowej linii
+    FILE_SUFFIXES = {"float32": "f32", "float16": "f16"}
+
+    def __init__(self, store_dir: Path, dtype: str = "float32"):
+        """
+        Args:
+            store_dir: Katalog magazynu
+            dtype: Typ zapisu nowego magazynu: "float32" albo "float16" (o połowę mniej
+                miejsca na dysku); istniejący magazyn zachowuje typ zapisany w metadanych
+        """
+        if dtype not in self.FILE_SUFFIXES:
+            raise ValueError(f"Nieobsługiwany typ wektorów: {dtype}")
+        self.store_dir = Path(store_dir)
+        self._recover_compaction()
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        self.hashes_path = self.store_dir / "vectors.hashes"
+        self.meta_path = self.store_dir / "vectors.meta.json"
+
+        self.dim: Optional[int] = None
+        self.dtype = dtype
+        self._rows: Dict[str, int] = {}
+        self._hashes: List[str] = []
+        self._matrix: Optional[np.memmap] = None
+        self._open()
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def __contains__(self, text_hash: str) -> bool:
+        return text_hash in self._rows
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """Cała macierz wektorów (memmap, tylko do odczytu)."""
+        if self._matrix is None:
+            return np.empty((0, self.dim or 0), dtype=self.dtype)
+        return self._matrix
+
+    @property
+    def hashes(self) -> List[str]:
+        return self._hashes
+
+    def row_of(self, text_hash: str) -> Optional[int]:
+        return self._rows.get(text_hash)
+
+    def get(self, text_hash: str) -> Optional[np.ndarray]:
+        """Zwraca widok (1, dim) na wiersz o danym hashu, bez kopiowania."""
+        row = self._rows.get(text_hash)
+        if row is None:
+            return None
+        return self._matrix[row:row + 1]
+
+    def add(self, text_hashes: List[str], embeddings: List[np.ndarray]) -> int:
+        """
+        Dopisuje na koniec wektory, których jeszcze nie ma w magazynie.
+
+        Najpierw zapisywane są wektory, dopiero potem hashe - przerwany zapis
+        zostawia co najwyżej nieopisane wiersze, które są obcinane przy starcie.
+
+        Returns:
+            Liczba dopisanych wektorów
+        """
+        new_hashes, new_vectors = [], []
+        pending = set()
+        for text_hash, embedding in zip(text_hashes, embeddings):
+            if text_hash in self._rows or text_hash in pending:
+                continue
+            pending.add(text_hash)
+            new_hashes.append(text_hash)
+            new_vectors.append(np.asarray(embedding, dtype=self.dtype).reshape(-1))
+
+        if not new_hashes:
+            return 0
+
+        block = np.vstack(new_vectors)
+        if self.dim is None:
+            self.dim = block.shape[1]
+            self._write_meta()
+        elif block.shape[1] != self.dim:
+            raise ValueError(f"Wektory muszą mieć wymiar {self.dim}, otrzymano: {block.shape[1]}")
+
+        with self.vectors_path.open('ab') as f:
+            f.write(np.ascontiguousarray(block).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        with self.hashes_path.open('a', encoding='ascii') as f:
+            f.write("".join(f"{text_hash}\n" for text_hash in new_hashes))
+            f.flush()
+            os.fsync(f.fileno())
+
+        for text_hash in new_hashes:
+            self._rows[text_hash] = len(self._hashes)
+            self._hashes.append(text_hash)
+        self._remap()
+        return len(new_hashes)
+
+    def clear(self) -> None:
+        """Usuwa wszystkie wektory i pliki magazynu."""
+        self._matrix = None
+        for path in (self.vectors_path, self.hashes_path, self.meta_path):
+            if path.exists():
+                path.unlink()
+        self.dim = None
+        self._rows = {}
+        self._hashes = []
+
+    def compact(self, keep: Iterable[str]) -> int:
+        """
+        Przepisuje magazyn, zostawiając tylko wektory o hashach z keep
+        (w dotychczasowej kolejności).
+
+        Widoki zwrócone wcześniej przez get wskazują na stary plik - po
+        kompaktowaniu trzeba je pobrać ponownie.
+
+        Returns:
+            Liczba usuniętych wektorów
+        """
+        keep = set(keep)
+        rows = [row for row, text_hash in enumerate(self._hashes) if text_hash in keep]
+        removed = len(self._hashes) - len(rows)
+        if removed == 0:
+            return 0
+
+        compact_dir = self.store_dir.with_name(self.store_dir.name + ".compact")
+        old_dir = self.store_dir.with_name(self.store_dir.name + ".old")
+        shutil.rmtree(compact_dir, ignore_errors=True)
+        compacted = MemmapVectorStore(compact_dir, dtype=self.dtype)
+        compacted.dim = self.dim
+        compacted._write_meta()
+        for start in range(0, len(rows), self.COMPACT_BLOCK_ROWS):
+            block = rows[start:start + self.COMPACT_BLOCK_ROWS]
+            compacted.add([self._hashes[row] for row in block], list(self._matrix[block]))
+        compacted._matrix = None
+
+        # Nowy katalog jest kompletny - podmieniamy go ze starym
+        self._matrix = None
+        shutil.rmtree(old_dir, ignore_errors=True)
+        os.replace(self.store_dir, old_dir)
+        os.replace(compact_dir, self.store_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+        self._open()
+        return removed
+
+    def migrate_from_directory(self, embeddings_dir: Path, remove_source: bool = True) -> int:
+        """
+        Jednorazowa migracja ze starego układu: jeden plik .npy na hash.
+
+        Args:
+            embeddings_dir: Katalog z plikami <hash>.npy
+            remove_source: Czy usunąć przeniesione pliki .npy
+
+        Returns:
+            Liczba przeniesionych wektorów
+        """
+        embeddings_dir = Path(embeddings_dir)
+        if not embeddings_dir.is_dir():
+            return 0
+
+        paths = sorted(embeddings_dir.glob("*.npy"))
+        hashes, vectors, migrated = [], [], []
+        for path in paths:
+            try:
+                vectors.append(np.load(path))
+                hashes.append(path.stem)
+                migrated.append(path)
+            except Exception as e:
+                print(f"Nie można przenieść embeddingu {path}: {e}")
+
+        added = self.add(hashes, vectors)
+
+        if remove_source:
+            for path in migrated:
+                path.unlink()
+            if not any(embeddings_dir.iterdir()):
+                embeddings_dir.rmdir()
+
+        print(f"Przeniesiono {added} embeddingów z {embeddings_dir} do {self.vectors_path}")
+        return added
+
+    @property
+    def vectors_path(self) -> Path:
+        return self.store_dir / f"vectors.{self.FILE_SUFFIXES[self.dtype]}"
+
+    def _recover_compaction(self) -> None:
+        compact_dir = self.store_dir.with_name(self.store_dir.name + ".compact")
+        old_dir = self.store_dir.with_name(self.store_dir.name + ".old")
+        # Przerwana podmiana: stary katalog jest kompletny i zgodny z metadanymi
+        if old_dir.is_dir() and not self.store_dir.exists():
+            os.replace(old_dir, self.store_dir)
+        for leftover in (compact_dir, old_dir):
+            if leftover.is_dir():
+                shutil.rmtree(leftover, ignore_errors=True)
+
+    def _open(self) -> None:
+        if self.meta_path.exists():
+            with self.meta_path.open('r', encoding='utf-8') as f:
+                meta = json.load(f)
+            self.dim = meta.get('dim')
+            self.dtype = meta.get('dtype', 'float32')
+
+        hashes = []
+        if self.hashes_path.exists():
+            with self.hashes_path.open('r', encoding='ascii') as f:
+                for line in f:
+                    # Ucięta ostatnia linia oznacza przerwany zapis - pomijamy ją
+                    if len(line) != self.HASH_LINE_LENGTH or not line.endswith("\n"):
+                        break
+                    hashes.append(line[:-1])
+
+        row_bytes = np.dtype(self.dtype).itemsize * (self.dim or 0)
+        stored_rows = self.vectors_path.stat().st_size // row_bytes if row_bytes and self.vectors_path.exists() else 0
+        count = min(len(hashes), stored_rows)
+
+        # Obcinamy wiersze i hashe bez pary (przerwany zapis)
+        if self.vectors_path.exists() and row_bytes:
+            if self.vectors_path.stat().st_size != count * row_bytes:
+                with self.vectors_path.open('r+b') as f:
+                    f.truncate(count * row_bytes)
+        if len(hashes) != count or (self.hashes_path.exists()
+                                    and self.hashes_path.stat().st_size != count * self.HASH_LINE_LENGTH):
+            with self.hashes_path.open('r+b') as f:
+                f.truncate(count * self.HASH_LINE_LENGTH)
+
+        self._hashes = hashes[:count]
+        self._rows = {text_hash: row for row, text_hash in enumerate(self._hashes)}
+        self._remap()
+
+    def _remap(self) -> None:
+        if not self._hashes:
+            self._matrix = None
+            return
+        self._matrix = np.memmap(self.vectors_path, dtype=self.dtype, mode='r',
+                                 shape=(len(self._hashes), self.dim))
+
+    def _write_meta(self) -> None:
+        tmp_path = self.meta_path.with_suffix(".tmp")
+        with tmp_path.open('w', encoding='utf-8') as f:
+            json.dump({"dim": self.dim, "dtype": self.dtype}, f)
+        os.replace(tmp_path, self.meta_path)
@@ -1,6 +1,9 @@
 from dataclasses import dataclass
 from typing import List, Dict, Optional, Set, Tuple
+import atexit
+import queue
 import re
+import threading
 from pathlib import Path
 from collections import defaultdict
 
@@ -69,19 +72,50 @@ class HierarchicalLegalChunker:
     """
     Ulepszony chunker tekstu prawnego oparty na hierarchii dokumentu.
     Zapewnia inteligentny podział na chunki z zachowaniem pełnego kontekstu strukturalnego.
+    
+    Zapis chunków do plików (do debugowania) jest domyślnie wyłączony. Po
+    włączeniu pliki zapisuje wątek w tle, więc split_text nie wykonuje
+    operacji na dysku; flush() czeka na zapis zleconych plików. Każdy proces
+    (np. w puli chunkowania) ma własny wątek zapisu.
     """
     
-    def __init__(self, text_analyzer=None):
+    def __init__(self, text_analyzer=None, dump_chunks: bool = False, chunks_dir: str = "chunks"):
         """
         Inicjalizuje chunker.
         
         Args:
             text_analyzer: Ignorowany parametr dla kompatybilności ze starym API
+            dump_chunks: Czy zapisywać chunki do plików .txt (w tle)
+            chunks_dir: Katalog na pliki chunków (tworzony przy pierwszym zapisie)
         """
-        self.chunks_dir = Path("chunks")
-        self.chunks_dir.mkdir(exist_ok=True)
+        self.dump_chunks = dump_chunks
+        self.chunks_dir = Path(chunks_dir)
+        self._init_writer()
+    
+    def __getstate__(self):
+        # Wątek i kolejka nie są serializowalne - proces roboczy tworzy własne
+        state = self.__dict__.copy()
+        for key in ('_writer', '_write_queue', '_writer_lock'):
+            state.pop(key, None)
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_writer()
+    
+    def flush(self) -> None:
+        """Czeka, aż wątek w tle zapisze wszystkie zlecone chunki."""
+        if self._writer is not None:
+            self._write_queue.join()
+    
+    def close(self) -> None:
+        """Zapisuje zaległe chunki i zatrzymuje wątek zapisu."""
+        with self._writer_lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            self._write_queue.put(None)
+            writer.join()
     
-   
 
     def split_text(self, text: str, doc_id: str = "") -> List[LegalChunk]:
         """
@@ -153,11 +187,38 @@ class HierarchicalLegalChunker:
                 chunks.append(chunk)
                 chunk_id += 1
         
-        # Opcjonalne: Zapisujemy chunki do plików 
-        self._save_chunks_to_files(chunks)
+        # Opcjonalne: zlecamy zapis chunków do plików wątkowi w tle
+        if self.dump_chunks:
+            self._enqueue_dump(chunks)
         
         return chunks
     
+    def _init_writer(self) -> None:
+        self._writer: Optional[threading.Thread] = None
+        self._write_queue: queue.Queue = queue.Queue()
+        self._writer_lock = threading.Lock()
+    
+    def _enqueue_dump(self, chunks: List[LegalChunk]) -> None:
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="chunk-dump", daemon=True)
+                self._writer.start()
+                atexit.register(self.close)
+        self._write_queue.put(list(chunks))
+    
+    def _write_loop(self) -> None:
+        while True:
+            chunks = self._write_queue.get()
+            try:
+                if chunks is None:
+                    return
+                self.chunks_dir.mkdir(parents=True, exist_ok=True)
+                self._save_chunks_to_files(chunks)
+            except OSError as e:
+                print(f"Błąd zapisu chunków do {self.chunks_dir}: {e}")
+            finally:
+                self._write_queue.task_done()
+    
     def _save_chunks_to_files(self, chunks: List[LegalChunk]) -> None:
         """
         Zapisuje chunki do plików tekstowych.
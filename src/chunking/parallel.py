@@ -0,0 +1,70 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import multiprocessing
+import time
+from typing import Iterable, Iterator, List, Tuple
+
+from src.chunking.text_splitter import Chunk, SimpleTextSplitter
+
+# Moduł celowo nie importuje modeli - procesy robocze ładują tylko chunker.
+
+# Chunker procesu roboczego - przekazywany raz, przy starcie procesu
+_worker_chunker = None
+
+
+def _init_worker(chunker: SimpleTextSplitter) -> None:
+    global _worker_chunker
+    _worker_chunker = chunker
+
+
+def _split_in_worker(text: str, doc_id: str) -> Tuple[List[Chunk], float]:
+    start = time.perf_counter()
+    chunks = _worker_chunker.split_text(text, doc_id=doc_id)
+    return chunks, time.perf_counter() - start
+
+
+def chunk_documents(chunker: SimpleTextSplitter,
+                    documents: Iterable[Tuple[str, str]],
+                    num_workers: int = 1,
+                    max_in_flight: int = 4) -> Iterator[Tuple[str, str, List[Chunk], float]]:
+    """
+    Dzieli dokumenty na chunki w puli procesów, zachowując kolejność wejścia.
+
+    Pula startuje tylko wtedy, gdy num_workers > 1 i jest więcej niż jeden
+    dokument - pojedynczy dokument szybciej podzielić na miejscu.
+
+    Args:
+        chunker: Chunker (musi dać się zserializować)
+        documents: Pary (tekst, doc_id)
+        num_workers: Liczba procesów roboczych
+        max_in_flight: Liczba zadań w locie na proces (ogranicza zużycie pamięci)
+
+    Returns:
+        Iterator krotek (tekst, doc_id, chunki, czas chunkowania w sekundach)
+    """
+    documents = iter(documents)
+    head = list(itertools.islice(documents, 2))
+
+    if num_workers <= 1 or len(head) < 2:
+        for text, doc_id in itertools.chain(head, documents):
+            start = time.perf_counter()
+            chunks = chunker.split_text(text, doc_id=doc_id)
+            yield text, doc_id, chunks, time.perf_counter() - start
+        return
+
+    # "spawn" - procesy nie dziedziczą załadowanego modelu ani wątków rodzica
+    with ProcessPoolExecutor(max_workers=num_workers,
+                             mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker,
+                             initargs=(chunker,)) as executor:
+        in_flight = deque()
+        for text, doc_id in itertools.chain(head, documents):
+            in_flight.append((text, doc_id, executor.submit(_split_in_worker, text, doc_id)))
+            if len(in_flight) >= num_workers * max_in_flight:
+                text, doc_id, future = in_flight.popleft()
+                yield (text, doc_id, *future.result())
+
+        while in_flight:
+            text, doc_id, future = in_flight.popleft()
+            yield (text, doc_id, *future.result())
@@ -1,10 +1,13 @@
 import torch
 from transformers import AutoTokenizer, AutoModel
 import numpy as np
+from typing import List
 
 class PolishLegalEmbedder:
     def __init__(self, use_gpu: bool = False, model_name = "BAAI/bge-m3"):
         self.device = torch.device("cuda" if use_gpu and torch.cuda.is_available() else "cpu")
+        self.model_name = model_name
+        self.use_gpu = self.device.type == "cuda"
         print(f"Using device: {self.device}")
 
         self.tokenizer = AutoTokenizer.from_pretrained(model_name)
@@ -34,3 +37,42 @@ class PolishLegalEmbedder:
             embedding = self.mean_pooling(outputs, inputs['attention_mask'])
 
         return embedding.cpu().numpy()
+
+    def get_embeddings(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """
+        Oblicza embeddingi dla wielu tekstów w paczkach.
+
+        Teksty są sortowane według liczby tokenów, więc każda paczka jest
+        dopełniana tylko do długości najdłuższego tekstu w tej paczce.
+
+        Args:
+            texts: Lista tekstów
+            batch_size: Maksymalna liczba tekstów w jednym przebiegu modelu
+
+        Returns:
+            Macierz float32 o kształcie (len(texts), d) w kolejności wejściowej
+        """
+        embeddings = np.empty((len(texts), self.model.config.hidden_size), dtype=np.float32)
+        if not texts:
+            return embeddings
+
+        # Tokenizujemy raz, bez paddingu - długości wyznaczają kolejność paczek
+        encoded = self.tokenizer(texts, truncation=True, max_length=8192)
+        # Najdłuższe najpierw: ewentualny brak pamięci ujawni się od razu
+        order = sorted(range(len(texts)), key=lambda i: len(encoded['input_ids'][i]), reverse=True)
+
+        with torch.inference_mode():
+            for start in range(0, len(order), batch_size):
+                batch_idx = order[start:start + batch_size]
+                batch = self.tokenizer.pad(
+                    {key: [encoded[key][i] for i in batch_idx] for key in encoded.keys()},
+                    padding=True,
+                    return_tensors='pt'
+                )
+                batch = {k: v.to(self.device) for k, v in batch.items()}
+
+                outputs = self.model(**batch)
+                pooled = self.mean_pooling(outputs, batch['attention_mask'])
+                embeddings[batch_idx] = pooled.float().cpu().numpy()
+
+        return embeddings
@@ -1,7 +1,9 @@
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Iterator, Optional, Tuple, Union
 import time
-import os
 from src.chunking import Chunk
+from src.generation.clients import ClientPool, get_client_pool
+from src.generation.context_packer import ContextPacker, TokenCounter
+from src.generation.resilience import CircuitBreaker, CircuitOpenError, RetryPolicy, get_circuit_breaker
 from dotenv import load_dotenv
 import anthropic
 
@@ -11,7 +13,12 @@ class AnthropicGenerator:
                  max_context_length: int = 200000,
                  retry_attempts: int = 3,
                  retry_delay: int = 2,
-                 api_key: str = None):
+                 api_key: str = None,
+                 clients: ClientPool = None,
+                 retry_policy: RetryPolicy = None,
+                 circuit_breaker: CircuitBreaker = None,
+                 max_context_tokens: Optional[int] = None,
+                 tokenizer: Any = None):
         self.model = model_name
         self.api_key = api_key
         self.base_timeout = 30
@@ -22,27 +29,42 @@ class AnthropicGenerator:
         # Załaduj zmienne środowiskowe
         load_dotenv()
         
-        # Inicjalizacja klienta tylko w razie potrzeby
-        self._client = None
+        # Klienci tworzeni są raz na klucz API i współdzieleni (pula połączeń)
+        self.clients = clients if clients is not None else get_client_pool()
+        
+        # Wykładnicze ponawianie z jitterem i bezpiecznik wspólny dla całego API Anthropic
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy(
+            max_attempts=retry_attempts, base_delay=retry_delay
+        )
+        self.circuit_breaker = circuit_breaker if circuit_breaker is not None else get_circuit_breaker("anthropic")
+        
+        # Konteksty pakowane są w budżet tokenów (domyślnie ~4 znaki na token z max_context_length)
+        self.context_packer = ContextPacker(
+            TokenCounter(tokenizer),
+            max_tokens=max_context_tokens if max_context_tokens is not None else max_context_length // 4
+        )
 
     @property
     def client(self):
-        """Leniwa inicjalizacja klienta Anthropic"""
-        if self._client is None:
-            # Najpierw sprawdź bezpośredni klucz API
-            api_key = self.api_key
-            
-            # Jeśli nie istnieje, użyj zmiennej środowiskowej
-            if not api_key:
-                api_key = os.getenv('ANTHROPIC_API_KEY')
-                
-            # Utwórz klienta jeśli mamy klucz API
-            if api_key:
-                self._client = anthropic.Client(api_key=api_key)
-                
-        return self._client
+        """Współdzielony klient Anthropic (bezpośredni klucz API albo ANTHROPIC_API_KEY)"""
+        return self.clients.anthropic_client(self.api_key)
+
+    @property
+    def async_client(self):
+        """Współdzielony asynchroniczny klient Anthropic"""
+        return self.clients.async_anthropic_client(self.api_key)
+
+    @staticmethod
+    def is_retryable(error: BaseException) -> bool:
+        """Czy błąd API warto ponowić: timeout, błąd połączenia, 408/409/429 lub 5xx."""
+        if isinstance(error, (anthropic.APITimeoutError, anthropic.APIConnectionError)):
+            return True
+        if isinstance(error, anthropic.APIStatusError):
+            return error.status_code in (408, 409, 429) or error.status_code >= 500
+        return False
 
-    def generate(self, query: str, contexts: List[Chunk], max_tokens: int = 4000) -> Dict[str, Any]:
+    def generate(self, query: str, contexts: List[Chunk], max_tokens: int = 4000,
+                 stream: bool = False) -> Union[Dict[str, Any], Iterator[str]]:
         """
         Generuje odpowiedź na podstawie zapytania i dostarczonych kontekstów.
         
@@ -50,10 +72,15 @@ class AnthropicGenerator:
             query: Pytanie użytkownika
             contexts: Lista fragmentów dokumentów znalezionych przez retriever
             max_tokens: Maksymalna liczba tokenów w odpowiedzi
+            stream: Czy zwrócić iterator fragmentów tekstu (patrz generate_stream)
             
         Returns:
             Słownik zawierający wygenerowaną odpowiedź i metadane
+            albo iterator fragmentów odpowiedzi, gdy stream=True
         """
+        if stream:
+            return self.generate_stream(query, contexts, max_tokens)
+        
         # Sprawdź, czy możemy zainicjalizować klienta
         if not self.client:
             return {
@@ -107,6 +134,176 @@ class AnthropicGenerator:
         
         return result
     
+    async def agenerate(self, query: str, contexts: List[Chunk], max_tokens: int = 4000) -> Dict[str, Any]:
+        """
+        Asynchroniczna wersja generate - nie blokuje pętli zdarzeń na czas wywołania API.
+        
+        Args:
+            query: Pytanie użytkownika
+            contexts: Lista fragmentów dokumentów znalezionych przez retriever
+            max_tokens: Maksymalna liczba tokenów w odpowiedzi
+            
+        Returns:
+            Słownik zawierający wygenerowaną odpowiedź i metadane
+        """
+        if not self.async_client:
+            return {
+                "answer": "Brak klucza API Anthropic. Nie można wygenerować odpowiedzi.",
+                "sources": [],
+                "error": "Brak klucza API Anthropic",
+                "processing_time": 0
+            }
+        
+        system_prompt = self._format_system_prompt(contexts)
+        dynamic_timeout = self._calculate_dynamic_timeout(contexts, max_tokens)
+        prioritized_contexts = self._prioritize_contexts(contexts, query)
+        
+        result = {
+            "answer": "",
+            "sources": [],
+            "error": None,
+            "processing_time": 0
+        }
+        
+        start_time = time.time()
+        
+        try:
+            answer = await self.acomplete(
+                prompt=f"Odpowiedz na postawione pytanie zwięźle i merytorycznie: {query}",
+                system_prompt=system_prompt,
+                temperature=0,
+                max_tokens=max_tokens,
+                timeout=dynamic_timeout
+            )
+            
+            if answer:
+                if self._is_truncated_response(answer):
+                    continuation = (await self.acomplete(
+                        prompt=(f"Poprzednia odpowiedź została przerwana. Kontynuuj odpowiedź od miejsca: "
+                                f"{answer[-200:]}"),
+                        system_prompt=self._format_system_prompt(prioritized_contexts),
+                        temperature=0,
+                        max_tokens=2000,
+                        timeout=self.base_timeout * 2
+                    )).lstrip()
+                    if continuation:
+                        answer = f"{answer.rstrip('.')} {continuation}"
+                
+                result["answer"] = answer
+                result["sources"] = self._extract_sources_from_contexts(prioritized_contexts, answer)
+            else:
+                result["error"] = "Brak odpowiedzi z API Anthropic"
+                
+        except Exception as e:
+            result["error"] = f"Wystąpił błąd podczas generowania odpowiedzi: {str(e)}"
+            
+        result["processing_time"] = time.time() - start_time
+        
+        return result
+    
+    async def acomplete(self,
+                        prompt: str,
+                        system_prompt: str,
+                        temperature: float = 0,
+                        max_tokens: int = 4000,
+                        timeout: int = 30) -> str:
+        """
+        Asynchroniczne zapytanie do API Anthropic dla gotowego promptu (odpowiednik _call_anthropic).
+        
+        Returns:
+            Tekst odpowiedzi albo pusty ciąg, gdy wszystkie próby się nie powiodły
+        """
+        if not self.async_client:
+            print("Ostrzeżenie: Brak klucza API Anthropic. Generator zwróci pustą odpowiedź.")
+            return ""
+        
+        client = self.async_client
+        try:
+            message = await self.retry_policy.acall(
+                lambda: client.messages.create(
+                    model=self.model,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    system=system_prompt,
+                    messages=[
+                        {"role": "user", "content": prompt}
+                    ],
+                    timeout=timeout
+                ),
+                breaker=self.circuit_breaker,
+                retryable=self.is_retryable
+            )
+            return "".join([block.text for block in message.content if block.type == "text"])
+        except Exception as e:
+            print(f"Wyjątek podczas zapytania do Anthropic: {str(e)}")
+            return ""
+    
+    def generate_stream(self, query: str, contexts: List[Chunk], max_tokens: int = 4000) -> Iterator[str]:
+        """
+        Generuje odpowiedź strumieniowo - fragmenty tekstu zwracane są w miarę ich nadchodzenia.
+        
+        W odróżnieniu od generate nie dogenerowuje uciętej odpowiedzi.
+        
+        Args:
+            query: Pytanie użytkownika
+            contexts: Lista fragmentów dokumentów znalezionych przez retriever
+            max_tokens: Maksymalna liczba tokenów w odpowiedzi
+            
+        Returns:
+            Iterator fragmentów odpowiedzi
+            
+        Raises:
+            RuntimeError: Gdy brak klucza API lub wszystkie próby się nie powiodły
+        """
+        system_prompt = self._format_system_prompt(contexts)
+        yield from self.stream_completion(
+            prompt=f"Odpowiedz na postawione pytanie zwięźle i merytorycznie: {query}",
+            system_prompt=system_prompt,
+            temperature=0,
+            max_tokens=max_tokens,
+            timeout=self._calculate_dynamic_timeout(contexts, max_tokens)
+        )
+    
+    def stream_completion(self,
+                          prompt: str,
+                          system_prompt: str,
+                          temperature: float = 0,
+                          max_tokens: int = 4000,
+                          timeout: int = 30) -> Iterator[str]:
+        """
+        Strumieniuje odpowiedź API Anthropic dla gotowego promptu.
+        
+        Ponawiane są tylko próby, które nie zwróciły jeszcze żadnego tekstu -
+        przerwanego strumienia nie da się wznowić bez powtórzenia tekstu.
+        
+        Raises:
+            RuntimeError: Gdy brak klucza API lub wszystkie próby się nie powiodły
+        """
+        if not self.client:
+            raise RuntimeError("Brak klucza API Anthropic")
+        
+        def open_stream() -> Iterator[str]:
+            with self.client.messages.stream(
+                model=self.model,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                system=system_prompt,
+                messages=[
+                    {"role": "user", "content": prompt}
+                ],
+                timeout=timeout
+            ) as stream:
+                yield from stream.text_stream
+        
+        # Retry-After z odpowiedzi 429/529 uwzględnia RetryPolicy
+        try:
+            yield from self.retry_policy.stream(open_stream, breaker=self.circuit_breaker,
+                                                retryable=self.is_retryable)
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            raise RuntimeError(f"Błąd strumienia Anthropic: {str(e)}") from e
+    
     def _call_anthropic(self, 
                     prompt: str, 
                     system_prompt: str,
@@ -120,10 +317,10 @@ class AnthropicGenerator:
             print("Ostrzeżenie: Brak klucza API Anthropic. Generator zwróci pustą odpowiedź.")
             return ""
             
-        for attempt in range(self.retry_attempts):
-            try:
-                # Wywołanie API Anthropic za pomocą oficjalnego klienta
-                message = self.client.messages.create(
+        try:
+            # Wywołanie API Anthropic za pomocą oficjalnego klienta (ponawiane przez retry_policy)
+            message = self.retry_policy.call(
+                lambda: self.client.messages.create(
                     model=self.model,
                     max_tokens=max_tokens,
                     temperature=temperature,
@@ -132,29 +329,22 @@ class AnthropicGenerator:
                         {"role": "user", "content": prompt}
                     ],
                     timeout=timeout
-                )
-                
-                # Pobierz tekst z odpowiedzi
-                return "".join([block.text for block in message.content if block.type == "text"])
-                
-            except anthropic.APITimeoutError:
-                if attempt < self.retry_attempts - 1:
-                    time.sleep(self.retry_delay)
-                else:
-                    print(f"Timeout podczas zapytania do Anthropic API")
-                    return ""
-            except anthropic.APIError as e:
-                if attempt < self.retry_attempts - 1:
-                    time.sleep(self.retry_delay)
-                else:
-                    print(f"Błąd API Anthropic: {str(e)}")
-                    return ""
-            except Exception as e:
-                if attempt < self.retry_attempts - 1:
-                    time.sleep(self.retry_delay)
-                else:
-                    print(f"Wyjątek podczas zapytania do Anthropic: {str(e)}")
-                    return ""
+                ),
+                breaker=self.circuit_breaker,
+                retryable=self.is_retryable
+            )
+            
+            # Pobierz tekst z odpowiedzi
+            return "".join([block.text for block in message.content if block.type == "text"])
+            
+        except CircuitOpenError as e:
+            print(str(e))
+        except anthropic.APITimeoutError:
+            print(f"Timeout podczas zapytania do Anthropic API")
+        except anthropic.APIError as e:
+            print(f"Błąd API Anthropic: {str(e)}")
+        except Exception as e:
+            print(f"Wyjątek podczas zapytania do Anthropic: {str(e)}")
         
         return ""
 
@@ -193,57 +383,10 @@ class AnthropicGenerator:
 
     def _truncate_contexts(self, contexts: List[Chunk]) -> List[Chunk]:
         """
-        Inteligentne przycinanie kontekstów z uwzględnieniem ich ważności.
+        Wybiera konteksty mieszczące się w budżecie tokenów (patrz ContextPacker).
+        Przekazane chunki nie są modyfikowane.
         """
-        total_chars = sum(len(ctx.text) for ctx in contexts)
-        
-        if total_chars <= self.max_context_length:
-            return contexts
-            
-        # Sortuj konteksty według score, ale zachowaj różnorodność dokumentów
-        # Grupuj konteksty według doc_id
-        docs_groups = {}
-        for ctx in contexts:
-            doc_id = getattr(ctx, 'doc_id', 'unknown')
-            if doc_id not in docs_groups:
-                docs_groups[doc_id] = []
-            docs_groups[doc_id].append(ctx)
-        
-        # Wybierz po jednym najlepszym chunka z każdego dokumentu, 
-        # potem po drugim najlepszym itd.
-        selected_contexts = []
-        current_length = 0
-        
-        # Sortuj każdą grupę według score
-        for doc_id, ctx_group in docs_groups.items():
-            docs_groups[doc_id] = sorted(ctx_group, key=lambda x: getattr(x, 'score', 0), reverse=True)
-        
-        # Dodawaj po jednym najlepszym chunka z każdego dokumentu
-        i = 0
-        while current_length < self.max_context_length and any(docs_groups.values()):
-            for doc_id in list(docs_groups.keys()):
-                if docs_groups[doc_id]:
-                    ctx = docs_groups[doc_id].pop(0)
-                    # Sprawdź, czy zmieści się cały chunk
-                    if current_length + len(ctx.text) <= self.max_context_length:
-                        selected_contexts.append(ctx)
-                        current_length += len(ctx.text)
-                    else:
-                        # Przytnij tekst, aby zmieścił się w limicie
-                        truncated_text = ctx.text[:self.max_context_length - current_length]
-                        if len(truncated_text) > 100:  # Jeśli warto dodać
-                            ctx.text = truncated_text
-                            selected_contexts.append(ctx)
-                            current_length += len(truncated_text)
-                        break
-                if current_length >= self.max_context_length:
-                    break
-            i += 1
-            # Bezpiecznik
-            if i > 100:
-                break
-                
-        return selected_contexts
+        return self.context_packer.pack(contexts)
 
     def _calculate_dynamic_timeout(self, contexts: List[Chunk], max_tokens: int) -> int:
         """
@@ -251,9 +394,8 @@ class AnthropicGenerator:
         Claude może być szybszy niż Ollama, ale wciąż potrzebuje odpowiedniego timeoutu
         """
         # Szacuj, że generowanie 1000 tokenów zajmuje około 3 sekundy
-        context_size = sum(len(ctx.text) for ctx in contexts)
-        # Zakładamy, że średnio 4 znaki to 1 token
-        estimated_context_tokens = context_size / 4
+        # Liczby tokenów chunków są zapamiętywane w liczniku pakera
+        estimated_context_tokens = sum(self.context_packer.token_counter.count(ctx.text) for ctx in contexts)
         estimated_response_time = (estimated_context_tokens / 1000 * 1) + (max_tokens / 1000 * 3)
         
         # Minimum 10 sekund, maksimum 120 sekund
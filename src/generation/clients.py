@@ -0,0 +1,208 @@
+import asyncio
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import anthropic
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class ClientPool:
+    """
+    Współdzielone, utrzymujące połączenia klienty HTTP dla generatorów.
+
+    - requests.Session z pulą połączeń keep-alive (Ollama, wywołania synchroniczne),
+    - httpx.AsyncClient - jeden na pętlę zdarzeń (Ollama, wywołania asynchroniczne),
+    - klienty Anthropic (synchroniczny i asynchroniczny) tworzone raz na klucz API.
+
+    Statystyki ponownego użycia połączeń pochodzą z pul urllib3 sesji
+    (liczba żądań względem liczby otwartych połączeń).
+
+    Klienty asynchroniczne należą do pętli, w której powstały. Właściciel
+    pętli powinien wywołać `await pool.aclose()` przed jej zamknięciem (np. na
+    końcu funkcji przekazanej do asyncio.run) - klientów zamkniętej pętli nie
+    da się już zamknąć, są tylko porzucane.
+    """
+
+    def __init__(self, pool_size: int = 10, pool_block: bool = False):
+        """
+        Args:
+            pool_size: Maksymalna liczba utrzymywanych połączeń na host
+            pool_block: Czy czekać na wolne połączenie zamiast otwierać nadmiarowe
+        """
+        self.pool_size = pool_size
+        self.pool_block = pool_block
+        self._lock = threading.Lock()
+        self._session: Optional[requests.Session] = None
+        self._adapter: Optional[HTTPAdapter] = None
+        self._anthropic: Dict[str, anthropic.Anthropic] = {}
+        self._async_anthropic: Dict[Tuple[str, asyncio.AbstractEventLoop], anthropic.AsyncAnthropic] = {}
+        self._async_http: Dict[asyncio.AbstractEventLoop, httpx.AsyncClient] = {}
+        self.async_requests = 0
+
+    @property
+    def session(self) -> requests.Session:
+        """Sesja requests współdzielona przez wszystkie wątki."""
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size,
+                                          pool_block=self.pool_block)
+                    session = requests.Session()
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    self._adapter, self._session = adapter, session
+        return self._session
+
+    def async_http(self) -> httpx.AsyncClient:
+        """Klient httpx dla bieżącej pętli zdarzeń (klient nie może być współdzielony między pętlami)."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._drop_closed_loops()
+            client = self._async_http.get(loop)
+            if client is None or client.is_closed:
+                client = httpx.AsyncClient(
+                    limits=self._limits(),
+                    event_hooks={"request": [self._count_async_request]}
+                )
+                self._async_http[loop] = client
+        return client
+
+    def anthropic_client(self, api_key: Optional[str] = None) -> Optional[anthropic.Anthropic]:
+        """
+        Zwraca klienta Anthropic dla klucza API (domyślnie ANTHROPIC_API_KEY) albo None bez klucza.
+        """
+        api_key = api_key or os.getenv('ANTHROPIC_API_KEY')
+        if not api_key:
+            return None
+        with self._lock:
+            if api_key not in self._anthropic:
+                # Ponawianiem zarządzają generatory (RetryPolicy), nie SDK
+                self._anthropic[api_key] = anthropic.Anthropic(
+                    api_key=api_key,
+                    max_retries=0,
+                    http_client=httpx.Client(limits=self._limits())
+                )
+            return self._anthropic[api_key]
+
+    def async_anthropic_client(self, api_key: Optional[str] = None) -> Optional[anthropic.AsyncAnthropic]:
+        """Asynchroniczny odpowiednik anthropic_client - jeden klient na klucz API i pętlę zdarzeń."""
+        api_key = api_key or os.getenv('ANTHROPIC_API_KEY')
+        if not api_key:
+            return None
+        key = (api_key, asyncio.get_running_loop())
+        with self._lock:
+            self._drop_closed_loops()
+            if key not in self._async_anthropic:
+                self._async_anthropic[key] = anthropic.AsyncAnthropic(
+                    api_key=api_key,
+                    max_retries=0,
+                    http_client=httpx.AsyncClient(limits=self._limits())
+                )
+            return self._async_anthropic[key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Zwraca konfigurację pul i statystyki ponownego użycia połączeń."""
+        requests_sent, connections = 0, 0
+        if self._adapter is not None:
+            pools = self._adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is not None:
+                    requests_sent += pool.num_requests
+                    connections += pool.num_connections
+        reused = max(0, requests_sent - connections)
+        return {
+            "pool_size": self.pool_size,
+            "http": {
+                "requests": requests_sent,
+                "new_connections": connections,
+                "reused_connections": reused,
+                "reuse_rate": reused / requests_sent if requests_sent else 0.0
+            },
+            "async_http": {
+                "clients": len(self._async_http),
+                "requests": self.async_requests
+            },
+            "anthropic_clients": len(self._anthropic) + len(self._async_anthropic)
+        }
+
+    async def aclose(self) -> None:
+        """Zamyka asynchroniczne klienty bieżącej pętli zdarzeń."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._pop_async_clients(lambda client_loop: client_loop is loop)
+        for _, client in clients:
+            await self._aclose_client(client)
+
+    def close(self) -> None:
+        """
+        Zamyka wszystkie klienty. Asynchroniczne klienty otwartych pętli zamykane są
+        w swojej pętli; klienty pętli już zamkniętych są tylko porzucane (patrz aclose).
+        """
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+            for client in self._anthropic.values():
+                client.close()
+            self._session, self._adapter = None, None
+            self._anthropic = {}
+            async_clients = self._pop_async_clients(lambda client_loop: True)
+
+        for loop, client in async_clients:
+            if loop.is_closed():
+                continue
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is loop:
+                # Nie można blokować własnej pętli - zamknięcie kończy się w tle
+                loop.create_task(self._aclose_client(client))
+            elif loop.is_running():
+                asyncio.run_coroutine_threadsafe(self._aclose_client(client), loop).result()
+            else:
+                loop.run_until_complete(self._aclose_client(client))
+
+    def _drop_closed_loops(self) -> None:
+        # Klienty zamkniętych pętli nie są już użyteczne ani nie da się ich zamknąć
+        self._pop_async_clients(lambda client_loop: client_loop.is_closed())
+
+    def _pop_async_clients(self, matches: Callable[[asyncio.AbstractEventLoop], bool]
+                           ) -> List[Tuple[asyncio.AbstractEventLoop, Any]]:
+        """Usuwa z puli asynchroniczne klienty pętli spełniających warunek i zwraca pary (pętla, klient)."""
+        clients = []
+        for loop in [l for l in self._async_http if matches(l)]:
+            clients.append((loop, self._async_http.pop(loop)))
+        for key in [k for k in self._async_anthropic if matches(k[1])]:
+            clients.append((key[1], self._async_anthropic.pop(key)))
+        return clients
+
+    @staticmethod
+    async def _aclose_client(client: Any) -> None:
+        if isinstance(client, httpx.AsyncClient):
+            await client.aclose()
+        else:
+            await client.close()
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+
+    async def _count_async_request(self, request: httpx.Request) -> None:
+        self.async_requests += 1
+
+
+_default_pool: Optional[ClientPool] = None
+_default_pool_lock = threading.Lock()
+
+
+def get_client_pool() -> ClientPool:
+    """Domyślna pula klientów współdzielona przez generatory w procesie."""
+    global _default_pool
+    if _default_pool is None:
+        with _default_pool_lock:
+            if _default_pool is None:
+                _default_pool = ClientPool()
+    return _default_pool
@@ -0,0 +1,180 @@
+from collections import OrderedDict
+import copy
+import dataclasses
+import hashlib
+import threading
+from typing import Any, Dict, List, Optional, Union
+
+from src.chunking import Chunk
+
+
+class TokenCounter:
+    """
+    Liczy tokeny tekstu tokenizerem modelu i zapamiętuje wyniki per hash tekstu.
+
+    Tokenizer może być obiektem tokenizera HuggingFace albo nazwą modelu
+    (ładowany leniwie przez AutoTokenizer). Bez tokenizera - albo gdy nie da się
+    go wczytać - liczba tokenów jest szacowana (średnio 4 znaki na token).
+    """
+
+    CHARS_PER_TOKEN = 4
+
+    def __init__(self, tokenizer: Union[str, Any, None] = None, cache_size: int = 65536):
+        """
+        Args:
+            tokenizer: Tokenizer HuggingFace, nazwa modelu albo None (szacowanie)
+            cache_size: Maksymalna liczba zapamiętanych wyników
+        """
+        self._tokenizer = tokenizer
+        self.cache_size = cache_size
+        self._counts: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def tokenizer(self) -> Optional[Any]:
+        if isinstance(self._tokenizer, str):
+            name = self._tokenizer
+            try:
+                from transformers import AutoTokenizer
+                self._tokenizer = AutoTokenizer.from_pretrained(name)
+            except Exception as e:
+                print(f"Nie można wczytać tokenizera {name}, liczba tokenów będzie szacowana: {e}")
+                self._tokenizer = None
+        return self._tokenizer
+
+    @property
+    def is_exact(self) -> bool:
+        return self.tokenizer is not None
+
+    def count(self, text: str) -> int:
+        """Zwraca liczbę tokenów tekstu (bez tokenów specjalnych)."""
+        key = hashlib.md5(text.encode()).hexdigest()
+        with self._lock:
+            count = self._counts.get(key)
+            if count is not None:
+                self._counts.move_to_end(key)
+                self.hits += 1
+                return count
+            self.misses += 1
+
+        count = self._count(text)
+        with self._lock:
+            self._counts[key] = count
+            while len(self._counts) > self.cache_size:
+                self._counts.popitem(last=False)
+        return count
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Zwraca najdłuższy prefiks tekstu mieszczący się w max_tokens tokenach."""
+        if max_tokens <= 0:
+            return ""
+        tokenizer = self.tokenizer
+        if tokenizer is not None and getattr(tokenizer, "is_fast", False):
+            offsets = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+            if len(offsets) <= max_tokens:
+                return text
+            return text[:offsets[max_tokens - 1][1]]
+
+        # Bez mapowania pozycji skracamy proporcjonalnie i sprawdzamy wynik
+        cut = min(len(text), max_tokens * self.CHARS_PER_TOKEN)
+        while cut > 0 and self._count(text[:cut]) > max_tokens:
+            cut = int(cut * 0.9)
+        return text[:cut]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "exact": self.is_exact,
+            "cached": len(self._counts),
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+    def _count(self, text: str) -> int:
+        tokenizer = self.tokenizer
+        if tokenizer is None:
+            return (len(text) + self.CHARS_PER_TOKEN - 1) // self.CHARS_PER_TOKEN
+        return len(tokenizer.encode(text, add_special_tokens=False))
+
+
+class ContextPacker:
+    """
+    Pakuje znalezione chunki w budżet tokenów kontekstu.
+
+    Chunki rozpatrywane są w kolejności od najlepszego (kolejność z retrievera).
+    Chunk, który się nie mieści, jest pomijany, a miejsce mogą zająć kolejne,
+    krótsze chunki. Jeśli zostało co najmniej min_partial_tokens, pierwszy
+    niemieszczący się chunk trafia do kontekstu skrócony. Oryginalne chunki
+    nigdy nie są modyfikowane - skrócony chunk jest kopią.
+    """
+
+    def __init__(self, token_counter: Optional[TokenCounter] = None, max_tokens: int = 8000,
+                 per_chunk_overhead: int = 24, min_partial_tokens: int = 128):
+        """
+        Args:
+            token_counter: Licznik tokenów (domyślnie szacujący)
+            max_tokens: Budżet tokenów na konteksty
+            per_chunk_overhead: Tokeny nagłówka dodawanego do każdego kontekstu w prompcie
+            min_partial_tokens: Minimalna wolna przestrzeń, dla której warto dodać skrócony chunk
+        """
+        self.token_counter = token_counter if token_counter is not None else TokenCounter()
+        self.max_tokens = max_tokens
+        self.per_chunk_overhead = per_chunk_overhead
+        self.min_partial_tokens = min_partial_tokens
+
+        self.packed_calls = 0
+        self.dropped_chunks = 0
+        self.truncated_chunks = 0
+
+    def pack(self, contexts: List[Chunk], max_tokens: Optional[int] = None) -> List[Chunk]:
+        """
+        Wybiera konteksty mieszczące się w budżecie.
+
+        Args:
+            contexts: Chunki w kolejności od najbardziej trafnego
+            max_tokens: Opcjonalny budżet zamiast self.max_tokens
+
+        Returns:
+            Wybrane chunki (w kolejności wejściowej); skrócony chunk jest kopią
+        """
+        budget = self.max_tokens if max_tokens is None else max_tokens
+        selected: List[Chunk] = []
+        used = 0
+        truncated = False
+
+        for ctx in contexts:
+            cost = self.token_counter.count(ctx.text) + self.per_chunk_overhead
+            if used + cost <= budget:
+                selected.append(ctx)
+                used += cost
+                continue
+
+            remaining = budget - used - self.per_chunk_overhead
+            if not truncated and remaining >= self.min_partial_tokens:
+                selected.append(self._with_text(ctx, self.token_counter.truncate(ctx.text, remaining)))
+                used = budget
+                truncated = True
+                self.truncated_chunks += 1
+            else:
+                self.dropped_chunks += 1
+
+        self.packed_calls += 1
+        return selected
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "max_tokens": self.max_tokens,
+            "packed_calls": self.packed_calls,
+            "dropped_chunks": self.dropped_chunks,
+            "truncated_chunks": self.truncated_chunks,
+            "token_counter": self.token_counter.get_stats()
+        }
+
+    @staticmethod
+    def _with_text(ctx: Chunk, text: str) -> Chunk:
+        if dataclasses.is_dataclass(ctx):
+            return dataclasses.replace(ctx, text=text)
+        clone = copy.copy(ctx)
+        clone.text = text
+        return clone
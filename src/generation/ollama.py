@@ -1,7 +1,13 @@
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Iterator, Optional, Tuple, Union
+import json
+import httpx
 import requests
 import time
 from src.chunking import Chunk
+from src.generation.clients import ClientPool, get_client_pool
+from src.generation.context_packer import ContextPacker, TokenCounter
+from src.generation.resilience import (CircuitBreaker, CircuitOpenError, RetryPolicy, RetryableError,
+                                       get_circuit_breaker, parse_retry_after)
 
 class OllamaGenerator:
     def __init__(self, 
@@ -10,15 +16,38 @@ class OllamaGenerator:
                  timeout: int = 30,
                  max_context_length: int = 32000,
                  retry_attempts: int = 3,
-                 retry_delay: int = 2):
+                 retry_delay: int = 2,
+                 clients: ClientPool = None,
+                 retry_policy: RetryPolicy = None,
+                 circuit_breaker: CircuitBreaker = None,
+                 max_context_tokens: Optional[int] = None,
+                 tokenizer: Any = None):
         self.model = model_name
         self.base_url = base_url.rstrip('/')
         self.base_timeout = timeout
         self.max_context_length = max_context_length
         self.retry_attempts = retry_attempts
         self.retry_delay = retry_delay
+        
+        # Sesja keep-alive i klienci httpx współdzieleni między generatorami
+        self.clients = clients if clients is not None else get_client_pool()
+        
+        # Wykładnicze ponawianie z jitterem i bezpiecznik wspólny dla serwera Ollama
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy(
+            max_attempts=retry_attempts, base_delay=retry_delay
+        )
+        self.circuit_breaker = circuit_breaker if circuit_breaker is not None else get_circuit_breaker(
+            f"ollama:{self.base_url}"
+        )
+        
+        # Konteksty pakowane są w budżet tokenów (domyślnie ~4 znaki na token z max_context_length)
+        self.context_packer = ContextPacker(
+            TokenCounter(tokenizer),
+            max_tokens=max_context_tokens if max_context_tokens is not None else max_context_length // 4
+        )
 
-    def generate(self, query: str, contexts: List[Chunk], max_tokens: int = 4000) -> Dict[str, Any]:
+    def generate(self, query: str, contexts: List[Chunk], max_tokens: int = 4000,
+                 stream: bool = False) -> Union[Dict[str, Any], Iterator[str]]:
         """
         Generuje odpowiedź na podstawie zapytania i dostarczonych kontekstów.
         
@@ -26,10 +55,15 @@ class OllamaGenerator:
             query: Pytanie użytkownika
             contexts: Lista fragmentów dokumentów znalezionych przez retriever
             max_tokens: Maksymalna liczba tokenów w odpowiedzi
+            stream: Czy zwrócić iterator fragmentów tekstu (patrz generate_stream)
             
         Returns:
             Słownik zawierający wygenerowaną odpowiedź i metadane
+            albo iterator fragmentów odpowiedzi, gdy stream=True
         """
+        if stream:
+            return self.generate_stream(query, contexts, max_tokens)
+        
         system_prompt = self._format_system_prompt(contexts)
         config = self._get_generation_config(max_tokens)
         
@@ -76,40 +110,259 @@ class OllamaGenerator:
         
         return result
     
-    def _make_api_request(self, query: str, system_prompt: str, config: dict, timeout: int) -> Dict[str, Any]:
+    async def agenerate(self, query: str, contexts: List[Chunk], max_tokens: int = 4000) -> Dict[str, Any]:
         """
-        Wykonuje zapytanie do API Ollama z obsługą ponowień w przypadku błędów.
+        Asynchroniczna wersja generate - nie blokuje pętli zdarzeń na czas wywołania API.
+        
+        Args:
+            query: Pytanie użytkownika
+            contexts: Lista fragmentów dokumentów znalezionych przez retriever
+            max_tokens: Maksymalna liczba tokenów w odpowiedzi
+            
+        Returns:
+            Słownik zawierający wygenerowaną odpowiedź i metadane
         """
-        prompt = f"Odpowiedz na postawione pytanie zwięźle i merytorycznie: {query}"
+        system_prompt = self._format_system_prompt(contexts)
+        config = self._get_generation_config(max_tokens)
+        dynamic_timeout = self._calculate_dynamic_timeout(contexts, max_tokens)
+        prioritized_contexts = self._prioritize_contexts(contexts, query)
+        
+        result = {
+            "answer": "",
+            "sources": [],
+            "error": None,
+            "processing_time": 0
+        }
+        
+        start_time = time.time()
         
-        for attempt in range(self.retry_attempts):
-            try:
-                response = requests.post(
-                    f"{self.base_url}/api/generate",
-                    json={
-                        "model": self.model,
-                        "prompt": prompt,
-                        "stream": False,
-                        "system": system_prompt,
-                        "options": config
-                    },
-                    timeout=timeout
-                )
+        try:
+            response = await self._amake_api_request(
+                query=query,
+                system_prompt=system_prompt,
+                config=config,
+                timeout=dynamic_timeout
+            )
+            
+            if isinstance(response, dict) and "response" in response:
+                answer = response["response"]
+                
+                if self._is_truncated_response(answer):
+                    continuation = await self._amake_api_request(
+                        query=(f"Poprzednia odpowiedź została przerwana. Kontynuuj odpowiedź od miejsca: "
+                               f"{answer[-200:]}"),
+                        system_prompt=self._format_system_prompt(prioritized_contexts),
+                        config=self._get_generation_config(2000),
+                        timeout=self.base_timeout * 2
+                    )
+                    if continuation.get("response"):
+                        answer = f"{answer.rstrip('.')} {continuation['response'].lstrip()}"
                 
-                if response.status_code == 200:
-                    return response.json()
+                result["answer"] = answer
+                result["sources"] = self._extract_sources_from_contexts(prioritized_contexts, answer)
+            else:
+                result["error"] = f"Nieoczekiwana odpowiedź API: {response}"
                 
-                if response.status_code == 404:
-                    return {"response": f"Model {self.model} nie został znaleziony."}
-                    
-                if attempt < self.retry_attempts - 1:
-                    time.sleep(self.retry_delay)
-                    
-            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
-                if attempt < self.retry_attempts - 1:
-                    time.sleep(self.retry_delay)
-        
-        return {"response": "Nie udało się uzyskać odpowiedzi z modelu po kilku próbach."}
+        except Exception as e:
+            result["error"] = f"Wystąpił błąd podczas generowania odpowiedzi: {str(e)}"
+            
+        result["processing_time"] = time.time() - start_time
+        
+        return result
+    
+    async def acomplete(self,
+                        prompt: str,
+                        system_prompt: str,
+                        temperature: float = 0,
+                        max_tokens: int = 4000,
+                        timeout: int = 30) -> str:
+        """
+        Asynchroniczne zapytanie do API Ollama dla gotowego promptu.
+        
+        Returns:
+            Tekst odpowiedzi albo pusty ciąg, gdy wszystkie próby się nie powiodły
+        """
+        config = self._get_generation_config(max_tokens)
+        config["temperature"] = temperature
+        
+        async def send():
+            response = await self._apost(prompt, system_prompt, config, timeout)
+            self._raise_for_status(response)
+            return response
+        
+        try:
+            response = await self.retry_policy.acall(send, breaker=self.circuit_breaker, retryable=self.is_retryable)
+            if response.status_code == 200:
+                return response.json().get("response", "")
+            print(f"Błąd API Ollama: {response.status_code} - {response.text}")
+        except Exception as e:
+            print(f"Wyjątek podczas zapytania do Ollama: {str(e)}")
+        return ""
+    
+    def generate_stream(self, query: str, contexts: List[Chunk], max_tokens: int = 4000) -> Iterator[str]:
+        """
+        Generuje odpowiedź strumieniowo - fragmenty tekstu zwracane są w miarę ich nadchodzenia.
+        
+        W odróżnieniu od generate nie dogenerowuje uciętej odpowiedzi.
+        
+        Args:
+            query: Pytanie użytkownika
+            contexts: Lista fragmentów dokumentów znalezionych przez retriever
+            max_tokens: Maksymalna liczba tokenów w odpowiedzi
+            
+        Returns:
+            Iterator fragmentów odpowiedzi
+            
+        Raises:
+            RuntimeError: Gdy wszystkie próby się nie powiodły
+        """
+        system_prompt = self._format_system_prompt(contexts)
+        yield from self.stream_completion(
+            prompt=f"Odpowiedz na postawione pytanie zwięźle i merytorycznie: {query}",
+            system_prompt=system_prompt,
+            temperature=0,
+            max_tokens=max_tokens,
+            timeout=self._calculate_dynamic_timeout(contexts, max_tokens)
+        )
+    
+    def stream_completion(self,
+                          prompt: str,
+                          system_prompt: str,
+                          temperature: float = 0,
+                          max_tokens: int = 4000,
+                          timeout: int = 30) -> Iterator[str]:
+        """
+        Strumieniuje odpowiedź API Ollama (stream: true) dla gotowego promptu.
+        
+        Ponawiane są tylko próby, które nie zwróciły jeszcze żadnego tekstu.
+        
+        Raises:
+            RuntimeError: Gdy wszystkie próby się nie powiodły
+        """
+        config = self._get_generation_config(max_tokens)
+        config["temperature"] = temperature
+        
+        def open_stream() -> Iterator[str]:
+            with self.clients.session.post(
+                f"{self.base_url}/api/generate",
+                json={
+                    "model": self.model,
+                    "prompt": prompt,
+                    "stream": True,
+                    "system": system_prompt,
+                    "options": config
+                },
+                stream=True,
+                timeout=timeout
+            ) as response:
+                self._raise_for_status(response)
+                if response.status_code != 200:
+                    raise RuntimeError(f"Błąd API Ollama: {response.status_code} - {response.text}")
+                
+                # Każda linia to osobny obiekt JSON z kolejnym fragmentem odpowiedzi
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    data = json.loads(line)
+                    if data.get("error"):
+                        raise RuntimeError(f"Błąd API Ollama: {data['error']}")
+                    if data.get("response"):
+                        yield data["response"]
+                    if data.get("done"):
+                        break
+        
+        try:
+            yield from self.retry_policy.stream(open_stream, breaker=self.circuit_breaker,
+                                                retryable=self.is_retryable)
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            raise RuntimeError(f"Błąd strumienia Ollama: {str(e)}") from e
+    
+    def _make_api_request(self, query: str, system_prompt: str, config: dict, timeout: int) -> Dict[str, Any]:
+        """
+        Wykonuje zapytanie do API Ollama z ponawianiem (retry_policy) i bezpiecznikiem.
+        """
+        prompt = f"Odpowiedz na postawione pytanie zwięźle i merytorycznie: {query}"
+        
+        def send():
+            response = self.clients.session.post(
+                f"{self.base_url}/api/generate",
+                json={
+                    "model": self.model,
+                    "prompt": prompt,
+                    "stream": False,
+                    "system": system_prompt,
+                    "options": config
+                },
+                timeout=timeout
+            )
+            self._raise_for_status(response)
+            return response
+        
+        try:
+            response = self.retry_policy.call(send, breaker=self.circuit_breaker, retryable=self.is_retryable)
+        except CircuitOpenError as e:
+            return {"response": str(e)}
+        except Exception:
+            return {"response": "Nie udało się uzyskać odpowiedzi z modelu po kilku próbach."}
+        
+        if response.status_code == 404:
+            return {"response": f"Model {self.model} nie został znaleziony."}
+        if response.status_code != 200:
+            return {"response": f"Błąd API Ollama: {response.status_code}"}
+        return response.json()
+    
+    async def _amake_api_request(self, query: str, system_prompt: str, config: dict, timeout: int) -> Dict[str, Any]:
+        """
+        Asynchroniczny odpowiednik _make_api_request.
+        """
+        prompt = f"Odpowiedz na postawione pytanie zwięźle i merytorycznie: {query}"
+        
+        async def send():
+            response = await self._apost(prompt, system_prompt, config, timeout)
+            self._raise_for_status(response)
+            return response
+        
+        try:
+            response = await self.retry_policy.acall(send, breaker=self.circuit_breaker, retryable=self.is_retryable)
+        except CircuitOpenError as e:
+            return {"response": str(e)}
+        except Exception:
+            return {"response": "Nie udało się uzyskać odpowiedzi z modelu po kilku próbach."}
+        
+        if response.status_code == 404:
+            return {"response": f"Model {self.model} nie został znaleziony."}
+        if response.status_code != 200:
+            return {"response": f"Błąd API Ollama: {response.status_code}"}
+        return response.json()
+    
+    @staticmethod
+    def _raise_for_status(response: Any) -> None:
+        """Zgłasza RetryableError dla odpowiedzi, które warto ponowić (429 i 5xx)."""
+        if response.status_code == 429 or response.status_code >= 500:
+            raise RetryableError(f"Błąd API Ollama: {response.status_code}",
+                                 retry_after=parse_retry_after(response.headers))
+    
+    @staticmethod
+    def is_retryable(error: BaseException) -> bool:
+        """Czy błąd warto ponowić: 429/5xx, timeout lub błąd połączenia."""
+        return isinstance(error, (RetryableError,
+                                  requests.exceptions.Timeout, requests.exceptions.ConnectionError,
+                                  httpx.TimeoutException, httpx.NetworkError))
+    
+    async def _apost(self, prompt: str, system_prompt: str, config: dict, timeout: int) -> httpx.Response:
+        return await self.clients.async_http().post(
+            f"{self.base_url}/api/generate",
+            json={
+                "model": self.model,
+                "prompt": prompt,
+                "stream": False,
+                "system": system_prompt,
+                "options": config
+            },
+            timeout=timeout
+        )
     
     def _get_generation_config(self, max_tokens: int) -> dict:
         return {
@@ -154,66 +407,18 @@ class OllamaGenerator:
 
     def _truncate_contexts(self, contexts: List[Chunk]) -> List[Chunk]:
         """
-        Inteligentne przycinanie kontekstów z uwzględnieniem ich ważności.
+        Wybiera konteksty mieszczące się w budżecie tokenów (patrz ContextPacker).
+        Przekazane chunki nie są modyfikowane.
         """
-        total_chars = sum(len(ctx.text) for ctx in contexts)
-        
-        if total_chars <= self.max_context_length:
-            return contexts
-            
-        # Sortuj konteksty według score, ale zachowaj różnorodność dokumentów
-        # Grupuj konteksty według doc_id
-        docs_groups = {}
-        for ctx in contexts:
-            doc_id = getattr(ctx, 'doc_id', 'unknown')
-            if doc_id not in docs_groups:
-                docs_groups[doc_id] = []
-            docs_groups[doc_id].append(ctx)
-        
-        # Wybierz po jednym najlepszym chunka z każdego dokumentu, 
-        # potem po drugim najlepszym itd.
-        selected_contexts = []
-        current_length = 0
-        
-        # Sortuj każdą grupę według score
-        for doc_id, ctx_group in docs_groups.items():
-            docs_groups[doc_id] = sorted(ctx_group, key=lambda x: getattr(x, 'score', 0), reverse=True)
-        
-        # Dodawaj po jednym najlepszym chunka z każdego dokumentu
-        i = 0
-        while current_length < self.max_context_length and any(docs_groups.values()):
-            for doc_id in list(docs_groups.keys()):
-                if docs_groups[doc_id]:
-                    ctx = docs_groups[doc_id].pop(0)
-                    # Sprawdź, czy zmieści się cały chunk
-                    if current_length + len(ctx.text) <= self.max_context_length:
-                        selected_contexts.append(ctx)
-                        current_length += len(ctx.text)
-                    else:
-                        # Przytnij tekst, aby zmieścił się w limicie
-                        truncated_text = ctx.text[:self.max_context_length - current_length]
-                        if len(truncated_text) > 100:  # Jeśli warto dodać
-                            ctx.text = truncated_text
-                            selected_contexts.append(ctx)
-                            current_length += len(truncated_text)
-                        break
-                if current_length >= self.max_context_length:
-                    break
-            i += 1
-            # Bezpiecznik
-            if i > 100:
-                break
-                
-        return selected_contexts
+        return self.context_packer.pack(contexts)
 
     def _calculate_dynamic_timeout(self, contexts: List[Chunk], max_tokens: int) -> int:
         """
         Oblicza dynamiczny timeout w zależności od rozmiaru kontekstu i liczby tokenów.
         """
         # Szacuj, że generowanie 1000 tokenów zajmuje około 5 sekund
-        context_size = sum(len(ctx.text) for ctx in contexts)
-        # Zakładamy, że średnio 4 znaki to 1 token
-        estimated_context_tokens = context_size / 4
+        # Liczby tokenów chunków są zapamiętywane w liczniku pakera
+        estimated_context_tokens = sum(self.context_packer.token_counter.count(ctx.text) for ctx in contexts)
         estimated_response_time = (estimated_context_tokens / 1000 * 2) + (max_tokens / 1000 * 5)
         
         # Minimum 10 sekund, maksimum 120 sekund
@@ -0,0 +1,323 @@
+import asyncio
+from contextlib import closing
+from email.utils import parsedate_to_datetime
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterator, Mapping, Optional
+
+
+class CircuitOpenError(RuntimeError):
+    """Wywołanie odrzucone bez próby, bo backend jest oznaczony jako niedostępny."""
+
+
+class RetryableError(Exception):
+    """Błąd, po którym warto ponowić próbę (np. HTTP 429 lub 5xx)."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """
+    Odczytuje nagłówek Retry-After (liczba sekund albo data HTTP).
+
+    Returns:
+        Liczba sekund oczekiwania albo None, gdy nagłówka brak lub jest niepoprawny
+    """
+    if not headers:
+        return None
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    Bezpiecznik backendu LLM.
+
+    - closed: wywołania przechodzą; failure_threshold kolejnych błędów otwiera bezpiecznik,
+    - open: wywołania są od razu odrzucane (CircuitOpenError) przez recovery_timeout sekund,
+    - half_open: przepuszczane jest half_open_max_calls wywołań próbnych; sukces
+      zamyka bezpiecznik, błąd ponownie go otwiera.
+
+    Dzięki temu niedostępny backend nie blokuje wątków na czas kolejnych timeoutów.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5,
+                 recovery_timeout: float = 30.0, half_open_max_calls: int = 1):
+        """
+        Args:
+            name: Nazwa backendu (w statystykach)
+            failure_threshold: Liczba kolejnych błędów otwierająca bezpiecznik
+            recovery_timeout: Czas w sekundach, po którym dopuszczane są wywołania próbne
+            half_open_max_calls: Liczba równoczesnych wywołań próbnych
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_calls = 0
+        self._lock = threading.Lock()
+
+        self.opened_count = 0
+        self.rejected_calls = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def allow_request(self) -> bool:
+        """Sprawdza, czy wywołanie może się odbyć (w stanie half_open zajmuje miejsce próbne)."""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and self._trial_calls < self.half_open_max_calls:
+                self._trial_calls += 1
+                return True
+            self.rejected_calls += 1
+            return False
+
+    def check(self) -> None:
+        """
+        Raises:
+            CircuitOpenError: Gdy bezpiecznik nie dopuszcza wywołania
+        """
+        if not self.allow_request():
+            raise CircuitOpenError(f"Backend {self.name} jest chwilowo niedostępny (circuit breaker otwarty)")
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_calls = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            state = self._current_state()
+            self._failures += 1
+            if state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if state != self.OPEN:
+                    self.opened_count += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._trial_calls = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "name": self.name,
+                "state": self._current_state(),
+                "consecutive_failures": self._failures,
+                "opened_count": self.opened_count,
+                "rejected_calls": self.rejected_calls
+            }
+
+    def _current_state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self._state = self.HALF_OPEN
+            self._trial_calls = 0
+        return self._state
+
+
+class RetryPolicy:
+    """
+    Ponawianie z wykładniczym opóźnieniem i pełnym jitterem.
+
+    Opóźnienie przed próbą n+1 losowane jest z [0, min(max_delay, base_delay * multiplier**n)],
+    więc równoległe zapytania nie ponawiają się w tej samej chwili. Jeśli serwer
+    podał Retry-After, czekamy co najmniej tyle (ale nie dłużej niż max_delay).
+    """
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.5,
+                 max_delay: float = 20.0, multiplier: float = 2.0, seed: Optional[int] = None):
+        """
+        Args:
+            max_attempts: Maksymalna liczba prób (łącznie z pierwszą)
+            base_delay: Bazowe opóźnienie w sekundach
+            max_delay: Górny limit pojedynczego opóźnienia
+            multiplier: Mnożnik kolejnych opóźnień
+            seed: Opcjonalne ziarno generatora losowego jittera
+        """
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.total_backoff = 0.0
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        Zwraca opóźnienie po nieudanej próbie o numerze attempt (od 0).
+        """
+        ceiling = min(self.max_delay, self.base_delay * self.multiplier ** attempt)
+        with self._lock:
+            delay = self._random.uniform(0, ceiling)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+    def call(self, func: Callable[[], Any], breaker: Optional[CircuitBreaker] = None,
+             retryable: Callable[[BaseException], bool] = lambda e: True) -> Any:
+        """
+        Wywołuje func z ponawianiem.
+
+        Args:
+            func: Funkcja bez argumentów wykonująca jedną próbę
+            breaker: Opcjonalny bezpiecznik backendu
+            retryable: Czy dany wyjątek kwalifikuje się do ponowienia (i liczy się jako awaria backendu)
+
+        Raises:
+            CircuitOpenError: Gdy bezpiecznik jest otwarty
+            Exception: Ostatni błąd, gdy próby się wyczerpały lub błędu nie warto ponawiać
+        """
+        self._count("calls")
+        for attempt in range(self.max_attempts):
+            if breaker is not None:
+                breaker.check()
+            try:
+                result = func()
+            except Exception as e:
+                delay = self._on_failure(e, attempt, breaker, retryable)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            if breaker is not None:
+                breaker.record_success()
+            return result
+
+    async def acall(self, func: Callable[[], Awaitable[Any]], breaker: Optional[CircuitBreaker] = None,
+                    retryable: Callable[[BaseException], bool] = lambda e: True) -> Any:
+        """Asynchroniczny odpowiednik call - func zwraca korutynę, opóźnienia nie blokują pętli."""
+        self._count("calls")
+        for attempt in range(self.max_attempts):
+            if breaker is not None:
+                breaker.check()
+            try:
+                result = await func()
+            except Exception as e:
+                delay = self._on_failure(e, attempt, breaker, retryable)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            if breaker is not None:
+                breaker.record_success()
+            return result
+
+    def stream(self, open_stream: Callable[[], Iterator[Any]], breaker: Optional[CircuitBreaker] = None,
+               retryable: Callable[[BaseException], bool] = lambda e: True) -> Iterator[Any]:
+        """
+        Przekazuje elementy strumienia z ponawianiem - tylko dopóki nie zwrócił on żadnego
+        elementu, bo przerwanego strumienia nie da się wznowić bez powtórzenia tekstu.
+
+        Args:
+            open_stream: Funkcja bez argumentów otwierająca strumień (jedna próba)
+            breaker: Opcjonalny bezpiecznik backendu
+            retryable: Jak w call
+
+        Raises:
+            CircuitOpenError: Gdy bezpiecznik jest otwarty
+            Exception: Błąd strumienia, gdy próby się wyczerpały, błędu nie warto ponawiać
+                albo strumień zdążył już zwrócić elementy
+        """
+        self._count("calls")
+        for attempt in range(self.max_attempts):
+            if breaker is not None:
+                breaker.check()
+            received = False
+            try:
+                with closing(open_stream()) as items:
+                    for item in items:
+                        received = True
+                        yield item
+            except GeneratorExit:
+                # Odbiorca przerwał strumień - backend odpowiadał, zwalniamy miejsce próbne bezpiecznika
+                if breaker is not None:
+                    breaker.record_success()
+                raise
+            except Exception as e:
+                # Po pierwszym elemencie próba jest traktowana jak ostatnia
+                delay = self._on_failure(e, self.max_attempts - 1 if received else attempt, breaker, retryable)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            if breaker is not None:
+                breaker.record_success()
+            return
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "max_attempts": self.max_attempts,
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+            "total_backoff": self.total_backoff
+        }
+
+    def _on_failure(self, error: BaseException, attempt: int, breaker: Optional[CircuitBreaker],
+                    retryable: Callable[[BaseException], bool]) -> Optional[float]:
+        """Rejestruje błąd; zwraca opóźnienie przed kolejną próbą albo None, gdy należy się poddać."""
+        can_retry = retryable(error)
+        if breaker is not None:
+            if can_retry:
+                breaker.record_failure()
+            else:
+                # Błąd po stronie zapytania (np. 400) nie świadczy o awarii backendu
+                breaker.record_success()
+        if not can_retry or attempt == self.max_attempts - 1:
+            self._count("failures")
+            return None
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is None:
+            # Błędy HTTP klientów (anthropic, httpx, requests) niosą odpowiedź z nagłówkami
+            retry_after = parse_retry_after(getattr(getattr(error, "response", None), "headers", None))
+        delay = self.backoff(attempt, retry_after)
+        with self._lock:
+            self.retries += 1
+            self.total_backoff += delay
+        return delay
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(name: str, **kwargs) -> CircuitBreaker:
+    """
+    Zwraca bezpiecznik backendu o danej nazwie, współdzielony przez wszystkie generatory w procesie.
+    """
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name, **kwargs)
+        return _breakers[name]
@@ -1,14 +1,28 @@
-from typing import  List, Tuple, Dict, Any, Optional
+from typing import  List, Tuple, Dict, Any, Optional, Iterable, Iterator, Union
+import asyncio
 import time
 import json
 import hashlib
 import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
 from src.chunking import Chunk, SimpleTextSplitter
 from src.embeddings import PolishLegalEmbedder
-from src.cache import BaseCache
+from src.cache import BaseCache, MemmapCache, QueryEmbeddingCache, SemanticAnswerCache
+from src.rag.document_index import DocumentIndex
+from src.rag.ingestion import IngestionBatch, IngestionPipeline
+from src.rag.rwlock import ReadWriteLock
 from src.retrieval.semantic import SemanticRetriever
+from src.retrieval.bm25 import BM25Index
+from src.retrieval.ivf_index import IVFIndex
+from src.retrieval.quantized_index import QuantizedIndex
+from src.retrieval.reranker import CrossEncoderReranker
+from src.retrieval.structural_index import StructuralIndex
 from src.generation.anthropic import AnthropicGenerator
-import requests
+from src.generation.ollama import OllamaGenerator
+from src.generation.clients import ClientPool, get_client_pool
+import numpy as np
 import anthropic
 
 class LegalRAGPipeline:
@@ -22,6 +36,8 @@ class LegalRAGPipeline:
     def __init__(self, 
                  use_gpu: bool = False,
                  cache_dir: str = "cache",
+                 cache: BaseCache = None,
+                 answer_cache: SemanticAnswerCache = None,
                  chunker: SimpleTextSplitter = None,
                  embedder_model: str = "BAAI/bge-m3",
                  generator_model: str = "llama3.2",
@@ -29,46 +45,150 @@ class LegalRAGPipeline:
                  min_score_threshold: float = 0.6,
                  max_top_k: int = 10,
                  max_context_length: int = 32000,
+                 generation_concurrency: int = 4,
+                 batch_timeout: float = 120,
+                 embedding_batch_size: int = 32,
+                 ingestion_workers: Optional[int] = None,
+                 commit_batch_size: int = 512,
+                 retrieval_index: str = "exact",
+                 ivf_nprobe: int = 16,
+                 quantization_dim: Optional[int] = None,
+                 vector_dtype: str = "float32",
+                 query_cache_size: int = 1024,
+                 persist_query_cache: bool = False,
+                 hybrid_retrieval: bool = True,
+                 structural_lookup: bool = True,
+                 reranker: CrossEncoderReranker = None,
+                 compaction_threshold: Optional[float] = None,
+                 clients: ClientPool = None,
                  debug_mode: bool = False):
         
         self.debug_mode = debug_mode
+        self.embedding_batch_size = embedding_batch_size
+        self.generation_concurrency = generation_concurrency
+        self.batch_timeout = batch_timeout
+        
+        # Zmiany korpusu (ingestia, aktualizacja, usuwanie, kompaktowanie) są szeregowane
+        self._write_lock = threading.RLock()
+        # Zapytania czytają listy chunków, oznaczenia usuniętych i indeksy wyszukiwania pod wspólną
+        # blokadą odczytu; zmiany tego stanu są wyłączne, więc zapytanie widzi go zawsze w całości
+        self._index_lock = ReadWriteLock()
+        # Kompaktowanie w tle startuje, gdy usunięte chunki stanowią taki ułamek wszystkich
+        # (domyślnie wyłączone - compact wywołuje się jawnie)
+        self.compaction_threshold = compaction_threshold
+        self._compaction_thread: Optional[threading.Thread] = None
+        self.compactions = 0
         
         # Inicjalizacja embeddera
         if self.debug_mode:
             print(f"Inicjalizacja embeddera {embedder_model}...")
         self.embedder = PolishLegalEmbedder(model_name=embedder_model, use_gpu=use_gpu)
         
-        # Inicjalizacja cache'u
+        # Inicjalizacja cache'u (domyślnie embeddingi w jednym pliku mapowanym do pamięci)
         if not os.path.exists(cache_dir):
             os.makedirs(cache_dir)
-        self.cache = BaseCache(cache_dir)
+        self.cache = cache if cache is not None else MemmapCache(cache_dir, vector_dtype=vector_dtype)
         
-        # Inicjalizacja retrievera
+        # Inicjalizacja retrievera z wybranym backendem wyszukiwania
         if self.debug_mode:
-            print("Inicjalizacja retrievera...")
+            print(f"Inicjalizacja retrievera (indeks: {retrieval_index})...")
         self.retriever = SemanticRetriever(
             embedder=self.embedder,
             min_score_threshold=min_score_threshold,
-            max_top_k=max_top_k
+            max_top_k=max_top_k,
+            index=self._create_retrieval_index(retrieval_index, ivf_nprobe, quantization_dim),
+            query_cache=QueryEmbeddingCache(
+                max_size=query_cache_size,
+                store_dir=Path(self.cache.cache_dir) / "query_embeddings" if persist_query_cache else None
+            ),
+            sparse_index=self._create_sparse_index() if hybrid_retrieval else None,
+            structural_index=StructuralIndex() if structural_lookup else None,
+            reranker=reranker,
+            # Indeksy synchronizuje tylko ścieżka zapisu (_update_retrieval_index), nie zapytania
+            auto_sync=False
         )
         
-        # Inicjalizacja generatora
+        # Inicjalizacja generatora (klienci HTTP i API współdzieleni w puli)
         if self.debug_mode:
             print(f"Inicjalizacja generatora z modelem {generator_model}...")
+        self.clients = clients if clients is not None else get_client_pool()
         self.generator = AnthropicGenerator(
+            clients=self.clients,
+            # Tokenizer modelu Anthropic nie jest dostępny lokalnie - wielojęzyczny tokenizer embeddera jest jego przybliżeniem
+            tokenizer=getattr(self.embedder, "tokenizer", None),
             # model_name=generator_model,
             # base_url=ollama_url,
             # max_context_length=max_context_length
         )
         
+        # Cache odpowiedzi dla pytań o tym samym znaczeniu i tych samych źródłach
+        self.answer_cache = answer_cache if answer_cache is not None else SemanticAnswerCache()
+        
         # Inicjalizacja chunkera
         self.chunker = chunker if chunker is not None else SimpleTextSplitter()
         
+        # Potok ingestii: chunking w puli procesów, embedding i zapis w osobnych wątkach
+        self.ingestion = IngestionPipeline(
+            chunker=self.chunker,
+            embedder=self.embedder,
+            cache=self.cache,
+            num_workers=ingestion_workers,
+            embedding_batch_size=embedding_batch_size,
+            commit_batch_size=commit_batch_size,
+            debug_mode=debug_mode
+        )
+        
         # Wczytanie dokumentów i embeddingów z cache'u
         self.documents, self.embeddings = self.cache.load_cache()
+        self.document_index = DocumentIndex()
+        self.document_index.rebuild(self.documents, self.cache.document_hashes)
+        if self.documents:
+            with self._index_lock.write():
+                self._update_retrieval_index()
         if self.debug_mode:
             print(f"Wczytano {len(self.documents)} dokumentów z cache'u")
     
+    @property
+    def _ivf_index_path(self) -> Path:
+        return Path(self.cache.cache_dir) / "ivf_index.npz"
+    
+    def _create_retrieval_index(self, retrieval_index: str, ivf_nprobe: int,
+                                quantization_dim: Optional[int] = None) -> Optional[Union[IVFIndex, QuantizedIndex]]:
+        """
+        Tworzy backend wyszukiwania: "exact" (pełna macierz), "ivf" (przybliżony IVF)
+        lub "int8"/"float16" (skwantyzowana macierz, opcjonalnie z PCA do quantization_dim wymiarów).
+        """
+        if retrieval_index == "exact":
+            return None
+        if retrieval_index in QuantizedIndex.DTYPES:
+            return QuantizedIndex(dtype=retrieval_index, dim=quantization_dim)
+        if retrieval_index == "ivf":
+            index = IVFIndex(nprobe=ivf_nprobe)
+            index.load(self._ivf_index_path)
+            return index
+        raise ValueError(f"Nieznany typ indeksu wyszukiwania: {retrieval_index}")
+    
+    @property
+    def _bm25_index_path(self) -> Path:
+        return Path(self.cache.cache_dir) / "bm25_index.npz"
+    
+    def _create_sparse_index(self) -> BM25Index:
+        """Tworzy indeks BM25 i wczytuje jego zapisany stan z cache'u."""
+        index = BM25Index()
+        index.load(self._bm25_index_path)
+        return index
+    
+    def _update_retrieval_index(self) -> None:
+        """
+        Dokłada nowe chunki do indeksów wyszukiwania i zapisuje indeksy IVF i BM25 w cache'u.
+        Wywoływane z blokadą zapisu _index_lock.
+        """
+        self.retriever.sync(self.documents, self.embeddings)
+        if isinstance(self.retriever.index, IVFIndex):
+            self.retriever.index.save(self._ivf_index_path)
+        if self.retriever.sparse_index is not None:
+            self.retriever.sparse_index.save(self._bm25_index_path)
+    
     def add_document(self, document: str, doc_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Dodaje pojedynczy dokument do systemu.
@@ -93,53 +213,324 @@ class LegalRAGPipeline:
         Returns:
             Słownik ze statystykami dodawania dokumentów
         """
-        start_time = time.time()
-        
         if doc_ids is None:
-            doc_ids = [f"doc_{hashlib.md5(doc.encode()).hexdigest()[:10]}" for doc in documents]
+            doc_ids = [self._default_doc_id(doc) for doc in documents]
         
         if len(documents) != len(doc_ids):
             raise ValueError("Liczba dokumentów musi być równa liczbie identyfikatorów")
         
+        return self._ingest(zip(documents, doc_ids))
+    
+    def add_files(self, files: Iterable[Union[str, Path]], encoding: str = "utf-8") -> Dict[str, Any]:
+        """
+        Strumieniowo dodaje dokumenty z plików tekstowych.
+        
+        Pliki czytane są dopiero wtedy, gdy potok ingestii może je przyjąć, a gotowe
+        paczki od razu zapisywane są w cache'u - w pamięci nie ma całego korpusu.
+        Pliki, których treść jest już zaindeksowana, są pomijane, więc przerwane
+        dodawanie wystarczy uruchomić ponownie.
+        
+        Args:
+            files: Ścieżki plików (lista lub dowolny iterator)
+            encoding: Kodowanie plików
+            
+        Returns:
+            Słownik ze statystykami dodawania dokumentów
+        """
+        read_errors = {"failed_files": 0}
+        
+        def read_files():
+            for path in files:
+                try:
+                    text = Path(path).read_text(encoding=encoding)
+                except (OSError, UnicodeDecodeError) as e:
+                    print(f"Nie można wczytać pliku {path}: {e}")
+                    read_errors["failed_files"] += 1
+                    continue
+                yield text, self._default_doc_id(text)
+        
+        stats = self._ingest(read_files(), skip_known_content=True)
+        stats.update(read_errors)
+        return stats
+    
+    def add_directory(self, directory: Union[str, Path], pattern: str = "*.txt",
+                      recursive: bool = True, encoding: str = "utf-8") -> Dict[str, Any]:
+        """
+        Strumieniowo dodaje wszystkie pliki z katalogu pasujące do wzorca (patrz add_files).
+        
+        Args:
+            directory: Katalog z dokumentami
+            pattern: Wzorzec nazw plików
+            recursive: Czy przeszukiwać podkatalogi
+            encoding: Kodowanie plików
+            
+        Returns:
+            Słownik ze statystykami dodawania dokumentów
+        """
+        directory = Path(directory)
+        if not directory.is_dir():
+            raise FileNotFoundError(f"Katalog nie istnieje: {directory}")
+        
+        # Stała kolejność plików - wznowione dodawanie przechodzi je w tym samym porządku
+        paths = directory.rglob(pattern) if recursive else directory.glob(pattern)
+        files = sorted(path for path in paths if path.is_file())
+        if self.debug_mode:
+            print(f"Znaleziono {len(files)} plików w {directory}")
+        return self.add_files(files, encoding=encoding)
+    
+    def update_document(self, document: str, doc_id: str) -> Dict[str, Any]:
+        """
+        Zastępuje zaindeksowany dokument nową wersją (np. po nowelizacji).
+        
+        Nowa wersja jest dzielona na chunki porównywane ze starymi po hashu tekstu:
+        embeddingi niezmienionych chunków są zachowane, a model liczy tylko chunki
+        zmienione. Chunki starej wersji są wycofywane z cache'u (rekordy "drop"
+        w dzienniku metadanych) i oznaczane jako usunięte w indeksach wyszukiwania,
+        a nowe dopisywane na końcu. Nieznany doc_id jest po prostu dodawany.
+        
+        Args:
+            document: Tekst nowej wersji dokumentu
+            doc_id: Identyfikator aktualizowanego dokumentu
+        
+        Returns:
+            Słownik ze statystykami aktualizacji
+        """
+        if doc_id not in self.document_index:
+            return self.add_document(document, doc_id)
+        
+        start_time = time.time()
         stats = {
-            "added_documents": 0,
-            "skipped_documents": 0,
-            "total_chunks": 0,
+            "updated_documents": 0,
+            "unchanged_chunks": 0,
             "new_chunks": 0,
+            "retired_chunks": 0,
+            "total_chunks": self._live_chunk_count(),
             "time_chunking": 0,
             "time_embedding": 0,
             "total_time": 0
         }
         
-        for doc, doc_id in zip(documents, doc_ids):
-            # Sprawdzamy, czy dokument już istnieje
-            if any(chunk.doc_id == doc_id for chunk in self.documents):
+        content_hash = hashlib.md5(document.encode()).hexdigest()
+        if self.document_index.content_hash(doc_id) == content_hash:
+            if self.debug_mode:
+                print(f"Dokument {doc_id} nie zmienił się, pomijam...")
+            stats["total_time"] = time.time() - start_time
+            return stats
+        
+        chunking_start = time.time()
+        chunks = self.chunker.split_text(document, doc_id=doc_id)
+        stats["time_chunking"] = time.time() - chunking_start
+        
+        with self._write_lock:
+            old_rows = self._document_rows(doc_id)
+            old_hashes = {self.cache._text_hash(self.documents[row].text): row for row in old_rows}
+        
+            # Niezmienione chunki zachowują swoje wektory, zmienione liczy model (przez cache)
+            new_hashes = [self.cache._text_hash(chunk.text) for chunk in chunks]
+            changed = [i for i, text_hash in enumerate(new_hashes) if text_hash not in old_hashes]
+            embedding_start = time.time()
+            changed_embeddings = self.cache.get_embeddings(
+                [chunks[i].text for i in changed],
+                self.embedder,
+                batch_size=self.embedding_batch_size
+            )
+            stats["time_embedding"] = time.time() - embedding_start
+            embeddings = [self.embeddings[old_hashes[text_hash]] if text_hash in old_hashes else None
+                          for text_hash in new_hashes]
+            for i, embedding in zip(changed, changed_embeddings):
+                embeddings[i] = embedding
+        
+            self.cache.save_cache(
+                chunks, embeddings,
+                document_hashes={doc_id: content_hash},
+                retired=[(doc_id, self.documents[row].chunk_id) for row in old_rows]
+            )
+        
+            # Stara wersja zostaje w listach jako usunięta do kompaktowania, nowa trafia
+            # na koniec - tak samo ułoży ją odczyt dziennika przy starcie
+            with self._index_lock.write():
+                self.retriever.tombstone(old_rows)
+                self.document_index.remove(doc_id)
+                self._append_documents(chunks, embeddings, {doc_id: (len(chunks), content_hash)})
+                self._update_retrieval_index()
+            self.answer_cache.invalidate()
+        
+            stats["updated_documents"] = 1
+            stats["unchanged_chunks"] = len(chunks) - len(changed)
+            stats["new_chunks"] = len(changed)
+            stats["retired_chunks"] = len(set(old_hashes) - set(new_hashes))
+            stats["total_chunks"] = self._live_chunk_count()
+        stats["total_time"] = time.time() - start_time
+        
+        if self.debug_mode:
+            print(f"Zaktualizowano dokument {doc_id}: {stats['new_chunks']} nowych chunków, "
+                  f"{stats['unchanged_chunks']} bez zmian, {stats['retired_chunks']} wycofanych")
+        
+        self._schedule_compaction()
+        return stats
+    
+    def remove_document(self, doc_id: str) -> Dict[str, Any]:
+        """
+        Usuwa dokument z systemu.
+        
+        Chunki dokumentu są od razu oznaczane jako usunięte w indeksach wyszukiwania
+        i wycofywane z dziennika metadanych, ale wiersze i wektory zostają na miejscu
+        do kompaktowania (compact), uruchamianego też w tle po przekroczeniu
+        compaction_threshold.
+        
+        Args:
+            doc_id: Identyfikator usuwanego dokumentu
+        
+        Returns:
+            Słownik ze statystykami usuwania
+        """
+        stats = {"removed_documents": 0, "removed_chunks": 0, "total_chunks": self._live_chunk_count()}
+        with self._write_lock:
+            if doc_id not in self.document_index:
                 if self.debug_mode:
-                    print(f"Dokument {doc_id} już istnieje, pomijam...")
-                stats["skipped_documents"] += 1
-                continue
-            
-            # Dzielimy dokument na chunki
-            chunk_start = time.time()
-            chunks = self.chunker.split_text(doc, doc_id=doc_id)
-            stats["time_chunking"] += time.time() - chunk_start
-            
-            # Obliczamy embeddingi i dodajemy do systemu
-            embed_start = time.time()
-            for chunk in chunks:
-                embedding = self.cache.get_embedding(chunk.text, self.embedder)
-                self.documents.append(chunk)
-                self.embeddings.append(embedding)
-                stats["new_chunks"] += 1
-            stats["time_embedding"] += time.time() - embed_start
-            
-            stats["added_documents"] += 1
+                    print(f"Dokument {doc_id} nie istnieje, pomijam...")
+                return stats
+        
+            rows = self._document_rows(doc_id)
+            with self._index_lock.write():
+                self.retriever.tombstone(rows)
+                self.document_index.remove(doc_id)
+            self.cache.remove_document(doc_id)
+            self.answer_cache.invalidate()
+        
+            stats["removed_documents"] = 1
+            stats["removed_chunks"] = len(rows)
+            stats["total_chunks"] = self._live_chunk_count()
+        
+        if self.debug_mode:
+            print(f"Usunięto dokument {doc_id} ({len(rows)} chunków)")
+        
+        self._schedule_compaction()
+        return stats
+    
+    def compact(self) -> Dict[str, Any]:
+        """
+        Usuwa z pamięci, z indeksów i z cache'u chunki oznaczone jako usunięte.
+        
+        Dziennik metadanych przepisywany jest do checkpointu, magazyn wektorów
+        bez osieroconych embeddingów, a listy chunków i indeksy wyszukiwania są
+        odtwarzane z cache'u. Listy, oznaczenia usuniętych i indeksy podmieniane są
+        razem pod blokadą zapisu - zapytania w toku kończą się na starym stanie,
+        a kolejne czekają na nowy.
+        
+        Returns:
+            Słownik ze statystykami kompaktowania
+        """
+        start_time = time.time()
+        with self._write_lock:
+            removed_chunks = len(self.retriever.tombstones)
+            cache_stats = self.cache.compact()
+            documents, embeddings = self.cache.load_cache()
+            with self._index_lock.write():
+                self.documents, self.embeddings = documents, embeddings
+                self.retriever.clear_tombstones()
+                self.document_index.rebuild(self.documents, self.cache.document_hashes)
+                self._update_retrieval_index()
+            self.compactions += 1
+        
+        stats = {
+            "removed_chunks": removed_chunks,
+            "removed_embeddings": cache_stats["removed_embeddings"],
+            "total_chunks": len(self.documents),
+            "total_time": time.time() - start_time
+        }
+        if self.debug_mode:
+            print(f"Kompaktowanie: usunięto {removed_chunks} chunków i "
+                  f"{stats['removed_embeddings']} embeddingów w {stats['total_time']:.2f}s")
+        return stats
+    
+    def wait_for_compaction(self, timeout: Optional[float] = None) -> None:
+        """Czeka na zakończenie kompaktowania w tle, jeśli trwa."""
+        thread = self._compaction_thread
+        if thread is not None:
+            thread.join(timeout)
+    
+    def _schedule_compaction(self) -> None:
+        """Uruchamia kompaktowanie w tle, gdy usuniętych chunków jest za dużo."""
+        if self.compaction_threshold is None or not self.documents:
+            return
+        if len(self.retriever.tombstones) / len(self.documents) < self.compaction_threshold:
+            return
+        if self._compaction_thread is not None and self._compaction_thread.is_alive():
+            return
+        self._compaction_thread = threading.Thread(target=self._compact_in_background,
+                                                   name="compaction", daemon=True)
+        self._compaction_thread.start()
+    
+    def _compact_in_background(self) -> None:
+        try:
+            self.compact()
+        except Exception as e:
+            print(f"Błąd kompaktowania w tle: {e}")
+    
+    def _document_rows(self, doc_id: str) -> List[int]:
+        return [row for start, end in self.document_index.chunk_ranges(doc_id) for row in range(start, end)]
+    
+    def _live_chunk_count(self) -> int:
+        return len(self.documents) - len(self.retriever.tombstones)
+    
+    @staticmethod
+    def _default_doc_id(document: str) -> str:
+        return f"doc_{hashlib.md5(document.encode()).hexdigest()[:10]}"
+    
+    def _ingest(self, documents: Iterable[Tuple[str, str]], skip_known_content: bool = False) -> Dict[str, Any]:
+        """
+        Przepuszcza pary (tekst, doc_id) przez potok ingestii, pomijając znane dokumenty.
         
-        stats["total_chunks"] = len(self.documents)
+        Args:
+            documents: Pary (tekst, doc_id), przetwarzane leniwie
+            skip_known_content: Czy pomijać też dokumenty o zaindeksowanej już treści
+            
+        Returns:
+            Słownik ze statystykami dodawania dokumentów
+        """
+        start_time = time.time()
+        stats = {
+            "added_documents": 0,
+            "skipped_documents": 0,
+            "total_chunks": 0,
+            "new_chunks": 0,
+            "time_chunking": 0,
+            "time_embedding": 0,
+            "time_writing": 0,
+            "total_time": 0
+        }
         
-        # Zapisujemy do cache'u tylko jeśli dodano nowe dokumenty
-        if stats["added_documents"] > 0:
-            self.cache.save_cache(self.documents, self.embeddings)
+        def new_documents():
+            seen_ids = set()
+            seen_content = set()
+            for doc, doc_id in documents:
+                # Sprawdzamy, czy dokument już istnieje
+                known = doc_id in seen_ids or doc_id in self.document_index
+                content_hash = None
+                if skip_known_content and not known:
+                    content_hash = hashlib.md5(doc.encode()).hexdigest()
+                    known = content_hash in seen_content or self.document_index.has_content(content_hash)
+                if known:
+                    if self.debug_mode:
+                        print(f"Dokument {doc_id} już istnieje, pomijam...")
+                    stats["skipped_documents"] += 1
+                    continue
+                seen_ids.add(doc_id)
+                if content_hash is not None:
+                    seen_content.add(content_hash)
+                yield doc, doc_id
+        
+        # Chunking, embedding (tylko braki w cache'u trafiają do modelu) i zapis paczkami.
+        # Każda zatwierdzona paczka od razu trafia do indeksu wyszukiwania (_commit_batch).
+        with self._write_lock:
+            chunks_before = len(self.documents)
+            try:
+                stats.update(self.ingestion.run(new_documents(), self._commit_batch))
+            finally:
+                if len(self.documents) > chunks_before:
+                    self.answer_cache.invalidate()
+            stats["total_chunks"] = self._live_chunk_count()
         
         stats["total_time"] = time.time() - start_time
         
@@ -149,8 +540,42 @@ class LegalRAGPipeline:
         
         return stats
     
+    def _commit_batch(self, batch: IngestionBatch) -> None:
+        """
+        Zatwierdza paczkę potoku ingestii: dopisuje ją do pipeline'u i indeksów wyszukiwania
+        (pod blokadą zapisu - zapytania widzą paczkę w całości albo wcale) i zapisuje w cache'u.
+        """
+        with self._index_lock.write():
+            self._append_documents(batch.chunks, batch.embeddings, batch.documents)
+            self._update_retrieval_index()
+        self.cache.save_cache(
+            batch.chunks, batch.embeddings,
+            document_hashes={doc_id: content_hash for doc_id, (_, content_hash) in batch.documents.items()}
+        )
+        if self.debug_mode:
+            print(f"Zapisano paczkę: {len(batch.documents)} dokumentów, {len(batch.chunks)} chunków "
+                  f"(łącznie {len(self.document_index)} dokumentów)")
+    
+    def _append_documents(self, chunks: List[Chunk], embeddings: List[np.ndarray],
+                          new_documents: Dict[str, Tuple[int, str]]) -> None:
+        """
+        Dopisuje chunki i embeddingi nowych dokumentów oraz rejestruje je w indeksie dokumentów.
+        
+        Args:
+            chunks: Chunki nowych dokumentów, w kolejności new_documents
+            embeddings: Embeddingi chunków
+            new_documents: Słownik {doc_id: (liczba chunków, hash treści)}
+        """
+        start = len(self.documents)
+        self.documents.extend(chunks)
+        self.embeddings.extend(embeddings)
+        for doc_id, (chunk_count, content_hash) in new_documents.items():
+            self.document_index.add(doc_id, self.documents, start, start + chunk_count, content_hash)
+            start += chunk_count
+    
     def smart_query(self, question: str, top_k: Optional[int] = None, 
-              min_score: Optional[float] = None, batch_threshold: int = 3) -> Dict[str, Any]:
+              min_score: Optional[float] = None, batch_threshold: int = 3,
+              stream: bool = False) -> Union[Dict[str, Any], Iterator[Dict[str, Any]]]:
         """
         Inteligentnie wybiera między standardowym query a query_large_context
         w zależności od liczby wyników wyszukiwania.
@@ -160,10 +585,15 @@ class LegalRAGPipeline:
             top_k: Opcjonalna liczba najlepszych dokumentów do użycia
             min_score: Opcjonalny minimalny próg podobieństwa
             batch_threshold: Próg liczby chunków, od którego używane jest przetwarzanie wsadowe
+            stream: Czy zwrócić iterator zdarzeń (patrz smart_query_stream)
             
         Returns:
-            Słownik z odpowiedzią i metadanymi
+            Słownik z odpowiedzią i metadanymi albo iterator zdarzeń, gdy stream=True
         """
+        if stream:
+            return self.smart_query_stream(question, top_k=top_k, min_score=min_score,
+                                           batch_threshold=batch_threshold)
+        
         # Najpierw wykonaj wyszukiwanie, aby sprawdzić liczbę znalezionych chunków
         start_time = time.time()
         
@@ -180,13 +610,7 @@ class LegalRAGPipeline:
             }
         
         # Etap 1: Wyszukiwanie semantyczne
-        retrieved_chunks = self.retriever.retrieve(
-            query=question,
-            documents=self.documents,
-            embeddings=self.embeddings,
-            top_k=top_k,
-            min_score=min_score
-        )
+        retrieved_chunks = self._retrieve(question, top_k, min_score)
         
         # W zależności od liczby znalezionych chunków, wybierz odpowiednią metodę przetwarzania
         if len(retrieved_chunks) > batch_threshold:
@@ -206,6 +630,143 @@ class LegalRAGPipeline:
                 min_score=min_score
             )
             
+    def smart_query_stream(self, question: str, top_k: Optional[int] = None,
+                           min_score: Optional[float] = None, batch_threshold: int = 3,
+                           batch_size: int = 2, max_batches: int = 16) -> Iterator[Dict[str, Any]]:
+        """
+        Strumieniowa wersja smart_query. Zwraca kolejno zdarzenia:
+        
+        - {"type": "retrieval", ...} - znalezione chunki i źródła, zaraz po wyszukiwaniu,
+        - {"type": "batches", ...} - szczegóły wsadów (tylko przy dużym kontekście),
+        - {"type": "token", "text": ...} - kolejne fragmenty odpowiedzi,
+        - {"type": "done", ...} - pełna odpowiedź i czasy, w tym time_to_first_token
+          (od początku zapytania do pierwszego fragmentu odpowiedzi).
+        
+        Przy dużym kontekście wsady generowane są równolegle, a strumieniowana
+        jest odpowiedź konsolidująca.
+        
+        Args:
+            question: Pytanie użytkownika
+            top_k: Opcjonalna liczba najlepszych dokumentów do użycia
+            min_score: Opcjonalny minimalny próg podobieństwa
+            batch_threshold: Próg liczby chunków, od którego używane jest przetwarzanie wsadowe
+            batch_size: Rozmiar wsadu przy dużym kontekście
+            max_batches: Maksymalna liczba wsadów przy dużym kontekście
+            
+        Returns:
+            Iterator zdarzeń (słowników)
+        """
+        start_time = time.time()
+        done = {
+            "type": "done",
+            "question": question,
+            "answer": "",
+            "cached": False,
+            "error": None,
+            "time_retrieval": 0,
+            "time_to_first_token": None,
+            "time_generation": 0,
+            "total_time": 0
+        }
+        
+        if not self.documents:
+            done["answer"] = "Brak dokumentów do przeszukania. Dodaj dokumenty przed zadawaniem pytań."
+            done["total_time"] = time.time() - start_time
+            yield done
+            return
+        
+        # Etap 1: Wyszukiwanie semantyczne - wyniki wysyłamy od razu
+        retrieved_chunks = self._retrieve(question, top_k, min_score)
+        done["time_retrieval"] = time.time() - start_time
+        large_context = len(retrieved_chunks) > batch_threshold
+        used_chunks = retrieved_chunks[:batch_size * max_batches] if large_context else retrieved_chunks
+        
+        yield {
+            "type": "retrieval",
+            "chunks": [{
+                "doc_id": chunk.doc_id,
+                "chunk_id": chunk.chunk_id,
+                "score": float(score),
+                "text_length": len(chunk.text)
+            } for chunk, score in retrieved_chunks],
+            "sources": [{
+                "doc_id": chunk.doc_id,
+                "chunk_id": chunk.chunk_id,
+                "score": float(score),
+                "preview": chunk.text[:150] + "..." if len(chunk.text) > 150 else chunk.text
+            } for chunk, score in used_chunks],
+            "large_context": large_context,
+            "time_retrieval": done["time_retrieval"]
+        }
+        
+        if not retrieved_chunks:
+            done["answer"] = "Na podstawie dostępnych danych nie mogę odpowiedzieć na to pytanie."
+            done["total_time"] = time.time() - start_time
+            yield done
+            return
+        
+        # Etap 2: Generacja - źródło fragmentów odpowiedzi zależy od trybu
+        generation_start = time.time()
+        mode = ("large_context", batch_size, max_batches) if large_context else "query"
+        cached_answer, cache_key = self._lookup_answer(question, retrieved_chunks, mode)
+        complete = True
+        fallback = ""
+        
+        if cached_answer is not None:
+            done["cached"] = True
+            fragments = iter([cached_answer])
+        elif large_context:
+            batches = self._split_batches(retrieved_chunks, batch_size, max_batches)
+            details = self._generate_batches(question, batches, self.generation_concurrency, self.batch_timeout)
+            yield {"type": "batches", "batch_details": [{k: v for k, v in d.items() if k != "answer"} for d in details]}
+            
+            batch_answers = [d for d in details if d["status"] == "ok"]
+            complete = len(batch_answers) == len(details)
+            if not batch_answers:
+                done["error"] = "Żaden wsad nie wygenerował odpowiedzi"
+                fragments = iter([])
+            elif len(batch_answers) == 1:
+                fragments = iter([batch_answers[0]["answer"]])
+            else:
+                system_prompt, consolidation_prompt = self._consolidation_prompts(question, batch_answers, len(batches))
+                fragments = self.generator.stream_completion(
+                    prompt=consolidation_prompt,
+                    system_prompt=system_prompt,
+                    temperature=0.1,
+                    max_tokens=8000,
+                    timeout=60
+                )
+                # Jeśli konsolidacja się nie powiedzie, wysyłamy połączone odpowiedzi wsadów
+                fallback = "\n\n".join(f"Część {a['batch_id']}/{len(batches)}:\n{a['answer']}" for a in batch_answers)
+        else:
+            fragments = self.generator.generate(question, [chunk for chunk, _ in retrieved_chunks], stream=True)
+        
+        parts = []
+        try:
+            for text in fragments:
+                if done["time_to_first_token"] is None:
+                    done["time_to_first_token"] = time.time() - start_time
+                parts.append(text)
+                yield {"type": "token", "text": text}
+        except Exception as e:
+            print(f"Błąd podczas strumieniowania odpowiedzi: {str(e)}")
+            done["error"] = str(e)
+            if fallback and not parts:
+                if done["time_to_first_token"] is None:
+                    done["time_to_first_token"] = time.time() - start_time
+                parts.append(fallback)
+                complete = False
+                yield {"type": "token", "text": fallback}
+        
+        done["answer"] = "".join(parts)
+        if not done["answer"]:
+            done["answer"] = "Nie udało się wygenerować odpowiedzi. Spróbuj ponownie później."
+        elif done["error"] is None and complete and not done["cached"]:
+            self._store_answer(cache_key, done["answer"])
+        done["time_generation"] = time.time() - generation_start
+        done["total_time"] = time.time() - start_time
+        yield done
+    
     def query(self, question: str, top_k: Optional[int] = None, 
           min_score: Optional[float] = None, retrieved_chunks: Optional[List[Tuple[Chunk, float]]] = None) -> Dict[str, Any]:
         """
@@ -227,6 +788,7 @@ class LegalRAGPipeline:
             "answer": "",
             "sources": [],
             "chunks": [],
+            "cached": False,
             "time_retrieval": 0,
             "time_generation": 0,
             "total_time": 0
@@ -240,13 +802,7 @@ class LegalRAGPipeline:
         # Etap 1: Wyszukiwanie semantyczne (jeśli nie zostało już wykonane)
         retrieval_start = time.time()
         if retrieved_chunks is None:
-            retrieved_chunks = self.retriever.retrieve(
-                query=question,
-                documents=self.documents,
-                embeddings=self.embeddings,
-                top_k=top_k,
-                min_score=min_score
-            )
+            retrieved_chunks = self._retrieve(question, top_k, min_score)
         result["time_retrieval"] = time.time() - retrieval_start
         
         # Zapisujemy informacje o znalezionych chunkach
@@ -263,12 +819,19 @@ class LegalRAGPipeline:
             result["total_time"] = time.time() - start_time
             return result
         
-        # Etap 2: Generacja odpowiedzi
+        # Etap 2: Generacja odpowiedzi (albo odpowiedź z cache'u dla tych samych źródeł)
         generation_start = time.time()
-        contexts = [chunk for chunk, _ in retrieved_chunks]
-        raw_answer = self.generator.generate(question, contexts)
+        cached_answer, cache_key = self._lookup_answer(question, retrieved_chunks, mode="query")
+        if cached_answer is not None:
+            result["answer"] = cached_answer
+            result["cached"] = True
+        else:
+            contexts = [chunk for chunk, _ in retrieved_chunks]
+            answer, error = self._answer_text(self.generator.generate(question, contexts))
+            result["answer"] = answer
+            if answer and not error:
+                self._store_answer(cache_key, answer)
         result["time_generation"] = time.time() - generation_start
-        result["answer"] = raw_answer
         
         # Przygotowanie informacji o źródłach
         for chunk, score in retrieved_chunks:
@@ -284,11 +847,79 @@ class LegalRAGPipeline:
         
         return result
     
+    def _retrieve(self, question: str, top_k: Optional[int],
+                  min_score: Optional[float]) -> List[Tuple[Chunk, float]]:
+        """Wyszukiwanie na spójnym stanie list chunków i indeksów (pod blokadą odczytu)."""
+        with self._index_lock.read():
+            return self.retriever.retrieve(
+                query=question,
+                documents=self.documents,
+                embeddings=self.embeddings,
+                top_k=top_k,
+                min_score=min_score
+            )
+    
+    def _lookup_answer(self, question: str, retrieved_chunks: List[Tuple[Chunk, float]],
+                       mode: Any) -> Tuple[Optional[str], Optional[Tuple]]:
+        """
+        Szuka odpowiedzi w cache'u odpowiedzi.
+        
+        Returns:
+            Krotka (odpowiedź albo None, klucz do zapisania nowej odpowiedzi przez _store_answer
+            albo None, gdy odpowiedź nie jest cache'owana)
+        """
+        evidence = SemanticAnswerCache.evidence_key((chunk.doc_id, chunk.chunk_id) for chunk, _ in retrieved_chunks)
+        with self._index_lock.read():
+            structural_hit = self.retriever.structural_rows(question) is not None
+        if structural_hit:
+            # Jednoznaczne odwołanie (ta sama bramka co w retrieve) nie wymaga embeddingu pytania -
+            # wpis kluczowany jest wskazanymi chunkami i znormalizowaną treścią pytania
+            query_embedding = None
+            mode = ("structural", mode, " ".join(question.lower().split()))
+        else:
+            query_embedding = self.retriever.embed_query(question)
+        cache_key = (query_embedding, evidence, mode, self.answer_cache.generation)
+        answer = self.answer_cache.get(query_embedding, evidence, mode)
+        if answer is not None and self.debug_mode:
+            print("Odpowiedź z cache'u odpowiedzi")
+        return answer, cache_key
+    
+    def _store_answer(self, cache_key: Optional[Tuple], answer: str) -> None:
+        if cache_key is None:
+            return
+        query_embedding, evidence, mode, generation = cache_key
+        self.answer_cache.put(query_embedding, evidence, answer, mode=mode, generation=generation)
+    
+    @staticmethod
+    def _answer_text(generation: Any) -> Tuple[str, Optional[str]]:
+        """
+        Wyciąga tekst odpowiedzi z wyniku generator.generate.
+        
+        Returns:
+            Krotka (odpowiedź, opis błędu albo None)
+        """
+        if isinstance(generation, dict):
+            return generation.get("answer", ""), generation.get("error")
+        return generation or "", None
+    
     def clear(self) -> None:
         """Czyści wszystkie dokumenty i embeddingi z systemu."""
-        self.documents = []
-        self.embeddings = []
-        self.cache.clear_cache()
+        with self._write_lock:
+            with self._index_lock.write():
+                self.documents = []
+                self.embeddings = []
+                self.document_index.clear()
+                self.retriever.clear_tombstones()
+                self.retriever.index.reset()
+                if self.retriever.sparse_index is not None:
+                    self.retriever.sparse_index.reset()
+                if self.retriever.structural_index is not None:
+                    self.retriever.structural_index.reset()
+            self.answer_cache.invalidate()
+            for index_path in (self._ivf_index_path, self._bm25_index_path):
+                if index_path.exists():
+                    index_path.unlink()
+            self.cache.clear_cache()
         if self.debug_mode:
             print("Wyczyszczono wszystkie dokumenty i cache")
     
@@ -299,31 +930,27 @@ class LegalRAGPipeline:
         Returns:
             Słownik ze statystykami
         """
-        # Zbieramy unikalne dokumenty
-        unique_docs = set()
-        for chunk in self.documents:
-            unique_docs.add(chunk.doc_id)
-        
-        # Zbieramy statystyki dla każdego dokumentu
+        # Statystyki dokumentów pochodzą z indeksu - bez skanowania wszystkich chunków
         doc_stats = {}
-        for doc_id in unique_docs:
-            doc_chunks = [chunk for chunk in self.documents if chunk.doc_id == doc_id]
+        for doc_id in self.document_index:
             doc_stats[doc_id] = {
-                "chunks": len(doc_chunks),
-                "total_text_length": sum(len(chunk.text) for chunk in doc_chunks)
+                "chunks": self.document_index.chunk_count(doc_id),
+                "total_text_length": self.document_index.text_length(doc_id)
             }
         
         # Zbieramy statystyki embeddera
         embedder_info = {
             "model": self.embedder.model_name,
-            "embedding_dim": self.embeddings[0].shape[0] if self.embeddings else 0,
+            "embedding_dim": self.embeddings[0].shape[-1] if self.embeddings else 0,
             "using_gpu": self.embedder.use_gpu
         }
         
         return {
             "documents": {
-                "count": len(unique_docs),
-                "total_chunks": len(self.documents),
+                "count": len(self.document_index),
+                "total_chunks": self._live_chunk_count(),
+                "tombstoned_chunks": len(self.retriever.tombstones),
+                "compactions": self.compactions,
                 "per_document": doc_stats
             },
             "embedder": embedder_info,
@@ -333,28 +960,118 @@ class LegalRAGPipeline:
             },
             "retriever": {
                 "min_score_threshold": self.retriever.min_score_threshold,
-                "max_top_k": self.retriever.max_top_k
+                "max_top_k": self.retriever.max_top_k,
+                "index": type(self.retriever.index).__name__,
+                "index_memory_bytes": (self.retriever.index.memory_bytes
+                                       if isinstance(self.retriever.index, QuantizedIndex)
+                                       else self.retriever.index.matrix.nbytes),
+                "query_cache": self.retriever.query_cache.get_stats(),
+                "sparse_index": {
+                    "chunks": len(self.retriever.sparse_index),
+                    "vocabulary": self.retriever.sparse_index.vocabulary_size
+                } if self.retriever.sparse_index is not None else None,
+                "structural_index": {
+                    "chunks": len(self.retriever.structural_index),
+                    "references": self.retriever.structural_index.reference_count,
+                    "hits": self.retriever.structural_hits
+                } if self.retriever.structural_index is not None else None,
+                "reranker": self.retriever.reranker.get_stats() if self.retriever.reranker is not None else None
+            },
+            "answer_cache": self.answer_cache.get_stats(),
+            "clients": self.clients.get_stats(),
+            "generation": {
+                "retry": self.generator.retry_policy.get_stats()
+                         if hasattr(self.generator, "retry_policy") else None,
+                "circuit_breaker": self.generator.circuit_breaker.get_stats()
+                                   if hasattr(self.generator, "circuit_breaker") else None,
+                "context_packer": self.generator.context_packer.get_stats()
+                                  if hasattr(self.generator, "context_packer") else None
             }
         }
     
     def process_in_batches(self, question: str, chunks: List[Tuple[Chunk, float]], 
-                        batch_size: int = 4, max_batches: int = 4) -> str:
+                        batch_size: int = 4, max_batches: int = 4,
+                        max_concurrency: Optional[int] = None,
+                        batch_timeout: Optional[float] = None,
+                        batch_details: Optional[List[Dict[str, Any]]] = None) -> str:
         """
         Przetwarza duże zestawy chunków w mniejszych wsadach i konsoliduje odpowiedzi.
         
+        Wsady generowane są równolegle (co najwyżej max_concurrency naraz). Wsad,
+        który zakończy się błędem albo przekroczy batch_timeout, jest pomijany,
+        a konsolidacja startuje, gdy tylko wszystkie wsady się zakończą.
+        
         Args:
             question: Pytanie użytkownika
             chunks: Lista chunków (Chunk, score) zwróconych przez retriever
             batch_size: Rozmiar pojedynczego wsadu (liczba chunków)
             max_batches: Maksymalna liczba wsadów do przetworzenia
+            max_concurrency: Maksymalna liczba równoległych wywołań LLM (domyślnie self.generation_concurrency)
+            batch_timeout: Limit czasu jednego wsadu w sekundach (domyślnie self.batch_timeout)
+            batch_details: Opcjonalna lista, do której trafiają szczegóły i czasy wsadów
             
         Returns:
-            Skonsolidowana odpowiedź ze wszystkich wsadów
+            Skonsolidowana odpowiedź ze wszystkich wsadów (pusta, gdy żaden wsad się nie powiódł)
+        """
+        return self._process_in_batches(question, chunks, batch_size, max_batches, max_concurrency,
+                                        batch_timeout, batch_details)[0]
+    
+    def _process_in_batches(self, question: str, chunks: List[Tuple[Chunk, float]],
+                            batch_size: int, max_batches: int,
+                            max_concurrency: Optional[int] = None,
+                            batch_timeout: Optional[float] = None,
+                            batch_details: Optional[List[Dict[str, Any]]] = None) -> Tuple[str, bool]:
+        """
+        Implementacja process_in_batches.
+        
+        Returns:
+            Krotka (odpowiedź, czy jest pełna - wszystkie wsady się powiodły, a odpowiedzi
+            zostały skonsolidowane, a nie tylko połączone po błędzie konsolidacji)
         """
         if not chunks:
-            return "Nie znaleziono odpowiednich fragmentów dla tego pytania."
+            return "Nie znaleziono odpowiednich fragmentów dla tego pytania.", False
+        
+        batches = self._split_batches(chunks, batch_size, max_batches)
+        
+        # Generujemy odpowiedzi dla wszystkich wsadów równolegle
+        details = self._generate_batches(
+            question, batches,
+            max_concurrency=max_concurrency if max_concurrency is not None else self.generation_concurrency,
+            batch_timeout=batch_timeout if batch_timeout is not None else self.batch_timeout
+        )
+        if batch_details is not None:
+            batch_details.extend({k: v for k, v in d.items() if k != "answer"} for d in details)
         
-        # Dzielimy chunki na mniejsze wsady
+        # Odpowiedzi wsadów zakończonych błędem są pomijane
+        batch_answers = [d for d in details if d["status"] == "ok"]
+        if not batch_answers:
+            print("Żaden wsad nie wygenerował odpowiedzi")
+            return "", False
+        all_batches_ok = len(batch_answers) == len(details)
+        
+        # Konsolidujemy odpowiedzi z wszystkich wsadów
+        if len(batch_answers) == 1:
+            return batch_answers[0]["answer"], all_batches_ok
+        
+        system_prompt, consolidation_prompt = self._consolidation_prompts(question, batch_answers, len(batches))
+        
+        consolidated_answer = self._call_anthropic(
+            prompt=consolidation_prompt,
+            system_prompt=system_prompt,
+            temperature=0.1,
+            max_tokens=8000,
+            timeout=60
+        )
+        
+        if not consolidated_answer:
+            # Jeśli konsolidacja się nie powiodła, zwróć połączone odpowiedzi (niepełne - bez cache'u)
+            return "\n\n".join([f"Część {a['batch_id']}/{len(batches)}:\n{a['answer']}" for a in batch_answers]), False
+        
+        return consolidated_answer, all_batches_ok
+
+    def _split_batches(self, chunks: List[Tuple[Chunk, float]], batch_size: int,
+                       max_batches: int) -> List[List[Tuple[Chunk, float]]]:
+        """Dzieli chunki (od najlepszego wyniku) na co najwyżej max_batches wsadów po batch_size."""
         batches = []
         chunks_sorted = sorted(chunks, key=lambda x: x[1], reverse=True)  # Sortuj według score
         
@@ -368,32 +1085,18 @@ class LegalRAGPipeline:
         if self.debug_mode:
             print(f"Podzielono {total_chunks} chunków na {len(batches)} wsady po {batch_size}.")
         
-        # Generujemy odpowiedź dla każdego wsadu
-        batch_answers = []
-        for i, batch in enumerate(batches):
-            if self.debug_mode:
-                print(f"Przetwarzanie wsadu {i+1}/{len(batches)}...")
-            
-            # Przygotuj konteksty dla tego wsadu
-            contexts = [chunk for chunk, _ in batch]
-            
-            # Wygeneruj odpowiedź dla tego wsadu chunków
-            batch_question = f"{question} (część {i+1}/{len(batches)})"
-            batch_answer = self.generator.generate(batch_question, contexts)
-            
-            batch_answers.append({
-                "batch_id": i+1,
-                "question": batch_question,
-                "answer": batch_answer,
-                "chunks": [{"doc_id": c.doc_id, "chunk_id": c.chunk_id, "score": s} for c, s in batch]
-            })
-        
-        # Konsolidujemy odpowiedzi z wszystkich wsadów
-        if len(batch_answers) == 1:
-            return batch_answers[0]["answer"]
+        return batches
+    
+    def _consolidation_prompts(self, question: str, batch_answers: List[Dict[str, Any]],
+                               batch_count: int) -> Tuple[str, str]:
+        """
+        Buduje prompty konsolidacji odpowiedzi wsadów.
         
+        Returns:
+            Krotka (prompt systemowy, prompt użytkownika)
+        """
         # Przygotuj odpowiedzi do konsolidacji
-        answers_to_consolidate = [f"CZĘŚĆ {a['batch_id']}/{len(batches)}:\n{a['answer']}" for a in batch_answers]
+        answers_to_consolidate = [f"CZĘŚĆ {a['batch_id']}/{batch_count}:\n{a['answer']}" for a in batch_answers]
         answers_text = "\n\n".join(answers_to_consolidate)
         
         # Konsolidujemy odpowiedzi
@@ -423,19 +1126,77 @@ class LegalRAGPipeline:
         z powyższych części. Usuń powtórzenia i połącz informacje logicznie.
         """
         
-        consolidated_answer = self._call_anthropic(
-            prompt=consolidation_prompt,
-            system_prompt=system_prompt,
-            temperature=0.1,
-            max_tokens=8000,
-            timeout=60
-        )
+        return system_prompt, consolidation_prompt
+    
+    def _generate_batches(self, question: str, batches: List[List[Tuple[Chunk, float]]],
+                          max_concurrency: int, batch_timeout: float) -> List[Dict[str, Any]]:
+        """
+        Generuje odpowiedzi dla wsadów w puli wątków.
         
-        if not consolidated_answer:
-            # Jeśli konsolidacja się nie powiodła, zwróć połączone odpowiedzi
-            return "\n\n".join([f"Część {a['batch_id']}/{len(batches)}:\n{a['answer']}" for a in batch_answers])
+        Limit czasu liczony jest od startu wsadu, więc wsady czekające na wolny
+        wątek nie tracą swojego czasu. Przekroczenie limitu przerywa tylko
+        oczekiwanie - wynik spóźnionego wywołania jest odrzucany.
         
-        return consolidated_answer
+        Returns:
+            Lista szczegółów wsadów w ich kolejności (status: "ok", "error" lub "timeout")
+        """
+        details = [{
+            "batch_id": i + 1,
+            "question": f"{question} (część {i + 1}/{len(batches)})",
+            "chunks": [{"doc_id": c.doc_id, "chunk_id": c.chunk_id, "score": float(s)} for c, s in batch],
+            "status": "pending",
+            "answer": "",
+            "error": None,
+            "latency": None
+        } for i, batch in enumerate(batches)]
+        started: Dict[int, float] = {}
+        
+        def generate_batch(i: int) -> Tuple[str, Optional[str]]:
+            started[i] = time.time()
+            contexts = [chunk for chunk, _ in batches[i]]
+            return self._answer_text(self.generator.generate(details[i]["question"], contexts))
+        
+        executor = ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(batches))),
+                                      thread_name_prefix="batch-generation")
+        try:
+            pending = {executor.submit(generate_batch, i): i for i in range(len(batches))}
+            while pending:
+                # Czekamy najwyżej do najbliższego upływu limitu czasu uruchomionego wsadu
+                deadlines = [started[i] + batch_timeout for i in pending.values() if i in started]
+                wait_timeout = max(0.0, min(deadlines, default=time.time() + batch_timeout) - time.time())
+                done, _ = wait(list(pending), timeout=wait_timeout, return_when=FIRST_COMPLETED)
+                
+                for future in done:
+                    i = pending.pop(future)
+                    detail = details[i]
+                    detail["latency"] = time.time() - started.get(i, time.time())
+                    try:
+                        answer, error = future.result()
+                    except Exception as e:
+                        answer, error = "", str(e)
+                    if error or not answer:
+                        detail["status"] = "error"
+                        detail["error"] = error or "Pusta odpowiedź"
+                    else:
+                        detail["status"] = "ok"
+                        detail["answer"] = answer
+                
+                now = time.time()
+                for future, i in list(pending.items()):
+                    if i in started and now - started[i] >= batch_timeout:
+                        future.cancel()
+                        del pending[future]
+                        details[i].update(status="timeout", latency=now - started[i],
+                                          error=f"Przekroczono limit czasu {batch_timeout}s")
+        finally:
+            # Nie czekamy na spóźnione wywołania - ich wyniki i tak są odrzucane
+            executor.shutdown(wait=False, cancel_futures=True)
+        
+        if self.debug_mode:
+            for detail in details:
+                print(f"Wsad {detail['batch_id']}/{len(batches)}: {detail['status']} ({detail['latency'] or 0:.2f}s)")
+        
+        return details
 
     def query_large_context(self, question: str, top_k: Optional[int] = None, 
                        min_score: Optional[float] = None, 
@@ -464,6 +1225,7 @@ class LegalRAGPipeline:
             "sources": [],
             "chunks": [],
             "batch_details": [],
+            "cached": False,
             "time_retrieval": 0,
             "time_generation": 0,
             "time_consolidation": 0,
@@ -480,13 +1242,7 @@ class LegalRAGPipeline:
         if retrieved_chunks is None:
             effective_top_k = top_k if top_k is not None else batch_size * max_batches
             
-            retrieved_chunks = self.retriever.retrieve(
-                query=question,
-                documents=self.documents,
-                embeddings=self.embeddings,
-                top_k=effective_top_k,
-                min_score=min_score
-            )
+            retrieved_chunks = self._retrieve(question, effective_top_k, min_score)
         result["time_retrieval"] = time.time() - retrieval_start
         
         # Zapisujemy informacje o znalezionych chunkach
@@ -503,18 +1259,31 @@ class LegalRAGPipeline:
             result["total_time"] = time.time() - start_time
             return result
         
-        # Etap 2: Generacja odpowiedzi z użyciem batchowania
+        # Etap 2: Generacja odpowiedzi z użyciem batchowania (albo odpowiedź z cache'u)
         generation_start = time.time()
-        consolidated_answer = self.process_in_batches(
-            question=question,
-            chunks=retrieved_chunks,
-            batch_size=batch_size,
-            max_batches=max_batches
+        cached_answer, cache_key = self._lookup_answer(
+            question, retrieved_chunks, mode=("large_context", batch_size, max_batches)
         )
+        if cached_answer is not None:
+            result["answer"] = cached_answer
+            result["cached"] = True
+        else:
+            consolidated_answer, complete = self._process_in_batches(
+                question=question,
+                chunks=retrieved_chunks,
+                batch_size=batch_size,
+                max_batches=max_batches,
+                batch_details=result["batch_details"]
+            )
+            if not consolidated_answer:
+                result["answer"] = "Nie udało się wygenerować odpowiedzi. Spróbuj ponownie później."
+            else:
+                result["answer"] = consolidated_answer
+                # Odpowiedź z pominiętymi wsadami albo bez konsolidacji jest niepełna - nie trafia do cache'u
+                if complete:
+                    self._store_answer(cache_key, consolidated_answer)
         result["time_generation"] = time.time() - generation_start
         
-        result["answer"] = consolidated_answer
-        
         # Przygotowanie informacji o źródłach
         for chunk, score in retrieved_chunks[:batch_size * max_batches]:
             chunk_preview = chunk.text[:100] + "..." if len(chunk.text) > 100 else chunk.text
@@ -529,6 +1298,272 @@ class LegalRAGPipeline:
         
         return result
     
+    async def asmart_query(self, question: str, top_k: Optional[int] = None,
+                           min_score: Optional[float] = None, batch_threshold: int = 3) -> Dict[str, Any]:
+        """
+        Asynchroniczna wersja smart_query.
+        
+        Wyszukiwanie i embedding pytania wykonywane są w puli wątków, a wywołania
+        LLM przez asynchronicznych klientów generatora, więc wiele pytań może
+        korzystać z jednej instancji pipeline'u bez osobnego wątku na zapytanie.
+        
+        Args:
+            question: Pytanie użytkownika
+            top_k: Opcjonalna liczba najlepszych dokumentów do użycia
+            min_score: Opcjonalny minimalny próg podobieństwa
+            batch_threshold: Próg liczby chunków, od którego używane jest przetwarzanie wsadowe
+            
+        Returns:
+            Słownik z odpowiedzią i metadanymi
+        """
+        if not self.documents:
+            return await self.aquery(question, top_k=top_k, min_score=min_score)
+        
+        retrieved_chunks = await self._aretrieve(question, top_k, min_score)
+        if len(retrieved_chunks) > batch_threshold:
+            return await self.aquery_large_context(question, min_score=min_score, retrieved_chunks=retrieved_chunks)
+        return await self.aquery(question, min_score=min_score, retrieved_chunks=retrieved_chunks)
+    
+    async def aquery(self, question: str, top_k: Optional[int] = None,
+                     min_score: Optional[float] = None,
+                     retrieved_chunks: Optional[List[Tuple[Chunk, float]]] = None) -> Dict[str, Any]:
+        """
+        Asynchroniczna wersja query - zwraca słownik o tej samej postaci.
+        
+        Args:
+            question: Pytanie użytkownika
+            top_k: Opcjonalna liczba najlepszych dokumentów do użycia
+            min_score: Opcjonalny minimalny próg podobieństwa
+            retrieved_chunks: Opcjonalna lista już znalezionych chunków
+            
+        Returns:
+            Słownik z odpowiedzią i metadanymi
+        """
+        start_time = time.time()
+        
+        result = {
+            "question": question,
+            "answer": "",
+            "sources": [],
+            "chunks": [],
+            "cached": False,
+            "time_retrieval": 0,
+            "time_generation": 0,
+            "total_time": 0
+        }
+        
+        if not self.documents:
+            result["answer"] = "Brak dokumentów do przeszukania. Dodaj dokumenty przed zadawaniem pytań."
+            result["total_time"] = time.time() - start_time
+            return result
+        
+        retrieval_start = time.time()
+        if retrieved_chunks is None:
+            retrieved_chunks = await self._aretrieve(question, top_k, min_score)
+        result["time_retrieval"] = time.time() - retrieval_start
+        result["chunks"] = [{
+            "doc_id": chunk.doc_id,
+            "chunk_id": chunk.chunk_id,
+            "score": float(score),
+            "text_length": len(chunk.text)
+        } for chunk, score in retrieved_chunks]
+        
+        if not retrieved_chunks:
+            result["answer"] = "Na podstawie dostępnych danych nie mogę odpowiedzieć na to pytanie."
+            result["total_time"] = time.time() - start_time
+            return result
+        
+        generation_start = time.time()
+        cached_answer, cache_key = await asyncio.to_thread(self._lookup_answer, question, retrieved_chunks, "query")
+        if cached_answer is not None:
+            result["answer"] = cached_answer
+            result["cached"] = True
+        else:
+            answer, error = await self._agenerate(question, [chunk for chunk, _ in retrieved_chunks])
+            result["answer"] = answer
+            if answer and not error:
+                self._store_answer(cache_key, answer)
+        result["time_generation"] = time.time() - generation_start
+        
+        result["sources"] = [{
+            "doc_id": chunk.doc_id,
+            "chunk_id": chunk.chunk_id,
+            "score": float(score),
+            "preview": chunk.text[:150] + "..." if len(chunk.text) > 150 else chunk.text
+        } for chunk, score in retrieved_chunks]
+        result["total_time"] = time.time() - start_time
+        
+        return result
+    
+    async def aquery_large_context(self, question: str, top_k: Optional[int] = None,
+                                   min_score: Optional[float] = None,
+                                   batch_size: int = 2,
+                                   max_batches: int = 16,
+                                   retrieved_chunks: Optional[List[Tuple[Chunk, float]]] = None) -> Dict[str, Any]:
+        """
+        Asynchroniczna wersja query_large_context. Wsady generowane są jako
+        współbieżne zadania asyncio (co najwyżej self.generation_concurrency naraz).
+        
+        Args:
+            question: Pytanie użytkownika
+            top_k: Opcjonalna liczba najlepszych dokumentów do użycia (może być duża)
+            min_score: Opcjonalny minimalny próg podobieństwa
+            batch_size: Rozmiar pojedynczego wsadu (liczba chunków)
+            max_batches: Maksymalna liczba wsadów do przetworzenia
+            retrieved_chunks: Opcjonalna lista już znalezionych chunków
+            
+        Returns:
+            Słownik z odpowiedzią i metadanymi
+        """
+        start_time = time.time()
+        
+        result = {
+            "question": question,
+            "answer": "",
+            "sources": [],
+            "chunks": [],
+            "batch_details": [],
+            "cached": False,
+            "time_retrieval": 0,
+            "time_generation": 0,
+            "time_consolidation": 0,
+            "total_time": 0
+        }
+        
+        if not self.documents:
+            result["answer"] = "Brak dokumentów do przeszukania. Dodaj dokumenty przed zadawaniem pytań."
+            result["total_time"] = time.time() - start_time
+            return result
+        
+        retrieval_start = time.time()
+        if retrieved_chunks is None:
+            effective_top_k = top_k if top_k is not None else batch_size * max_batches
+            retrieved_chunks = await self._aretrieve(question, effective_top_k, min_score)
+        result["time_retrieval"] = time.time() - retrieval_start
+        result["chunks"] = [{
+            "doc_id": chunk.doc_id,
+            "chunk_id": chunk.chunk_id,
+            "score": float(score),
+            "text_length": len(chunk.text)
+        } for chunk, score in retrieved_chunks]
+        
+        if not retrieved_chunks:
+            result["answer"] = "Na podstawie dostępnych danych nie mogę odpowiedzieć na to pytanie."
+            result["total_time"] = time.time() - start_time
+            return result
+        
+        generation_start = time.time()
+        cached_answer, cache_key = await asyncio.to_thread(
+            self._lookup_answer, question, retrieved_chunks, ("large_context", batch_size, max_batches)
+        )
+        if cached_answer is not None:
+            result["answer"] = cached_answer
+            result["cached"] = True
+        else:
+            batches = self._split_batches(retrieved_chunks, batch_size, max_batches)
+            details = await self._agenerate_batches(question, batches, self.generation_concurrency, self.batch_timeout)
+            result["batch_details"] = [{k: v for k, v in d.items() if k != "answer"} for d in details]
+            
+            batch_answers = [d for d in details if d["status"] == "ok"]
+            answer = ""
+            complete = len(batch_answers) == len(details)
+            if len(batch_answers) == 1:
+                answer = batch_answers[0]["answer"]
+            elif batch_answers:
+                consolidation_start = time.time()
+                system_prompt, consolidation_prompt = self._consolidation_prompts(question, batch_answers, len(batches))
+                answer = await self._acomplete(consolidation_prompt, system_prompt,
+                                               temperature=0.1, max_tokens=8000, timeout=60)
+                if not answer:
+                    # Połączone odpowiedzi wsadów nie są skonsolidowaną odpowiedzią - bez cache'u
+                    answer = "\n\n".join(f"Część {a['batch_id']}/{len(batches)}:\n{a['answer']}" for a in batch_answers)
+                    complete = False
+                result["time_consolidation"] = time.time() - consolidation_start
+            
+            if not answer:
+                result["answer"] = "Nie udało się wygenerować odpowiedzi. Spróbuj ponownie później."
+            else:
+                result["answer"] = answer
+                if complete:
+                    self._store_answer(cache_key, answer)
+        result["time_generation"] = time.time() - generation_start
+        
+        result["sources"] = [{
+            "doc_id": chunk.doc_id,
+            "chunk_id": chunk.chunk_id,
+            "score": float(score),
+            "preview": chunk.text[:100] + "..." if len(chunk.text) > 100 else chunk.text
+        } for chunk, score in retrieved_chunks[:batch_size * max_batches]]
+        result["total_time"] = time.time() - start_time
+        
+        return result
+    
+    async def _aretrieve(self, question: str, top_k: Optional[int],
+                         min_score: Optional[float]) -> List[Tuple[Chunk, float]]:
+        """Wyszukiwanie (z embeddingiem pytania) w puli wątków, poza pętlą zdarzeń."""
+        return await asyncio.to_thread(self._retrieve, question, top_k, min_score)
+    
+    async def _agenerate(self, question: str, contexts: List[Chunk]) -> Tuple[str, Optional[str]]:
+        """Generuje odpowiedź asynchronicznie; generator bez agenerate działa w puli wątków."""
+        if hasattr(self.generator, "agenerate"):
+            generation = await self.generator.agenerate(question, contexts)
+        else:
+            generation = await asyncio.to_thread(self.generator.generate, question, contexts)
+        return self._answer_text(generation)
+    
+    async def _acomplete(self, prompt: str, system_prompt: str, **kwargs) -> str:
+        """Asynchroniczny odpowiednik _call_anthropic (konsolidacja odpowiedzi wsadów)."""
+        if hasattr(self.generator, "acomplete"):
+            return await self.generator.acomplete(prompt, system_prompt, **kwargs)
+        return await asyncio.to_thread(self._call_anthropic, prompt, system_prompt, **kwargs)
+    
+    async def _agenerate_batches(self, question: str, batches: List[List[Tuple[Chunk, float]]],
+                                 max_concurrency: int, batch_timeout: float) -> List[Dict[str, Any]]:
+        """
+        Asynchroniczny odpowiednik _generate_batches: limit czasu liczony jest
+        od startu wsadu, a przekroczenie go przerywa oczekiwanie na wsad.
+        
+        Returns:
+            Lista szczegółów wsadów w ich kolejności (status: "ok", "error" lub "timeout")
+        """
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        
+        async def generate_batch(i: int, batch: List[Tuple[Chunk, float]]) -> Dict[str, Any]:
+            detail = {
+                "batch_id": i + 1,
+                "question": f"{question} (część {i + 1}/{len(batches)})",
+                "chunks": [{"doc_id": c.doc_id, "chunk_id": c.chunk_id, "score": float(s)} for c, s in batch],
+                "status": "pending",
+                "answer": "",
+                "error": None,
+                "latency": None
+            }
+            async with semaphore:
+                started = time.time()
+                try:
+                    answer, error = await asyncio.wait_for(
+                        self._agenerate(detail["question"], [chunk for chunk, _ in batch]), batch_timeout
+                    )
+                except asyncio.TimeoutError:
+                    detail.update(status="timeout", error=f"Przekroczono limit czasu {batch_timeout}s")
+                except Exception as e:
+                    detail.update(status="error", error=str(e))
+                else:
+                    if error or not answer:
+                        detail.update(status="error", error=error or "Pusta odpowiedź")
+                    else:
+                        detail.update(status="ok", answer=answer)
+                detail["latency"] = time.time() - started
+            return detail
+        
+        details = await asyncio.gather(*(generate_batch(i, batch) for i, batch in enumerate(batches)))
+        
+        if self.debug_mode:
+            for detail in details:
+                print(f"Wsad {detail['batch_id']}/{len(batches)}: {detail['status']} ({detail['latency'] or 0:.2f}s)")
+        
+        return list(details)
+    
     def _call_anthropic(self, 
                    prompt: str, 
                    system_prompt: str,
@@ -539,28 +1574,28 @@ class LegalRAGPipeline:
         Pomocnicza metoda do wykonywania zapytań do API Anthropic.
         """
         try:
-            # Inicjalizacja klienta Anthropic
-            from dotenv import load_dotenv
-            import anthropic
-            
-            load_dotenv()  # Załaduj zmienne środowiskowe z .env
-            client = anthropic.Client(api_key=os.getenv('ANTHROPIC_API_KEY'))
+            # Współdzielony klient Anthropic z puli (bez nowego połączenia przy każdym wywołaniu)
+            client = self.clients.anthropic_client()
             
             # Jeśli nie ma klucza API, zwróć pusty ciąg znaków
-            if not os.getenv('ANTHROPIC_API_KEY'):
+            if client is None:
                 print("Błąd: Brak klucza API Anthropic w zmiennych środowiskowych")
                 return ""
             
-            # Wywołanie API za pomocą klienta
-            message = client.messages.create(
-                model=self.generator.model,
-                max_tokens=max_tokens,
-                temperature=temperature,
-                system=system_prompt,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ],
-                timeout=timeout
+            # Wywołanie API za pomocą klienta, z ponawianiem i bezpiecznikiem generatora
+            message = self.generator.retry_policy.call(
+                lambda: client.messages.create(
+                    model=self.generator.model,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    system=system_prompt,
+                    messages=[
+                        {"role": "user", "content": prompt}
+                    ],
+                    timeout=timeout
+                ),
+                breaker=self.generator.circuit_breaker,
+                retryable=AnthropicGenerator.is_retryable
             )
             
             # Pobierz tekst z odpowiedzi
@@ -585,16 +1620,23 @@ class LegalRAGPipeline:
                 "num_predict": max_tokens,
             }
             
-            response = requests.post(
-                f"{self.generator.base_url}/api/generate",
-                json={
-                    "model": self.generator.model,
-                    "prompt": prompt,
-                    "stream": False,
-                    "system": system_prompt,
-                    "options": config
-                },
-                timeout=timeout
+            def send():
+                response = self.clients.session.post(
+                    f"{self.generator.base_url}/api/generate",
+                    json={
+                        "model": self.generator.model,
+                        "prompt": prompt,
+                        "stream": False,
+                        "system": system_prompt,
+                        "options": config
+                    },
+                    timeout=timeout
+                )
+                OllamaGenerator._raise_for_status(response)
+                return response
+            
+            response = self.generator.retry_policy.call(
+                send, breaker=self.generator.circuit_breaker, retryable=OllamaGenerator.is_retryable
             )
             
             if response.status_code == 200:
@@ -0,0 +1,113 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+from src.chunking import Chunk
+
+
+class DocumentIndex:
+    """
+    Indeks dokumentów pipeline'u: doc_id -> zakres chunków w liście documents
+    oraz hash treści -> doc_id.
+
+    Pozwala sprawdzić istnienie dokumentu w O(1) zamiast skanować wszystkie
+    chunki i trzyma gotowe statystyki per dokument dla get_stats.
+    """
+
+    def __init__(self):
+        self._ranges: Dict[str, List[Tuple[int, int]]] = {}
+        self._chunk_counts: Dict[str, int] = {}
+        self._text_lengths: Dict[str, int] = {}
+        self._content: Dict[str, str] = {}
+        self._content_of: Dict[str, str] = {}
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._ranges
+
+    def __len__(self) -> int:
+        return len(self._ranges)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._ranges)
+
+    def rebuild(self, documents: List[Chunk], content_hashes: Optional[Dict[str, str]] = None) -> None:
+        """
+        Buduje indeks od nowa jednym przejściem po chunkach.
+
+        Args:
+            documents: Lista chunków pipeline'u
+            content_hashes: Opcjonalny słownik {doc_id: hash treści dokumentu}
+        """
+        self.clear()
+
+        run_start = 0
+        for i in range(1, len(documents) + 1):
+            if i == len(documents) or documents[i].doc_id != documents[run_start].doc_id:
+                self._add_range(documents, run_start, i)
+                run_start = i
+
+        # Dokumenty bez chunków znamy tylko z ich hashy treści
+        for doc_id, content_hash in (content_hashes or {}).items():
+            self._ranges.setdefault(doc_id, [])
+            self._set_content_hash(doc_id, content_hash)
+
+    def add(self, doc_id: str, documents: List[Chunk], start: int, end: int,
+            content_hash: Optional[str] = None) -> None:
+        """
+        Rejestruje chunki documents[start:end] jako należące do dokumentu doc_id.
+        """
+        self._add_range(documents, start, end, doc_id)
+        if content_hash is not None:
+            self._set_content_hash(doc_id, content_hash)
+
+    def remove(self, doc_id: str) -> None:
+        """Usuwa dokument z indeksu; zakresy pozostałych dokumentów się nie zmieniają."""
+        self._ranges.pop(doc_id, None)
+        self._chunk_counts.pop(doc_id, None)
+        self._text_lengths.pop(doc_id, None)
+        content_hash = self._content_of.pop(doc_id, None)
+        if content_hash is not None and self._content.get(content_hash) == doc_id:
+            del self._content[content_hash]
+
+    def clear(self) -> None:
+        self._ranges = {}
+        self._chunk_counts = {}
+        self._text_lengths = {}
+        self._content = {}
+        self._content_of = {}
+
+    def has_content(self, content_hash: str) -> bool:
+        return content_hash in self._content
+
+    def doc_for_content(self, content_hash: str) -> Optional[str]:
+        return self._content.get(content_hash)
+
+    def content_hash(self, doc_id: str) -> Optional[str]:
+        return self._content_of.get(doc_id)
+
+    def chunk_ranges(self, doc_id: str) -> List[Tuple[int, int]]:
+        """Zwraca listę półotwartych zakresów [start, end) chunków dokumentu."""
+        return list(self._ranges.get(doc_id, []))
+
+    def chunk_count(self, doc_id: str) -> int:
+        return self._chunk_counts.get(doc_id, 0)
+
+    def text_length(self, doc_id: str) -> int:
+        return self._text_lengths.get(doc_id, 0)
+
+    def _add_range(self, documents: List[Chunk], start: int, end: int, doc_id: Optional[str] = None) -> None:
+        if end <= start and doc_id is None:
+            return
+        doc_id = doc_id if doc_id is not None else documents[start].doc_id
+
+        ranges = self._ranges.setdefault(doc_id, [])
+        if ranges and ranges[-1][1] == start:
+            ranges[-1] = (ranges[-1][0], end)
+        elif end > start:
+            ranges.append((start, end))
+
+        self._chunk_counts[doc_id] = self._chunk_counts.get(doc_id, 0) + (end - start)
+        self._text_lengths[doc_id] = self._text_lengths.get(doc_id, 0) + sum(
+            len(documents[i].text) for i in range(start, end)
+        )
+
+    def _set_content_hash(self, doc_id: str, content_hash: str) -> None:
+        self._content[content_hash] = doc_id
+        self._content_of[doc_id] = content_hash
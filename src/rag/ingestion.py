@@ -0,0 +1,187 @@
+from dataclasses import dataclass, field
+import hashlib
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from src.cache import BaseCache
+from src.chunking import Chunk, SimpleTextSplitter
+from src.chunking.parallel import chunk_documents
+from src.embeddings import PolishLegalEmbedder
+
+
+@dataclass
+class IngestionBatch:
+    """Paczka całych dokumentów przekazywana między etapami ingestii."""
+    chunks: List[Chunk] = field(default_factory=list)
+    documents: Dict[str, Tuple[int, str]] = field(default_factory=dict)  # doc_id -> (liczba chunków, hash treści)
+    embeddings: List[np.ndarray] = field(default_factory=list)
+
+
+class IngestionPipeline:
+    """
+    Etapowa ingestia dokumentów: chunking -> embedding -> zapis.
+
+    - chunking (analiza struktury tekstu) działa w puli procesów na wielu rdzeniach,
+    - jeden wątek liczy embeddingi całymi paczkami chunków,
+    - osobny wątek zatwierdza gotowe paczki (pipeline + cache).
+
+    Etapy połączone są ograniczonymi kolejkami, więc chunking nie wyprzedza
+    embeddera o więcej niż queue_size paczek. Kolejność dokumentów jest zachowana.
+    """
+
+    def __init__(self,
+                 chunker: SimpleTextSplitter,
+                 embedder: PolishLegalEmbedder,
+                 cache: BaseCache,
+                 num_workers: Optional[int] = None,
+                 embedding_batch_size: int = 32,
+                 commit_batch_size: int = 512,
+                 queue_size: int = 2,
+                 debug_mode: bool = False):
+        """
+        Args:
+            chunker: Chunker dokumentów (musi dać się zserializować dla puli procesów)
+            embedder: Embedder używany dla chunków spoza cache'u
+            cache: Cache embeddingów
+            num_workers: Liczba procesów chunkujących (domyślnie liczba rdzeni, <= 1 wyłącza pulę)
+            embedding_batch_size: Rozmiar paczki przekazywany do embeddera
+            commit_batch_size: Minimalna liczba chunków w paczce przekazywanej dalej
+            queue_size: Maksymalna liczba paczek czekających między etapami
+            debug_mode: Czy wypisywać informacje diagnostyczne
+        """
+        self.chunker = chunker
+        self.embedder = embedder
+        self.cache = cache
+        self.num_workers = num_workers if num_workers is not None else (os.cpu_count() or 1)
+        self.embedding_batch_size = embedding_batch_size
+        self.commit_batch_size = commit_batch_size
+        self.queue_size = queue_size
+        self.debug_mode = debug_mode
+
+    def run(self, documents: Iterable[Tuple[str, str]],
+            commit: Callable[[IngestionBatch], None]) -> Dict[str, Any]:
+        """
+        Przetwarza dokumenty i przekazuje gotowe paczki do funkcji commit.
+
+        Args:
+            documents: Pary (tekst, doc_id) do dodania
+            commit: Funkcja zatwierdzająca paczkę z policzonymi embeddingami
+
+        Returns:
+            Słownik ze statystykami etapów
+        """
+        stats = {
+            "added_documents": 0,
+            "new_chunks": 0,
+            "time_chunking": 0,
+            "time_embedding": 0,
+            "time_writing": 0,
+            "stages": {
+                "chunking": {"workers": 1, "documents": 0, "chunks": 0, "busy_time": 0, "wall_time": 0},
+                "embedding": {"batches": 0, "chunks": 0, "busy_time": 0},
+                "writing": {"batches": 0, "chunks": 0, "busy_time": 0},
+            },
+        }
+        stages = stats["stages"]
+
+        embed_queue: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        write_queue: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        errors: List[BaseException] = []
+        threads = [
+            threading.Thread(target=self._stage, name="ingestion-embedding", daemon=True,
+                             args=(embed_queue, write_queue, self._embed_batch, stages["embedding"], errors)),
+            threading.Thread(target=self._stage, name="ingestion-writing", daemon=True,
+                             args=(write_queue, None, commit, stages["writing"], errors)),
+        ]
+        for thread in threads:
+            thread.start()
+
+        chunking_start = time.perf_counter()
+        try:
+            batch = IngestionBatch()
+            if self.num_workers > 1:
+                stages["chunking"]["workers"] = self.num_workers
+            for text, doc_id, chunks, elapsed in chunk_documents(self.chunker, documents, self.num_workers):
+                if errors:
+                    break
+                batch.chunks.extend(chunks)
+                batch.documents[doc_id] = (len(chunks), hashlib.md5(text.encode()).hexdigest())
+                stages["chunking"]["documents"] += 1
+                stages["chunking"]["chunks"] += len(chunks)
+                stages["chunking"]["busy_time"] += elapsed
+
+                if len(batch.chunks) >= self.commit_batch_size:
+                    embed_queue.put(batch)
+                    batch = IngestionBatch()
+
+            if batch.documents and not errors:
+                embed_queue.put(batch)
+        finally:
+            stages["chunking"]["wall_time"] = time.perf_counter() - chunking_start
+            embed_queue.put(None)
+            for thread in threads:
+                thread.join()
+
+        if errors:
+            raise errors[0]
+
+        stats["added_documents"] = stages["chunking"]["documents"]
+        stats["new_chunks"] = stages["writing"]["chunks"]
+        stats["time_chunking"] = stages["chunking"]["busy_time"]
+        stats["time_embedding"] = stages["embedding"]["busy_time"]
+        stats["time_writing"] = stages["writing"]["busy_time"]
+
+        stages["chunking"]["docs_per_s"] = self._rate(stages["chunking"]["documents"], stages["chunking"]["wall_time"])
+        for name in ("embedding", "writing"):
+            stages[name]["chunks_per_s"] = self._rate(stages[name]["chunks"], stages[name]["busy_time"])
+
+        if self.debug_mode:
+            print(f"Chunking: {stages['chunking']['docs_per_s']:.1f} dok./s "
+                  f"({stages['chunking']['workers']} proc.), "
+                  f"embedding: {stages['embedding']['chunks_per_s']:.1f} chunków/s, "
+                  f"zapis: {stages['writing']['chunks_per_s']:.1f} chunków/s")
+
+        return stats
+
+    def _embed_batch(self, batch: IngestionBatch) -> None:
+        batch.embeddings = self.cache.get_embeddings(
+            [chunk.text for chunk in batch.chunks],
+            self.embedder,
+            batch_size=self.embedding_batch_size
+        )
+
+    @staticmethod
+    def _stage(inbox: queue.Queue, outbox: Optional[queue.Queue], work: Callable[[IngestionBatch], None],
+               stage_stats: Dict[str, Any], errors: List[BaseException]) -> None:
+        """
+        Pętla etapu: pobiera paczki aż do znacznika None i przekazuje je dalej.
+        Po błędzie etap dalej opróżnia kolejkę, żeby nie zablokować poprzedników.
+        """
+        while True:
+            batch = inbox.get()
+            if batch is None:
+                break
+            if errors:
+                continue
+            try:
+                start = time.perf_counter()
+                work(batch)
+                stage_stats["busy_time"] += time.perf_counter() - start
+                stage_stats["batches"] += 1
+                stage_stats["chunks"] += len(batch.chunks)
+                if outbox is not None:
+                    outbox.put(batch)
+            except BaseException as e:
+                errors.append(e)
+
+        if outbox is not None:
+            outbox.put(None)
+
+    @staticmethod
+    def _rate(count: int, seconds: float) -> float:
+        return count / seconds if seconds > 0 else 0.0
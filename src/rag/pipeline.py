@@ -11,7 +11,8 @@ import numpy as np
 # Local
 from src.chunking import Chunk, SimpleTextSplitter
 from src.generation.anthropic import AnthropicGenerator
-from src.cache import BaseCache
+from src.cache import BaseCache, MemmapCache
+from src.rag.document_index import DocumentIndex
 from src.embeddings import PolishLegalEmbedder
 from src.retrieval.semantic import SemanticRetriever
 
@@ -24,19 +25,22 @@ class MiniRAG:
     def __init__(self, 
             use_gpu: bool = False,
             cache_dir: str = "cache", 
+            cache: BaseCache = None,
             chunker: SimpleTextSplitter = None, 
             generator_model: str = "llama3.2",
             min_score_threshold: float = 0.6,
             max_top_k: int = 10,
             max_context_length: int = 32000,
+            embedding_batch_size: int = 32,
             debug_mode: bool = False):
 
         self.debug_mode = debug_mode
+        self.embedding_batch_size = embedding_batch_size
         self.max_context_length = max_context_length
         
         # Inicjalizacja komponentów
         self.embedder = PolishLegalEmbedder(use_gpu=use_gpu)
-        self.cache = BaseCache(cache_dir)
+        self.cache = cache if cache is not None else MemmapCache(cache_dir)
         self.retriever = SemanticRetriever(
             embedder=self.embedder,
             min_score_threshold=min_score_threshold,
@@ -52,6 +56,8 @@ class MiniRAG:
         
         # Wczytaj zapisane dokumenty i embeddingi
         self.documents, self.embeddings = self.cache.load_cache()
+        self.document_index = DocumentIndex()
+        self.document_index.rebuild(self.documents, self.cache.document_hashes)
         
         if self.debug_mode:
             print(f"Zainicjalizowano MiniRAG z {len(self.documents)} dokumentami")
@@ -60,10 +66,48 @@ class MiniRAG:
         """Wyczyść wszystkie dokumenty i embeddingi z pamięci i cache."""
         self.documents = []
         self.embeddings = []
+        self.document_index.clear()
+        self.retriever.clear_tombstones()
         self.cache.clear_cache()
         if self.debug_mode:
             print("Wyczyszczono wszystkie dokumenty z pamięci i cache")
 
+    def remove_document(self, doc_id: str) -> Dict[str, Any]:
+        """
+        Usuń dokument z systemu. Jego chunki są od razu pomijane przy wyszukiwaniu,
+        a miejsce w pamięci i w cache odzyskuje compact().
+        
+        Args:
+            doc_id: Identyfikator usuwanego dokumentu
+            
+        Returns:
+            Słownik ze statystykami usuwania
+        """
+        if doc_id not in self.document_index:
+            return {"removed_documents": 0, "removed_chunks": 0}
+        
+        rows = [row for start, end in self.document_index.chunk_ranges(doc_id) for row in range(start, end)]
+        self.retriever.tombstone(rows)
+        self.document_index.remove(doc_id)
+        self.cache.remove_document(doc_id)
+        
+        if self.debug_mode:
+            print(f"Usunięto dokument {doc_id} ({len(rows)} chunków)")
+        return {"removed_documents": 1, "removed_chunks": len(rows)}
+
+    def compact(self) -> Dict[str, int]:
+        """
+        Usuń z pamięci i z cache chunki usuniętych dokumentów oraz osierocone embeddingi.
+        
+        Returns:
+            Słownik ze statystykami kompaktowania cache
+        """
+        stats = self.cache.compact()
+        self.documents, self.embeddings = self.cache.load_cache()
+        self.retriever.clear_tombstones()
+        self.document_index.rebuild(self.documents, self.cache.document_hashes)
+        return stats
+
     def add_documents(self, texts: List[str], doc_ids: Optional[List[str]] = None) -> Dict[str, Any]:
         """
         Dodaj nowe dokumenty do systemu, podziel je na chunki i oblicz embeddingi.
@@ -95,9 +139,11 @@ class MiniRAG:
         if self.debug_mode:
             print(f"Przetwarzanie {len(texts)} dokumentów...")
         
+        new_chunks = []
+        new_documents = {}  # doc_id -> (liczba chunków, hash treści)
         for i, (text, doc_id) in enumerate(zip(texts, doc_ids)):
             # Sprawdź, czy dokument już istnieje
-            if any(chunk.doc_id.startswith(doc_id) for chunk in self.documents):
+            if doc_id in new_documents or doc_id in self.document_index:
                 if self.debug_mode:
                     print(f"Dokument {i} ({doc_id}) już istnieje, pomijam...")
                 stats["skipped_documents"] += 1
@@ -105,19 +151,30 @@ class MiniRAG:
             
             # Podziel tekst na chunki
             chunks = self.chunker.split_text(text, doc_id=doc_id)
-            
-            # Dodaj chunki i embeddingi
-            for chunk in chunks:
-                embedding = self.cache.get_embedding(chunk.text, self.embedder)
-                self.documents.append(chunk)
-                self.embeddings.append(embedding)
-                stats["total_chunks"] += 1
-            
+            new_chunks.extend(chunks)
+            new_documents[doc_id] = (len(chunks), hashlib.md5(text.encode()).hexdigest())
             stats["added_documents"] += 1
         
+        # Oblicz embeddingi wszystkich nowych chunków w kilku dużych paczkach
+        embeddings = self.cache.get_embeddings(
+            [chunk.text for chunk in new_chunks],
+            self.embedder,
+            batch_size=self.embedding_batch_size
+        )
+        start = len(self.documents)
+        self.documents.extend(new_chunks)
+        self.embeddings.extend(embeddings)
+        for doc_id, (chunk_count, content_hash) in new_documents.items():
+            self.document_index.add(doc_id, self.documents, start, start + chunk_count, content_hash)
+            start += chunk_count
+        stats["total_chunks"] = len(new_chunks)
+        
         # Zapisz do cache
         if stats["added_documents"] > 0:
-            self.cache.save_cache(self.documents, self.embeddings)
+            self.cache.save_cache(
+                new_chunks, embeddings,
+                document_hashes={doc_id: content_hash for doc_id, (_, content_hash) in new_documents.items()}
+            )
         
         stats["processing_time"] = time.time() - start_time
         
@@ -227,22 +284,20 @@ class MiniRAG:
         unique_docs = set()
         doc_stats = {}
         
-        for chunk in self.documents:
-            doc_id = chunk.doc_id
+        # Liczniki chunków pochodzą z indeksu dokumentów - bez skanowania wszystkich chunków
+        for doc_id in self.document_index:
             base_doc_id = doc_id.split('_chunk_')[0] if '_chunk_' in doc_id else doc_id
             
             unique_docs.add(base_doc_id)
-            
-            if base_doc_id not in doc_stats:
-                doc_stats[base_doc_id] = 0
-            doc_stats[base_doc_id] += 1
+            doc_stats[base_doc_id] = doc_stats.get(base_doc_id, 0) + self.document_index.chunk_count(doc_id)
         
         return {
-            "total_chunks": len(self.documents),
+            "total_chunks": len(self.documents) - len(self.retriever.tombstones),
             "unique_documents": len(unique_docs),
             "documents_breakdown": doc_stats,
             "cache_size": self.cache.get_cache_size(),
-            "embedding_dimensions": self.embeddings[0].shape if self.embeddings else None
+            "embedding_dimensions": self.embeddings[0].shape if self.embeddings else None,
+            "query_cache": self.retriever.query_cache.get_stats()
         }
     
     def export_to_json(self, filepath: str) -> None:
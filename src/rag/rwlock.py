@@ -0,0 +1,49 @@
+from contextlib import contextmanager
+import threading
+from typing import Iterator
+
+
+class ReadWriteLock:
+    """
+    Blokada czytelników i pisarzy.
+
+    Dowolnie wielu czytelników (zapytań) może działać równocześnie; pisarz
+    (zmiana list chunków i indeksów wyszukiwania) czeka, aż wyjdą, i ma
+    pierwszeństwo przed nowymi czytelnikami, więc nie zostanie zagłodzony.
+    Blokada nie jest wielowejściowa.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        with self._condition:
+            while self._writer or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
@@ -1,3 +1,10 @@
+from .bm25 import BM25Index, PolishLegalTokenizer, reciprocal_rank_fusion
+from .dense_index import DenseIndex
+from .ivf_index import IVFIndex
+from .quantized_index import QuantizedIndex
+from .reranker import CrossEncoderReranker
 from .semantic import SemanticRetriever
+from .structural_index import StructuralIndex
 
-__all__ = ['SemanticRetriever']
\ No newline at end of file
+__all__ = ['BM25Index', 'CrossEncoderReranker', 'DenseIndex', 'IVFIndex', 'PolishLegalTokenizer',
+           'QuantizedIndex', 'SemanticRetriever', 'StructuralIndex', 'reciprocal_rank_fusion']
@@ -0,0 +1,311 @@
+from collections import Counter
+import hashlib
+from pathlib import Path
+import re
+import unicodedata
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+from src.chunking import Chunk
+
+
+class PolishLegalTokenizer:
+    """
+    Tokenizacja tekstów prawnych na potrzeby indeksu BM25.
+
+    - małe litery i usunięcie polskich znaków diakrytycznych ("życie" == "zycie"),
+    - odrzucenie najczęstszych słów funkcyjnych,
+    - lekki stemming: obcięcie typowych końcówek fleksyjnych,
+    - odwołania do jednostek redakcyjnych ("art. 415", "§ 3", "ust. 2") dają
+      dodatkowy token złożony ("art:415"), więc trafienie jest dokładne.
+    """
+
+    REFERENCE_UNITS = {
+        'art': 'art', 'artykul': 'art', 'artykulu': 'art', 'artykule': 'art', 'artykuly': 'art', 'artykulow': 'art',
+        '§': 'par', 'par': 'par', 'paragraf': 'par', 'paragrafu': 'par', 'paragrafie': 'par',
+        'ust': 'ust', 'ustep': 'ust', 'ustepu': 'ust', 'ustepie': 'ust',
+        'pkt': 'pkt', 'punkt': 'pkt', 'punktu': 'pkt', 'punkcie': 'pkt',
+        'rozdz': 'rozdz', 'rozdzial': 'rozdz', 'rozdzialu': 'rozdz', 'rozdziale': 'rozdz',
+        'lit': 'lit', 'litera': 'lit', 'zal': 'zal', 'zalacznik': 'zal', 'zalacznika': 'zal',
+    }
+
+    STOPWORDS = {
+        'a', 'aby', 'albo', 'ale', 'az', 'bez', 'by', 'byc', 'czy', 'dla', 'do', 'gdy', 'i', 'ich', 'ile',
+        'jak', 'jako', 'je', 'jego', 'jej', 'jest', 'jesli', 'juz', 'lub', 'ma', 'maja', 'mu', 'na', 'nad',
+        'nie', 'o', 'od', 'oraz', 'po', 'pod', 'przez', 'przy', 'sa', 'sie', 'ta', 'tak', 'te', 'tego',
+        'tej', 'to', 'tu', 'ty', 'u', 'w', 'we', 'z', 'za', 'ze', 'co', 'ktory', 'ktora', 'ktore', 'ktorych',
+    }
+
+    # Końcówki od najdłuższej; obcinana jest tylko jedna, jeśli zostaje rdzeń >= MIN_STEM znaków
+    SUFFIXES = sorted([
+        'owania', 'owanie', 'owaniu', 'aniem', 'eniem', 'ania', 'enia', 'anie', 'enie', 'aniu', 'eniu',
+        'ami', 'ach', 'owi', 'ego', 'emu', 'ymi', 'imi', 'ych', 'ich', 'iej', 'ej', 'ow', 'om',
+        'ie', 'a', 'e', 'i', 'y', 'u', 'o',
+    ], key=len, reverse=True)
+    MIN_STEM = 4
+
+    _TOKEN_RE = re.compile(r"§|\d+[a-z]*|[^\W\d_]+")
+    _FOLD = str.maketrans({'ł': 'l', 'Ł': 'l'})
+
+    def fold(self, text: str) -> str:
+        """Małe litery bez znaków diakrytycznych."""
+        text = unicodedata.normalize("NFKD", text.lower().translate(self._FOLD))
+        return "".join(c for c in text if not unicodedata.combining(c))
+
+    def stem(self, token: str) -> str:
+        if token.isdigit() or len(token) <= self.MIN_STEM:
+            return token
+        for suffix in self.SUFFIXES:
+            if token.endswith(suffix) and len(token) - len(suffix) >= self.MIN_STEM:
+                return token[:-len(suffix)]
+        return token
+
+    def tokenize(self, text: str) -> List[str]:
+        raw = self._TOKEN_RE.findall(self.fold(text))
+        tokens = []
+        for i, token in enumerate(raw):
+            unit = self.REFERENCE_UNITS.get(token)
+            if unit is not None and i + 1 < len(raw) and raw[i + 1][0].isdigit():
+                tokens.append(f"{unit}:{raw[i + 1]}")
+            if token in self.STOPWORDS or token == '§':
+                continue
+            tokens.append(self.stem(token))
+        return tokens
+
+
+class BM25Index:
+    """
+    Odwrócony indeks BM25 nad tekstem chunków.
+
+    Listy postingów przechowywane są w tablicach NumPy w formacie CSR
+    (offsety, wiersze, częstości); chunki dodane po ostatniej przebudowie
+    trzymane są w małym ogonie, scalanym z CSR, gdy urośnie. Zapytanie
+    sumuje wkłady postingów swoich termów (np.add.at) - koszt zależy od długości
+    list, a nie od rozmiaru korpusu - normalizacja długości dokumentów liczona
+    jest przy dodawaniu, a wyniki sumowane tylko dla wierszy z postingów.
+
+    Odcisk zaindeksowanych tekstów liczony jest przyrostowo przy dodawaniu,
+    a save przepisuje plik dopiero, gdy indeks urośnie o ponad 25% od
+    ostatniego zapisu.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, tokenizer: Optional[PolishLegalTokenizer] = None):
+        self.k1 = k1
+        self.b = b
+        self.tokenizer = tokenizer if tokenizer is not None else PolishLegalTokenizer()
+        self.generation = 0
+        self._source: Optional[List[Chunk]] = None
+        self._restored: Optional[Dict[str, np.ndarray]] = None
+        self._reset_state()
+
+    def __len__(self) -> int:
+        return len(self._doc_lengths)
+
+    @property
+    def vocabulary_size(self) -> int:
+        return len(self._vocabulary)
+
+    def reset(self) -> None:
+        self._reset_state()
+        self._source = None
+        self.generation += 1
+
+    def add(self, texts: Sequence[str]) -> None:
+        """Dodaje teksty na koniec indeksu (kolejne wiersze)."""
+        row = len(self._doc_lengths)
+        lengths = []
+        for text in texts:
+            counts = Counter(self.tokenizer.tokenize(text))
+            lengths.append(sum(counts.values()))
+            self._digest.update(hashlib.md5(text.encode()).digest())
+            for term, tf in counts.items():
+                term_id = self._vocabulary.setdefault(term, len(self._vocabulary))
+                self._tail.setdefault(term_id, []).append((row, tf))
+            row += 1
+        self._tail_size += len(lengths)
+        self._doc_lengths = np.concatenate([self._doc_lengths, np.asarray(lengths, dtype=np.int32)])
+        self._update_norm()
+
+        # CSR przebudowujemy, gdy ogon urośnie (jak w IVFIndex)
+        if self._tail_size > max(1024, (len(self._doc_lengths) - self._tail_size) // 4):
+            self._merge_tail()
+
+    def sync(self, documents: List[Chunk]) -> None:
+        """
+        Synchronizuje indeks z listą chunków pipeline'u (patrz DenseIndex.sync).
+        Stan wczytany przez load jest użyty, jeśli pasuje do początku korpusu.
+        """
+        if documents is not self._source or len(documents) < len(self):
+            self.reset()
+            self._source = documents
+            if self._restored is not None:
+                self._adopt_restored(documents)
+
+        if len(documents) > len(self):
+            self.add([chunk.text for chunk in documents[len(self):]])
+
+    def search(self, query: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Zwraca wiersze zawierające co najmniej jeden term zapytania i ich wyniki BM25.
+
+        Returns:
+            Krotka (indeksy wierszy, wyniki BM25), malejąco według wyniku
+        """
+        n = len(self)
+        row_parts, score_parts = [], []
+        for term in set(self.tokenizer.tokenize(query)):
+            term_id = self._vocabulary.get(term)
+            if term_id is None:
+                continue
+            rows, tfs = self._postings(term_id)
+            if rows.size == 0:
+                continue
+            idf = np.log(1 + (n - rows.size + 0.5) / (rows.size + 0.5))
+            row_parts.append(rows)
+            score_parts.append(idf * tfs * (self.k1 + 1) / (tfs + self._norm[rows]))
+
+        if not row_parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        # Sumowanie wkładów tylko po wierszach kandydatów, bez tablicy wyników na cały korpus
+        rows, inverse = np.unique(np.concatenate(row_parts), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(score_parts)).astype(np.float32)
+        keep = scores > 0
+        rows, scores = rows[keep].astype(np.int64), scores[keep]
+        order = np.argsort(-scores, kind='stable')
+        return rows[order], scores[order]
+
+    def save(self, path: Path, force: bool = False) -> None:
+        """
+        Zapisuje słownik i postingi (CSR) wraz z odciskiem zaindeksowanych tekstów.
+
+        Plik przepisywany jest dopiero, gdy od ostatniego zapisu przybyło ponad 25% wierszy -
+        chunki spoza zapisu są po wczytaniu dokładane przez sync.
+
+        Args:
+            path: Ścieżka pliku .npz
+            force: Zapis bez względu na liczbę nowych wierszy
+        """
+        path = Path(path)
+        unsaved = len(self) - self._saved_size
+        if len(self) == 0 or (path.exists() and unsaved <= (0 if force else self._saved_size // 4)):
+            return
+        self._merge_tail()
+        tmp_path = path.with_name(path.name + ".tmp.npz")
+        terms = sorted(self._vocabulary, key=self._vocabulary.get)
+        np.savez(
+            tmp_path,
+            terms=np.array(terms, dtype=str),
+            offsets=self._offsets,
+            rows=self._rows,
+            tfs=self._tfs,
+            doc_lengths=self._doc_lengths,
+            fingerprint=np.array(self._digest.hexdigest())
+        )
+        tmp_path.replace(path)
+        self._saved_size = len(self)
+
+    def load(self, path: Path) -> bool:
+        """
+        Wczytuje stan zapisany przez save; zostanie użyty przy najbliższym sync,
+        jeśli zaindeksowane teksty są początkiem korpusu.
+        """
+        path = Path(path)
+        if not path.exists():
+            return False
+        try:
+            with np.load(path) as data:
+                self._restored = {key: data[key] for key in data.files}
+            return True
+        except Exception as e:
+            print(f"Nie można wczytać indeksu BM25 {path}: {e}")
+            return False
+
+    def _reset_state(self) -> None:
+        self._vocabulary: Dict[str, int] = {}
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._rows = np.empty(0, dtype=np.int32)
+        self._tfs = np.empty(0, dtype=np.float32)
+        self._doc_lengths = np.empty(0, dtype=np.int32)
+        self._norm = np.empty(0, dtype=np.float32)
+        self._tail: Dict[int, List[Tuple[int, int]]] = {}
+        self._tail_size = 0
+        self._digest = hashlib.md5()
+        self._saved_size = 0
+
+    def _update_norm(self) -> None:
+        """Przelicza k1 * (1 - b + b * dl / avgdl) - zmienia się razem ze średnią długością."""
+        average_length = max(float(self._doc_lengths.mean()), 1e-9) if len(self._doc_lengths) else 1.0
+        self._norm = (self.k1 * (1 - self.b + self.b * self._doc_lengths / average_length)).astype(np.float32)
+
+    def _postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        if term_id + 1 < len(self._offsets):
+            start, end = self._offsets[term_id], self._offsets[term_id + 1]
+            rows, tfs = self._rows[start:end], self._tfs[start:end]
+        else:
+            rows, tfs = self._rows[:0], self._tfs[:0]
+        tail = self._tail.get(term_id)
+        if tail:
+            rows = np.concatenate([rows, np.fromiter((r for r, _ in tail), dtype=np.int32, count=len(tail))])
+            tfs = np.concatenate([tfs, np.fromiter((tf for _, tf in tail), dtype=np.float32, count=len(tail))])
+        return rows, tfs
+
+    def _merge_tail(self) -> None:
+        if not self._tail:
+            self._tail_size = 0
+            return
+        size = sum(len(postings) for postings in self._tail.values())
+        tail_terms = np.fromiter((term_id for term_id, postings in self._tail.items() for _ in postings),
+                                 dtype=np.int64, count=size)
+        tail_rows = np.fromiter((row for postings in self._tail.values() for row, _ in postings),
+                                dtype=np.int32, count=size)
+        tail_tfs = np.fromiter((tf for postings in self._tail.values() for _, tf in postings),
+                               dtype=np.float32, count=size)
+
+        # Stabilne sortowanie po termie zachowuje rosnącą kolejność wierszy w każdej liście
+        terms = np.concatenate([np.repeat(np.arange(len(self._offsets) - 1), np.diff(self._offsets)), tail_terms])
+        order = np.argsort(terms, kind='stable')
+        counts = np.bincount(terms, minlength=len(self._vocabulary))
+
+        self._offsets = np.concatenate([[0], np.cumsum(counts)])
+        self._rows = np.concatenate([self._rows, tail_rows])[order]
+        self._tfs = np.concatenate([self._tfs, tail_tfs])[order]
+        self._tail = {}
+        self._tail_size = 0
+
+    def _adopt_restored(self, documents: List[Chunk]) -> None:
+        restored, self._restored = self._restored, None
+        size = len(restored['doc_lengths'])
+        if size > len(documents):
+            return
+        digest = hashlib.md5()
+        for chunk in documents[:size]:
+            digest.update(hashlib.md5(chunk.text.encode()).digest())
+        if str(restored['fingerprint']) != digest.hexdigest():
+            return
+        self._vocabulary = {str(term): i for i, term in enumerate(restored['terms'])}
+        self._offsets = restored['offsets'].astype(np.int64)
+        self._rows = restored['rows'].astype(np.int32)
+        self._tfs = restored['tfs'].astype(np.float32)
+        self._doc_lengths = restored['doc_lengths'].astype(np.int32)
+        self._update_norm()
+        self._digest = digest
+        self._saved_size = size
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], k: int = 60) -> Dict[int, float]:
+    """
+    Łączy rankingi metodą Reciprocal Rank Fusion: score = suma 1 / (k + pozycja).
+
+    Args:
+        rankings: Listy identyfikatorów (np. wierszy) od najlepszego
+        k: Stała wygładzająca - im większa, tym mniejsza przewaga czołowych pozycji
+
+    Returns:
+        Słownik {identyfikator: wynik RRF}
+    """
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            fused[item] = fused.get(item, 0.0) + 1.0 / (k + rank)
+    return fused
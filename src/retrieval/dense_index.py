@@ -0,0 +1,136 @@
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+
+
+class DenseIndex:
+    """
+    Ciągła macierz znormalizowanych embeddingów (float32) do dokładnego wyszukiwania.
+
+    Wiersze są normalizowane raz, przy dodawaniu, więc zapytanie to jeden
+    iloczyn macierz-wektor zamiast pętli po wszystkich chunkach.
+    """
+
+    def __init__(self, initial_capacity: int = 1024):
+        self._matrix: Optional[np.ndarray] = None
+        self._size = 0
+        self._initial_capacity = initial_capacity
+        self._source: Optional[List[np.ndarray]] = None
+        self.generation = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def dim(self) -> Optional[int]:
+        return self._matrix.shape[1] if self._matrix is not None else None
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """Widok na zajęte wiersze macierzy (bez kopiowania)."""
+        if self._matrix is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return self._matrix[:self._size]
+
+    def reset(self) -> None:
+        """Usuwa wszystkie wektory z indeksu."""
+        self._matrix = None
+        self._size = 0
+        self._source = None
+        self.generation += 1
+
+    @staticmethod
+    def normalize(vectors: np.ndarray) -> np.ndarray:
+        """
+        Normalizuje wiersze do długości 1. Wiersze o normie bliskiej zeru
+        zostają wyzerowane, tak jak w SemanticRetriever.cosine_similarity.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        zero_rows = norms < 1e-10
+        normalized = vectors / np.where(zero_rows, np.float32(1.0), norms)
+        normalized[zero_rows[:, 0]] = 0.0
+        return normalized
+
+    def add(self, embeddings: Sequence[np.ndarray]) -> None:
+        """
+        Dodaje embeddingi na koniec indeksu.
+
+        Args:
+            embeddings: Sekwencja wektorów o kształcie (d,) lub (1, d)
+        """
+        if len(embeddings) == 0:
+            return
+
+        block = np.vstack([np.asarray(e, dtype=np.float32).reshape(1, -1) for e in embeddings])
+        if self._matrix is not None and block.shape[1] != self._matrix.shape[1]:
+            raise ValueError(
+                f"Wektory muszą mieć ten sam kształt, otrzymano: {block.shape[1]} i {self._matrix.shape[1]}"
+            )
+
+        self._reserve(self._size + block.shape[0], block.shape[1])
+        self._matrix[self._size:self._size + block.shape[0]] = self.normalize(block)
+        self._size += block.shape[0]
+
+    def sync(self, embeddings: List[np.ndarray]) -> None:
+        """
+        Synchronizuje indeks z listą embeddingów trzymaną przez pipeline.
+
+        Listy w pipeline'ach są tylko rozszerzane, więc wystarczy dołożyć nowe
+        wiersze. Gdy lista została podmieniona lub skrócona, indeks jest
+        budowany od nowa.
+        """
+        if embeddings is not self._source or len(embeddings) < self._size:
+            self.reset()
+            self._source = embeddings
+
+        if len(embeddings) > self._size:
+            self.add(embeddings[self._size:])
+
+    def scores(self, query_embedding: np.ndarray) -> np.ndarray:
+        """
+        Oblicza podobieństwo kosinusowe zapytania do wszystkich wektorów w indeksie.
+
+        Args:
+            query_embedding: Embedding zapytania o kształcie (d,) lub (1, d)
+
+        Returns:
+            Wektor podobieństw float32 o długości len(self)
+        """
+        if self._size == 0:
+            return np.empty(0, dtype=np.float32)
+
+        query = self.normalize(np.asarray(query_embedding).reshape(1, -1))[0]
+        if query.shape[0] != self._matrix.shape[1]:
+            raise ValueError(
+                f"Wektory muszą mieć ten sam kształt, otrzymano: {query.shape} i {(self._matrix.shape[1],)}"
+            )
+        return self.matrix @ query
+
+    def scores_for(self, rows: Sequence[int], query_embedding: np.ndarray) -> np.ndarray:
+        """Podobieństwa kosinusowe zapytania do wybranych wierszy."""
+        query = self.normalize(np.asarray(query_embedding).reshape(1, -1))[0]
+        return self.matrix[np.asarray(rows, dtype=np.int64)] @ query
+
+    def search(self, query_embedding: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Zwraca kandydatów dla zapytania jako (indeksy wierszy, podobieństwa).
+
+        Wspólny interfejs backendów wyszukiwania - indeks dokładny zwraca
+        wszystkie wiersze, indeksy przybliżone tylko ich podzbiór.
+        """
+        scores = self.scores(query_embedding)
+        return np.arange(len(scores)), scores
+
+    def _reserve(self, rows: int, dim: int) -> None:
+        if self._matrix is None:
+            capacity = max(self._initial_capacity, rows)
+            self._matrix = np.zeros((capacity, dim), dtype=np.float32)
+            return
+
+        if rows <= self._matrix.shape[0]:
+            return
+
+        capacity = max(rows, self._matrix.shape[0] * 2)
+        grown = np.zeros((capacity, dim), dtype=np.float32)
+        grown[:self._size] = self._matrix[:self._size]
+        self._matrix = grown
@@ -0,0 +1,234 @@
+from pathlib import Path
+import hashlib
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+
+from src.retrieval.dense_index import DenseIndex
+
+
+class IVFIndex:
+    """
+    Przybliżony indeks wektorowy IVF-flat napisany w NumPy.
+
+    Wektory dzielone są k-means (na sferze jednostkowej) na nlist list.
+    Zapytanie przeszukuje tylko nprobe list najbliższych centroidów i liczy
+    dokładne podobieństwo kosinusowe dla ich wierszy. nprobe steruje
+    kompromisem między recall a czasem wyszukiwania (nprobe == nlist daje
+    wynik dokładny).
+
+    Dopóki indeks ma mniej niż min_train_size wektorów, działa jak DenseIndex.
+    Nowe wektory trafiają do najbliższej listy; gdy korpus urośnie
+    retrain_factor razy od ostatniego treningu, centroidy są liczone od nowa.
+
+    Na dysk trafia tylko wynik treningu (centroidy, przypisania i odcisk
+    wektorów treningowych) - przypisania późniejszych wierszy wynikają
+    z centroidów i są liczone ponownie przy wczytaniu.
+    """
+
+    def __init__(self,
+                 nlist: Optional[int] = None,
+                 nprobe: int = 16,
+                 min_train_size: int = 4096,
+                 retrain_factor: float = 4.0,
+                 kmeans_iterations: int = 10,
+                 seed: int = 0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.retrain_factor = retrain_factor
+        self.kmeans_iterations = kmeans_iterations
+        self.seed = seed
+
+        self.dense = DenseIndex()
+        self.centroids: Optional[np.ndarray] = None
+        self._assignments = np.empty(0, dtype=np.int32)
+        self._trained_size = 0
+        self._trained_fingerprint: Optional[str] = None
+        self._unsaved = False
+        self._generation = self.dense.generation
+        self._restored: Optional[Tuple[np.ndarray, np.ndarray, Optional[str]]] = None
+
+        # Listy odwrócone w formacie CSR; wiersze dodane później trzymane są osobno
+        self._list_offsets: Optional[np.ndarray] = None
+        self._list_rows: Optional[np.ndarray] = None
+        self._csr_size = 0
+
+    def __len__(self) -> int:
+        return len(self.dense)
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self.dense.matrix
+
+    def reset(self) -> None:
+        self.dense.reset()
+        self._untrain()
+        self._generation = self.dense.generation
+
+    def add(self, embeddings: Sequence[np.ndarray]) -> None:
+        self.dense.add(embeddings)
+        self._update()
+
+    def sync(self, embeddings: List[np.ndarray]) -> None:
+        """Synchronizuje indeks z listą embeddingów pipeline'u (patrz DenseIndex.sync)."""
+        self.dense.sync(embeddings)
+
+        if self.dense.generation != self._generation:
+            self._generation = self.dense.generation
+            self._untrain()
+            # Stan wczytany z dysku pasuje, jeśli wektory treningowe są początkiem korpusu
+            if self._restored is not None:
+                centroids, assignments, fingerprint = self._restored
+                if (len(assignments) <= len(self.dense) and centroids.shape[1] == self.dense.dim
+                        and fingerprint == self._fingerprint(self.dense.matrix[:len(assignments)])):
+                    self.centroids = centroids
+                    self._assignments = assignments
+                    self._trained_size = len(assignments)
+                    self._trained_fingerprint = fingerprint
+                    self._build_lists()
+                self._restored = None
+
+        self._update()
+
+    def scores(self, query_embedding: np.ndarray) -> np.ndarray:
+        """Dokładne podobieństwa do wszystkich wektorów (jak DenseIndex.scores)."""
+        return self.dense.scores(query_embedding)
+
+    def scores_for(self, rows: Sequence[int], query_embedding: np.ndarray) -> np.ndarray:
+        return self.dense.scores_for(rows, query_embedding)
+
+    def search(self, query_embedding: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Zwraca wiersze z nprobe najbliższych list i ich dokładne podobieństwa.
+
+        Returns:
+            Krotka (indeksy wierszy, podobieństwa kosinusowe)
+        """
+        if not self.is_trained:
+            return self.dense.search(query_embedding)
+
+        query = DenseIndex.normalize(np.asarray(query_embedding).reshape(1, -1))[0]
+        nprobe = min(self.nprobe, len(self.centroids))
+        probe = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+
+        parts = [self._list_rows[self._list_offsets[l]:self._list_offsets[l + 1]] for l in probe]
+        tail = self._assignments[self._csr_size:]
+        if tail.size:
+            parts.append(self._csr_size + np.flatnonzero(np.isin(tail, probe)))
+
+        rows = np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+        return rows, self.dense.matrix[rows] @ query
+
+    def train(self) -> None:
+        """Liczy centroidy sferycznym k-means na próbce wektorów i przypisuje wszystkie wiersze."""
+        matrix = self.dense.matrix
+        n = matrix.shape[0]
+        nlist = self.nlist or max(16, int(np.sqrt(n)))
+        nlist = min(nlist, n)
+
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(n, max(nlist * 64, 65536))
+        sample = matrix[rng.choice(n, size=sample_size, replace=False)]
+
+        centroids = sample[rng.choice(sample_size, size=nlist, replace=False)].copy()
+        for _ in range(self.kmeans_iterations):
+            labels = self._nearest(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=nlist)
+
+            # Puste listy dostają losowy wektor z próbki
+            empty = counts == 0
+            if empty.any():
+                sums[empty] = sample[rng.choice(sample_size, size=int(empty.sum()))]
+            centroids = DenseIndex.normalize(sums)
+
+        self.centroids = centroids
+        self._assignments = self._nearest(matrix, centroids)
+        self._trained_size = n
+        self._trained_fingerprint = self._fingerprint(matrix)
+        self._unsaved = True
+        self._build_lists()
+
+    def save(self, path: Path) -> None:
+        """
+        Zapisuje centroidy, przypisania wierszy treningowych i ich odcisk (bez wektorów -
+        te są w cache'u). Plik przepisywany jest tylko po nowym treningu.
+        """
+        path = Path(path)
+        if not self.is_trained or (not self._unsaved and path.exists()):
+            return
+        tmp_path = path.with_name(path.name + ".tmp.npz")
+        np.savez(tmp_path, centroids=self.centroids, assignments=self._assignments[:self._trained_size],
+                 fingerprint=np.array(self._trained_fingerprint))
+        tmp_path.replace(path)
+        self._unsaved = False
+
+    def load(self, path: Path) -> bool:
+        """
+        Wczytuje stan zapisany przez save. Zostanie użyty przy najbliższym
+        sync, jeśli odcisk wektorów treningowych zgadza się z początkiem korpusu -
+        w przeciwnym razie indeks trenuje się od nowa.
+        """
+        path = Path(path)
+        if not path.exists():
+            return False
+        try:
+            with np.load(path) as data:
+                fingerprint = str(data['fingerprint']) if 'fingerprint' in data.files else None
+                self._restored = (data['centroids'].astype(np.float32), data['assignments'].astype(np.int32),
+                                  fingerprint)
+            return True
+        except Exception as e:
+            print(f"Nie można wczytać indeksu IVF {path}: {e}")
+            return False
+
+    def _update(self) -> None:
+        n = len(self.dense)
+        if not self.is_trained or n > self._trained_size * self.retrain_factor:
+            if n >= self.min_train_size:
+                self.train()
+            elif self.is_trained:
+                self._untrain()
+            return
+
+        if n > len(self._assignments):
+            new_rows = self.dense.matrix[len(self._assignments):n]
+            self._assignments = np.concatenate([self._assignments, self._nearest(new_rows, self.centroids)])
+
+        # CSR przebudowujemy, gdy ogon dopisanych wierszy urośnie
+        if n - self._csr_size > max(1024, self._csr_size // 4):
+            self._build_lists()
+
+    def _untrain(self) -> None:
+        self.centroids = None
+        self._assignments = np.empty(0, dtype=np.int32)
+        self._trained_size = 0
+        self._trained_fingerprint = None
+        self._unsaved = False
+        self._list_offsets = None
+        self._list_rows = None
+        self._csr_size = 0
+
+    def _build_lists(self) -> None:
+        order = np.argsort(self._assignments, kind='stable')
+        counts = np.bincount(self._assignments, minlength=len(self.centroids))
+        self._list_offsets = np.concatenate([[0], np.cumsum(counts)])
+        self._list_rows = order
+        self._csr_size = len(self._assignments)
+
+    @staticmethod
+    def _fingerprint(vectors: np.ndarray) -> str:
+        return hashlib.md5(np.ascontiguousarray(vectors, dtype=np.float32)).hexdigest()
+
+    @staticmethod
+    def _nearest(vectors: np.ndarray, centroids: np.ndarray, batch_size: int = 8192) -> np.ndarray:
+        labels = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), batch_size):
+            block = vectors[start:start + batch_size]
+            labels[start:start + batch_size] = np.argmax(block @ centroids.T, axis=1)
+        return labels
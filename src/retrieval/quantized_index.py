@@ -0,0 +1,255 @@
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+
+from src.retrieval.dense_index import DenseIndex
+
+
+class QuantizedIndex:
+    """
+    Indeks wektorowy ze skwantyzowanymi wierszami (int8 albo float16).
+
+    Wiersze są normalizowane, opcjonalnie skracane do `dim` wymiarów
+    i kwantyzowane:
+    - int8: skalowanie per wymiar (skala = max |x_d| / 127); gdy nowe wektory
+      przekroczą zakres wymiaru, jego kolumna jest przeskalowywana,
+    - float16: zwykłe rzutowanie.
+
+    Skracanie wymiaru:
+    - "pca": rzut na dim głównych kierunków (PCA bez centrowania, zachowuje
+      iloczyny skalarne), liczony po zebraniu min_train_size wektorów,
+    - "truncate": pierwsze dim współrzędnych (modele typu Matryoshka).
+    Po skróceniu wektory są ponownie normalizowane.
+
+    Wyniki liczone są blokami bezpośrednio na kodach, bez dekwantyzacji całej
+    macierzy. Jeśli dostępne są oryginalne wektory float32 (lista z sync,
+    w pipeline'ie - widoki na plik memmap), rescore_k najlepszych kandydatów
+    dostaje dokładne podobieństwo kosinusowe.
+    """
+
+    DTYPES = ('int8', 'float16')
+    REDUCTIONS = ('pca', 'truncate')
+
+    def __init__(self,
+                 dtype: str = "int8",
+                 dim: Optional[int] = None,
+                 reduction: str = "pca",
+                 rescore_k: Optional[int] = 100,
+                 min_train_size: int = 1024,
+                 block_size: int = 2048,
+                 initial_capacity: int = 1024):
+        """
+        Args:
+            dtype: Typ kodów: "int8" albo "float16"
+            dim: Opcjonalna liczba zachowanych wymiarów (None - bez skracania)
+            reduction: Sposób skracania wymiaru: "pca" albo "truncate"
+            rescore_k: Liczba kandydatów z dokładnym podobieństwem (None - bez rescore)
+            min_train_size: Liczba wektorów potrzebna do wyznaczenia PCA
+            block_size: Liczba wierszy dekwantyzowanych naraz podczas wyszukiwania
+            initial_capacity: Początkowa liczba wierszy macierzy kodów
+        """
+        if dtype not in self.DTYPES:
+            raise ValueError(f"Nieznany typ kwantyzacji: {dtype}")
+        if reduction not in self.REDUCTIONS:
+            raise ValueError(f"Nieznany sposób redukcji wymiaru: {reduction}")
+        self.dtype = dtype
+        self.reduced_dim = dim
+        self.reduction = reduction
+        self.rescore_k = rescore_k
+        self.min_train_size = min_train_size
+        self.block_size = block_size
+        self._initial_capacity = initial_capacity
+        self.generation = 0
+        self._reset_state()
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def dim(self) -> Optional[int]:
+        return self._dim
+
+    @property
+    def code_dim(self) -> Optional[int]:
+        return self._codes.shape[1] if self._codes is not None else None
+
+    @property
+    def memory_bytes(self) -> int:
+        """Rozmiar kodów, skal i macierzy rzutu w pamięci (bez oryginałów float32)."""
+        total = self._codes[:self._size].nbytes if self._codes is not None else 0
+        if self._projection is not None:
+            total += self._projection.nbytes
+        return total + self._max_abs.nbytes
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """Zdekwantyzowane, znormalizowane wiersze (kopia - tylko do diagnostyki)."""
+        if self._codes is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return self._decode(self._codes[:self._size])
+
+    def reset(self) -> None:
+        self._reset_state()
+        self.generation += 1
+
+    def add(self, embeddings: Sequence[np.ndarray]) -> None:
+        """Dodaje embeddingi na koniec indeksu (wektory o kształcie (d,) lub (1, d))."""
+        if len(embeddings) == 0:
+            return
+        if self._source is None:
+            self._own_vectors.extend(embeddings)
+
+        block = DenseIndex.normalize(np.vstack([np.asarray(e, dtype=np.float32).reshape(1, -1)
+                                                for e in embeddings]))
+        if self._dim is None:
+            self._dim = block.shape[1]
+        elif block.shape[1] != self._dim:
+            raise ValueError(f"Wektory muszą mieć ten sam kształt, otrzymano: {block.shape[1]} i {self._dim}")
+
+        if self._needs_projection() and self._size + len(block) >= self.min_train_size:
+            # PCA liczone raz; wiersze dodane wcześniej kodowane są od nowa z oryginałów
+            block = np.vstack([self._originals(np.arange(self._size)), block])
+            self._fit_projection(block)
+            self._codes, self._size = None, 0
+            self._max_abs = np.zeros(0, dtype=np.float32)
+
+        self._append(self._reduce(block))
+
+    def sync(self, embeddings: List[np.ndarray]) -> None:
+        """Synchronizuje indeks z listą embeddingów pipeline'u (patrz DenseIndex.sync)."""
+        if embeddings is not self._source or len(embeddings) < self._size:
+            self.reset()
+            self._source = embeddings
+
+        if len(embeddings) > self._size:
+            self.add(embeddings[self._size:])
+
+    def scores(self, query_embedding: np.ndarray) -> np.ndarray:
+        """Przybliżone podobieństwa kosinusowe zapytania do wszystkich wierszy."""
+        if self._size == 0:
+            return np.empty(0, dtype=np.float32)
+
+        weights = self._query_weights(query_embedding)
+        scores = np.empty(self._size, dtype=np.float32)
+        # Mały bufor mieszczący się w cache'u procesora, używany dla kolejnych bloków
+        buffer = np.empty((min(self.block_size, self._size), self.code_dim), dtype=np.float32)
+        for start in range(0, self._size, self.block_size):
+            end = min(start + self.block_size, self._size)
+            block = buffer[:end - start]
+            np.copyto(block, self._codes[start:end], casting='unsafe')
+            np.matmul(block, weights, out=scores[start:end])
+        return scores
+
+    def scores_for(self, rows: Sequence[int], query_embedding: np.ndarray) -> np.ndarray:
+        """
+        Podobieństwa dla wybranych wierszy - dokładne, jeśli dostępne są
+        oryginalne wektory, w przeciwnym razie przybliżone.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if rows.size == 0:
+            return np.empty(0, dtype=np.float32)
+        query = DenseIndex.normalize(np.asarray(query_embedding).reshape(1, -1))[0]
+        if self._has_originals():
+            return self._originals(rows) @ query
+        return self._codes[rows].astype(np.float32) @ self._query_weights(query_embedding)
+
+    def search(self, query_embedding: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Zwraca kandydatów dla zapytania jako (indeksy wierszy, podobieństwa).
+
+        Z rescore zwracanych jest rescore_k najlepszych wierszy z dokładnymi
+        podobieństwami, bez niego - wszystkie wiersze z wynikami przybliżonymi.
+        """
+        scores = self.scores(query_embedding)
+        if not self.rescore_k or not self._has_originals():
+            return np.arange(len(scores)), scores
+
+        k = min(self.rescore_k, len(scores))
+        rows = np.sort(np.argpartition(-scores, k - 1)[:k])
+        return rows, self.scores_for(rows, query_embedding)
+
+    def _reset_state(self) -> None:
+        self._codes: Optional[np.ndarray] = None
+        self._size = 0
+        self._dim: Optional[int] = None
+        self._projection: Optional[np.ndarray] = None
+        self._max_abs = np.zeros(0, dtype=np.float32)
+        self._source: Optional[List[np.ndarray]] = None
+        self._own_vectors: List[np.ndarray] = []
+
+    def _needs_projection(self) -> bool:
+        return (self.reduction == "pca" and self.reduced_dim is not None
+                and self._projection is None and self.reduced_dim < (self._dim or 0))
+
+    def _fit_projection(self, vectors: np.ndarray, sample_size: int = 65536) -> None:
+        rng = np.random.default_rng(0)
+        if len(vectors) > sample_size:
+            vectors = vectors[rng.choice(len(vectors), size=sample_size, replace=False)]
+        # Prawe wektory osobliwe = kierunki największej wariancji iloczynów skalarnych
+        _, _, vt = np.linalg.svd(vectors, full_matrices=False)
+        self._projection = np.ascontiguousarray(vt[:self.reduced_dim].T, dtype=np.float32)
+
+    def _reduce(self, vectors: np.ndarray) -> np.ndarray:
+        if self.reduced_dim is None or self.reduced_dim >= vectors.shape[1]:
+            return vectors
+        if self.reduction == "truncate":
+            return DenseIndex.normalize(vectors[:, :self.reduced_dim])
+        if self._projection is None:
+            # Przed wyznaczeniem PCA wektory przechowywane są w pełnym wymiarze
+            return vectors
+        return DenseIndex.normalize(vectors @ self._projection)
+
+    def _query_weights(self, query_embedding: np.ndarray) -> np.ndarray:
+        query = self._reduce(DenseIndex.normalize(np.asarray(query_embedding).reshape(1, -1)))[0]
+        if query.shape[0] != self.code_dim:
+            raise ValueError(f"Wektory muszą mieć ten sam kształt, otrzymano: {query.shape} i {(self.code_dim,)}")
+        if self.dtype == "int8":
+            return query * self._scales()
+        return query
+
+    def _scales(self) -> np.ndarray:
+        return np.where(self._max_abs > 0, self._max_abs / 127.0, np.float32(1.0)).astype(np.float32)
+
+    def _append(self, block: np.ndarray) -> None:
+        self._reserve(self._size + len(block), block.shape[1])
+        if self.dtype == "int8":
+            block_max = np.abs(block).max(axis=0)
+            if self._max_abs.size == 0:
+                self._max_abs = np.zeros(block.shape[1], dtype=np.float32)
+            grown = np.flatnonzero(block_max > self._max_abs)
+            if grown.size and self._size:
+                # Kolumny o poszerzonym zakresie przeskalowujemy do nowej skali
+                ratio = self._max_abs[grown] / block_max[grown]
+                codes = self._codes[:self._size, grown].astype(np.float32) * ratio
+                self._codes[:self._size, grown] = np.rint(codes).astype(np.int8)
+            self._max_abs[grown] = block_max[grown]
+            codes = np.clip(np.rint(block / self._scales()), -127, 127).astype(np.int8)
+        else:
+            codes = block.astype(np.float16)
+        self._codes[self._size:self._size + len(block)] = codes
+        self._size += len(block)
+
+    def _reserve(self, rows: int, dim: int) -> None:
+        code_type = np.int8 if self.dtype == "int8" else np.float16
+        if self._codes is None:
+            self._codes = np.zeros((max(self._initial_capacity, rows), dim), dtype=code_type)
+            return
+        if rows <= self._codes.shape[0]:
+            return
+        grown = np.zeros((max(rows, self._codes.shape[0] * 2), dim), dtype=code_type)
+        grown[:self._size] = self._codes[:self._size]
+        self._codes = grown
+
+    def _decode(self, codes: np.ndarray) -> np.ndarray:
+        decoded = codes.astype(np.float32)
+        return decoded * self._scales() if self.dtype == "int8" else decoded
+
+    def _has_originals(self) -> bool:
+        vectors = self._source if self._source is not None else self._own_vectors
+        return len(vectors) >= self._size
+
+    def _originals(self, rows: np.ndarray) -> np.ndarray:
+        vectors = self._source if self._source is not None else self._own_vectors
+        if len(rows) == 0:
+            return np.empty((0, self._dim or 0), dtype=np.float32)
+        return DenseIndex.normalize(np.vstack([np.asarray(vectors[row], dtype=np.float32).reshape(1, -1)
+                                               for row in rows]))
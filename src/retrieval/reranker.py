@@ -0,0 +1,181 @@
+from collections import OrderedDict
+import hashlib
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+from src.chunking import Chunk
+
+
+class CrossEncoderReranker:
+    """
+    Ponowne szeregowanie wyników wyszukiwania lokalnym cross-encoderem.
+
+    Ocenianych jest tylko `candidates` najlepszych wyników retrievera; pary
+    (pytanie, chunk) przetwarzane są paczkami, od najlepszego kandydata.
+    Gdy przekroczony zostanie budżet czasu, kolejne paczki nie są liczone,
+    a nieocenieni kandydaci trafiają za ocenionych w kolejności retrievera,
+    z wynikami w skali modelu (poniżej najniższego ocenionego).
+    Wyniki par zapamiętywane są per hash (pytanie, tekst chunka).
+
+    Model ładowany jest leniwie przy pierwszym użyciu.
+    """
+
+    def __init__(self,
+                 model_name: str = "BAAI/bge-reranker-v2-m3",
+                 candidates: int = 20,
+                 top_k: int = 5,
+                 min_score: Optional[float] = None,
+                 batch_size: int = 8,
+                 max_length: int = 512,
+                 latency_budget: float = 2.0,
+                 cache_size: int = 16384,
+                 use_gpu: bool = False,
+                 scorer: Optional[Callable[[List[Tuple[str, str]]], np.ndarray]] = None):
+        """
+        Args:
+            model_name: Nazwa modelu cross-encodera (HuggingFace)
+            candidates: Liczba najlepszych wyników retrievera oceniana przez model
+            top_k: Domyślna liczba zwracanych chunków
+            min_score: Opcjonalny próg wyniku modelu (0-1); najlepszy chunk zostaje zawsze
+            batch_size: Liczba par w jednym przebiegu modelu
+            max_length: Maksymalna długość pary w tokenach
+            latency_budget: Budżet czasu jednego wywołania rerank w sekundach
+            cache_size: Maksymalna liczba zapamiętanych wyników par
+            use_gpu: Czy używać GPU, jeśli jest dostępne (domyślnie CPU)
+            scorer: Opcjonalna funkcja oceniająca listę par (zamiast modelu)
+        """
+        self.model_name = model_name
+        self.candidates = candidates
+        self.top_k = top_k
+        self.min_score = min_score
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.latency_budget = latency_budget
+        self.cache_size = cache_size
+        self.use_gpu = use_gpu
+        self._scorer = scorer
+        self._model = None
+        self._tokenizer = None
+        self._device = None
+
+        self._scores: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._model_lock = threading.Lock()
+
+        self.calls = 0
+        self.pairs_scored = 0
+        self.cache_hits = 0
+        self.budget_exceeded = 0
+        self.total_time = 0.0
+
+    def rerank(self, query: str, results: Sequence[Tuple[Chunk, float]],
+               top_k: Optional[int] = None) -> List[Tuple[Chunk, float]]:
+        """
+        Szereguje wyniki retrievera według oceny cross-encodera.
+
+        Args:
+            query: Pytanie użytkownika
+            results: Pary (chunk, podobieństwo) od najlepszej
+            top_k: Opcjonalna liczba zwracanych chunków zamiast self.top_k
+
+        Returns:
+            Pary (chunk, wynik modelu 0-1) od najlepszej; nieocenieni kandydaci
+            (po przekroczeniu budżetu) trafiają na koniec w kolejności retrievera,
+            z wynikami malejącymi poniżej najniższego wyniku modelu
+        """
+        start_time = time.monotonic()
+        final_k = self.top_k if top_k is None else top_k
+        candidates = list(results[:self.candidates])
+        if not candidates:
+            return []
+
+        keys = [self._pair_key(query, chunk.text) for chunk, _ in candidates]
+        scores: Dict[int, float] = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                score = self._scores.get(key)
+                if score is not None:
+                    self._scores.move_to_end(key)
+                    scores[i] = score
+        self.cache_hits += len(scores)
+
+        pending = [i for i in range(len(candidates)) if i not in scores]
+        for batch_start in range(0, len(pending), self.batch_size):
+            if batch_start and time.monotonic() - start_time > self.latency_budget:
+                self.budget_exceeded += 1
+                print(f"Przekroczono budżet czasu rerankingu, oceniono {batch_start}/{len(pending)} par")
+                break
+            batch = pending[batch_start:batch_start + self.batch_size]
+            batch_scores = self._score([(query, candidates[i][0].text) for i in batch])
+            self.pairs_scored += len(batch)
+            with self._lock:
+                for i, score in zip(batch, batch_scores):
+                    scores[i] = float(score)
+                    self._scores[keys[i]] = float(score)
+                while len(self._scores) > self.cache_size:
+                    self._scores.popitem(last=False)
+
+        ranked = sorted(scores, key=lambda i: -scores[i])
+        if self.min_score is not None:
+            ranked = ranked[:1] + [i for i in ranked[1:] if scores[i] >= self.min_score]
+        reranked = [(candidates[i][0], scores[i]) for i in ranked]
+        # Nieocenieni kandydaci dostają wyniki poniżej najniższego ocenionego (w kolejności
+        # retrievera) - podobieństwa kosinusowe nie są porównywalne z wynikami modelu
+        unscored = [i for i in range(len(candidates)) if i not in scores]
+        floor = min(scores.values())
+        reranked += [(candidates[i][0], floor * (len(unscored) - rank) / (len(unscored) + 1))
+                     for rank, i in enumerate(unscored)]
+
+        self.calls += 1
+        self.total_time += time.monotonic() - start_time
+        return reranked[:final_k]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.model_name,
+            "calls": self.calls,
+            "pairs_scored": self.pairs_scored,
+            "cache_hits": self.cache_hits,
+            "cached_pairs": len(self._scores),
+            "budget_exceeded": self.budget_exceeded,
+            "avg_time": self.total_time / self.calls if self.calls else 0.0
+        }
+
+    def _score(self, pairs: List[Tuple[str, str]]) -> np.ndarray:
+        if self._scorer is not None:
+            return np.asarray(self._scorer(pairs), dtype=np.float32)
+
+        import torch
+        self._load_model()
+        inputs = self._tokenizer(
+            [query for query, _ in pairs],
+            [text for _, text in pairs],
+            padding=True,
+            truncation='only_second',
+            max_length=self.max_length,
+            return_tensors='pt'
+        )
+        inputs = {k: v.to(self._device) for k, v in inputs.items()}
+        with torch.inference_mode():
+            logits = self._model(**inputs).logits.view(-1).float()
+        return torch.sigmoid(logits).cpu().numpy()
+
+    def _load_model(self) -> None:
+        if self._model is not None:
+            return
+        with self._model_lock:
+            if self._model is None:
+                import torch
+                from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+                self._device = torch.device("cuda" if self.use_gpu and torch.cuda.is_available() else "cpu")
+                self._tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+                model = AutoModelForSequenceClassification.from_pretrained(self.model_name)
+                self._model = model.to(self._device).eval()
+                print(f"Załadowano reranker {self.model_name} ({self._device})")
+
+    @staticmethod
+    def _pair_key(query: str, text: str) -> str:
+        return hashlib.md5(f"{query}\0{text}".encode()).hexdigest()
@@ -1,18 +1,53 @@
-from typing import List, Tuple, Optional, Set
+from typing import Iterable, List, Tuple, Optional, Set
+import re
 import numpy as np
 from src.chunking import Chunk
 from src.embeddings import PolishLegalEmbedder
 from src.documents.similarity import DocumentSimilarity
+from src.retrieval.bm25 import BM25Index, reciprocal_rank_fusion
+from src.retrieval.dense_index import DenseIndex
+from src.retrieval.reranker import CrossEncoderReranker
+from src.retrieval.structural_index import StructuralIndex
+from src.cache.query_cache import QueryEmbeddingCache
 
 class SemanticRetriever:
     def __init__(self,
                 embedder: PolishLegalEmbedder,
                 min_score_threshold: float = 0.6,
-                max_top_k: int = 10):
+                max_top_k: int = 10,
+                index: Optional[DenseIndex] = None,
+                query_cache: Optional[QueryEmbeddingCache] = None,
+                sparse_index: Optional[BM25Index] = None,
+                sparse_top_k: int = 3,
+                fusion_k: int = 60,
+                structural_index: Optional[StructuralIndex] = None,
+                reranker: Optional[CrossEncoderReranker] = None,
+                auto_sync: bool = True):
         self.embedder = embedder
         self.min_score_threshold = min_score_threshold
         self.max_top_k = max_top_k
         self.doc_similarity = DocumentSimilarity()
+        # Backend wyszukiwania: dokładny (domyślnie) lub przybliżony, np. IVFIndex
+        self.index = index if index is not None else DenseIndex()
+        # Embeddingi powtarzających się zapytań nie są liczone ponownie
+        self.query_cache = query_cache if query_cache is not None else QueryEmbeddingCache()
+        # Opcjonalny indeks BM25 - najlepsze trafienia słów kluczowych (np. "art. 415")
+        # łączone są z wynikami gęstymi metodą RRF
+        self.sparse_index = sparse_index
+        self.sparse_top_k = sparse_top_k
+        self.fusion_k = fusion_k
+        # Opcjonalny indeks odwołań - jednoznaczne "art. 12 ust. 3" nie wymaga wyszukiwania wektorowego
+        self.structural_index = structural_index
+        self.structural_hits = 0
+        # Opcjonalny cross-encoder - ocenia najlepszych kandydatów i zostawia tylko top_k
+        self.reranker = reranker
+        # Wiersze usuniętych chunków - pomijane w wynikach do czasu kompaktowania
+        self.tombstones: Set[int] = set()
+        self._tombstone_rows = np.empty(0, dtype=np.int64)
+        # Czy retrieve synchronizuje indeksy z przekazanymi listami. Pipeline'y, które
+        # same synchronizują indeksy przy zapisie (sync), wyłączają to - zapytania
+        # z wielu wątków nie modyfikują wtedy współdzielonych indeksów
+        self.auto_sync = auto_sync
 
         self.broad_query_keywords = {
             'rozdział', 'rozdziały', 'dział', 'działy', 'sekcja', 'sekcje',
@@ -25,6 +60,12 @@ class SemanticRetriever:
             'postanowienia', 'postanowienia ogólne', 'postanowienia szczegółowe', 'postanowienia końcowe',
         }
 
+        # Słowa pytań o wyliczenie - same nazwy jednostek ("art", "paragraf") z broad_query_keywords
+        # nie wykluczają trafienia strukturalnego, bo właśnie je rozwiązuje StructuralIndex
+        self.enumeration_query_keywords = {
+            'wszystkie', 'wszystkich', 'lista', 'listę', 'wymień', 'wylicz'
+        }
+
         self.specific_query_keywords = {
             'definicja', 'definicje', 'def',
             'co to jest', 'co oznacza', 'jak zdefiniowano',
@@ -65,6 +106,48 @@ class SemanticRetriever:
         # Obliczenie podobieństwa kosinusowego
         return np.dot(vec1_normalized, vec2_normalized)
 
+    def embed_query(self, query: str) -> np.ndarray:
+        """
+        Zwraca embedding zapytania, korzystając z cache'u zapytań.
+        
+        Args:
+            query: Tekst zapytania.
+            
+        Returns:
+            np.ndarray: Embedding zapytania.
+        """
+        model_name = getattr(self.embedder, "model_name", "")
+        return self.query_cache.get_or_compute(query, model_name, self.embedder.get_embedding)
+
+    def tombstone(self, rows: Iterable[int]) -> None:
+        """Oznacza wiersze jako usunięte - nie trafią do wyników wyszukiwania."""
+        self.tombstones.update(int(row) for row in rows)
+        self._tombstone_rows = np.fromiter(self.tombstones, dtype=np.int64, count=len(self.tombstones))
+
+    def clear_tombstones(self) -> None:
+        """Czyści oznaczenia po przebudowie list chunków (kompaktowaniu)."""
+        self.tombstones = set()
+        self._tombstone_rows = np.empty(0, dtype=np.int64)
+
+    def sync(self, documents: List[Chunk], embeddings: List[np.ndarray]) -> None:
+        """Synchronizuje wszystkie indeksy wyszukiwania z listami chunków i embeddingów."""
+        self.index.sync(embeddings)
+        if self.sparse_index is not None:
+            self.sparse_index.sync(documents)
+        if self.structural_index is not None:
+            self.structural_index.sync(documents)
+
+    def structural_rows(self, query: str) -> Optional[List[int]]:
+        """
+        Zwraca wiersze chunków wskazane jednoznacznymi odwołaniami z pytania albo None,
+        gdy pytanie trafi do zwykłego wyszukiwania (brak indeksu, pytanie o wyliczenie, brak trafienia).
+        """
+        if self.structural_index is None:
+            return None
+        if any(word in self.enumeration_query_keywords for word in re.findall(r"\w+", query.lower())):
+            return None
+        return self.structural_index.resolve(query, exclude=self.tombstones)
+
     def retrieve(self, 
                 query: str, 
                 documents: List[Chunk],
@@ -73,6 +156,13 @@ class SemanticRetriever:
                 min_score: Optional[float] = None) -> List[Tuple[Chunk, float]]:
         print(f"\nWyszukiwanie dla zapytania: {query}")
         
+        if self.auto_sync:
+            try:
+                self.sync(documents, embeddings)
+            except ValueError as e:
+                print(f"Błąd podczas synchronizacji indeksu: {str(e)}")
+                return []
+        
         complexity, is_broad_query = self._calculate_query_complexity(query)
         
         if is_broad_query:
@@ -86,37 +176,103 @@ class SemanticRetriever:
         adjusted_min_score = self._adjust_min_score(query, base_min_score, is_broad_query)
         print(f"Dostosowany próg podobieństwa: {adjusted_min_score:.3f}")
         
-        query_embedding = self.embedder.get_embedding(query)
-        similarities = []
+        if self.structural_index is not None:
+            resolved = self._resolve_structural(query, documents)
+            if resolved is not None:
+                return resolved
         
-        for i, doc_embedding in enumerate(embeddings):
-            try:
-                # Używamy ulepszonej funkcji podobieństwa kosinusowego
-                similarity = self.cosine_similarity(query_embedding, doc_embedding)
-                
-                if similarity >= adjusted_min_score:
-                    similarities.append((i, similarity))
-            except Exception as e:
-                print(f"Błąd podczas obliczania podobieństwa dla dokumentu {i}: {str(e)}")
-                continue
+        query_embedding = self.embed_query(query)
         
-        sorted_similarities = sorted(similarities, key=lambda x: x[1], reverse=True)
+        # Jeden iloczyn macierz-wektor zamiast pętli po wszystkich chunkach
+        try:
+            rows, scores = self.index.search(query_embedding)
+        except ValueError as e:
+            print(f"Błąd podczas obliczania podobieństwa: {str(e)}")
+            return []
         
-        if is_broad_query:
-            results = [(documents[i], score) 
-                        for i, score in sorted_similarities[:effective_top_k]]
+        if self.tombstones:
+            alive = self._alive(rows)
+            rows, scores = rows[alive], scores[alive]
+        
+        above_threshold = scores >= adjusted_min_score
+        candidates = rows[above_threshold]
+        candidate_scores = scores[above_threshold]
+        
+        if self.reranker is not None:
+            # Ostateczną liczbę chunków wyznacza reranker, nie heurystyka spadku podobieństwa
+            order = self._top_k_order(candidate_scores, max(self.reranker.candidates, top_k or 0))
+        elif is_broad_query:
+            order = self._top_k_order(candidate_scores, effective_top_k)
         else:
-            optimal_k = self._get_optimal_top_k(sorted_similarities)
-            results = [(documents[i], score) 
-                        for i, score in sorted_similarities[:optimal_k]]
+            order = self._top_k_order(candidate_scores, None)
+            optimal_k = self._get_optimal_top_k(candidate_scores[order])
+            order = order[:optimal_k]
+        
+        result_rows, result_scores = candidates[order], candidate_scores[order]
+        if self.sparse_index is not None:
+            result_rows, result_scores = self._fuse_sparse(query, query_embedding, documents,
+                                                           result_rows, result_scores)
+        
+        results = [(documents[i], score) for i, score in zip(result_rows, result_scores)]
         
         print(f"Znalezione fragmenty: {len(results)}")
         print("Scores:", [f"{score:.3f}" for _, score in results])
         
         results = self._check_legal_relations(results)
         results = self.doc_similarity.group_similar_chunks(results)
+        if self.reranker is not None and results:
+            results = self.reranker.rerank(query, results, top_k=top_k)
+            print("Scores po rerankingu:", [f"{score:.3f}" for _, score in results])
+        return results
+
+    def _resolve_structural(self, query: str, documents: List[Chunk]) -> Optional[List[Tuple[Chunk, float]]]:
+        """
+        Zwraca chunki wskazane jednoznacznymi odwołaniami z pytania (z wynikiem 1.0)
+        albo None, gdy potrzebne jest zwykłe wyszukiwanie.
+        """
+        rows = self.structural_rows(query)
+        if rows is None:
+            return None
+        
+        self.structural_hits += 1
+        results = [(documents[row], 1.0) for row in rows]
+        print(f"Trafienie strukturalne: {[chunk.section_id for chunk, _ in results]}")
         return results
 
+    def _fuse_sparse(self, query: str, query_embedding: np.ndarray, documents: List[Chunk],
+                     dense_rows: np.ndarray, dense_scores: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Dokłada najlepsze trafienia BM25 do wyników gęstych i porządkuje całość według RRF.
+        
+        Trafienia BM25 nie podlegają progowi podobieństwa - dokładne dopasowanie
+        odwołania nie wymaga szerokiego top_k wyszukiwania gęstego. Zwracane
+        wyniki to nadal podobieństwa kosinusowe.
+        
+        Returns:
+            Krotka (indeksy wierszy, podobieństwa kosinusowe) w kolejności RRF
+        """
+        sparse_rows, _ = self.sparse_index.search(query)
+        if self.tombstones:
+            sparse_rows = sparse_rows[self._alive(sparse_rows)]
+        sparse_rows = sparse_rows[:self.sparse_top_k]
+        if sparse_rows.size == 0:
+            return dense_rows, dense_scores
+        
+        fused = reciprocal_rank_fusion([dense_rows.tolist(), sparse_rows.tolist()], k=self.fusion_k)
+        rows = np.array(sorted(fused, key=lambda row: -fused[row]), dtype=np.int64)
+        
+        cosine = dict(zip(dense_rows.tolist(), dense_scores.tolist()))
+        missing = [row for row in rows.tolist() if row not in cosine]
+        if missing:
+            cosine.update(zip(missing, self.index.scores_for(missing, query_embedding).tolist()))
+        
+        print(f"Trafienia BM25: {len(sparse_rows)} (nowe: {len(missing)})")
+        return rows, np.array([cosine[row] for row in rows.tolist()], dtype=np.float32)
+
+    def _alive(self, rows: np.ndarray) -> np.ndarray:
+        """Maska wierszy, które nie są oznaczone jako usunięte."""
+        return np.isin(rows, self._tombstone_rows, invert=True)
+
     def _calculate_query_complexity(self, query: str) -> Tuple[float, bool]:
         words = query.lower().split()
         
@@ -138,23 +294,34 @@ class SemanticRetriever:
         adjustment = 0.1 * (1 - complexity)
         return min(max(base_score + adjustment, 0.4), 0.7)
 
-    def _get_optimal_top_k(self, similarities: List[Tuple[int, float]], min_results: int = 3) -> int:
-        if not similarities:
+    def _top_k_order(self, scores: np.ndarray, top_k: Optional[int]) -> np.ndarray:
+        """
+        Zwraca indeksy top_k najwyższych wyników, malejąco według score.
+        Remisy zachowują kolejność dokumentów (jak stabilne sortowanie).
+        """
+        if top_k is None or top_k >= len(scores):
+            return np.argsort(-scores, kind='stable')
+        if top_k <= 0:
+            return np.empty(0, dtype=np.intp)
+        
+        top = np.sort(np.argpartition(-scores, top_k - 1)[:top_k])
+        return top[np.argsort(-scores[top], kind='stable')]
+
+    def _get_optimal_top_k(self, scores: np.ndarray, min_results: int = 3) -> int:
+        if len(scores) == 0:
             return min_results
-            
-        scores = [score for _, score in similarities]
         
         if len(scores) < min_results:
             return len(scores)
         
-        score_diffs = [scores[i] - scores[i+1] for i in range(len(scores)-1)]
-        if not score_diffs:
+        score_diffs = scores[:-1] - scores[1:]
+        if score_diffs.size == 0:
             return min_results
             
-        significant_drops = [(i, diff) for i, diff in enumerate(score_diffs) if diff > 0.1]
-        if significant_drops:
-            first_significant_drop = min(significant_drops, key=lambda x: x[1])[0]
-            return max(min_results, first_significant_drop + 1)
+        significant_drops = np.flatnonzero(score_diffs > 0.1)
+        if significant_drops.size:
+            first_significant_drop = significant_drops[np.argmin(score_diffs[significant_drops])]
+            return max(min_results, int(first_significant_drop) + 1)
         
         return min(min_results, len(scores))
 
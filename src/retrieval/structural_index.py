@@ -0,0 +1,132 @@
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+from src.chunking import Chunk
+from src.retrieval.bm25 import PolishLegalTokenizer
+
+Reference = Tuple[Tuple[str, str], ...]
+
+
+class StructuralIndex:
+    """
+    Indeks odwołań do jednostek redakcyjnych ("art. 12 ust. 3", "§ 4").
+
+    Kluczem jest (doc_id, ścieżka odwołania), gdzie ścieżka to pary
+    (section_type, numer) z context_path chunka, np. (("art", "12"), ("ustep", "3")).
+    Chunk jednostki zagnieżdżonej dostępny jest również pod samym numerem
+    własnej jednostki ("ust. 3"), jeśli jest on jednoznaczny. Chunki bez
+    struktury (np. z SimpleTextSplitter) są pomijane.
+
+    Odwołanie w pytaniu rozwiązywane jest słownikiem, bez embeddingu zapytania.
+    """
+
+    REFERABLE_TYPES = ('art', 'paragraf', 'ustep', 'sekcja')
+
+    UNITS = {'art': 'art', '§': 'paragraf', 'par': 'paragraf', 'ust': 'ustep', 'sek': 'sekcja'}
+
+    _REFERENCE_RE = re.compile(
+        r"(?<!\w)(?P<unit>§|art(?:ykul\w*)?\.?|par(?:agraf\w*)?\.?|ust(?:ep\w*)?\.?|sek(?:cj\w*)?\.?)"
+        r"\s*(?P<number>\d+[a-z]?)(?!\w)"
+    )
+    # "art. 12 i 13", "ust. 2-4" - wyliczenia i zakresy nie są jednoznaczne
+    _ENUMERATION_RE = re.compile(r"\d+[a-z]?\s*(?:,|-|–|\bi\b|\boraz\b|\blub\b|\balbo\b|\bdo\b)\s*\d")
+    _TOKENIZER = PolishLegalTokenizer()
+
+    def __init__(self):
+        self._entries: Dict[Reference, Dict[str, List[int]]] = {}
+        self._size = 0
+        self._source: Optional[List[Chunk]] = None
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def reference_count(self) -> int:
+        return len(self._entries)
+
+    def reset(self) -> None:
+        self._entries = {}
+        self._size = 0
+        self._source = None
+
+    def add(self, chunks: List[Chunk]) -> None:
+        """Dodaje chunki na koniec indeksu (kolejne wiersze)."""
+        for row, chunk in enumerate(chunks, start=self._size):
+            path = tuple(
+                (ctx.get('type', ''), str(ctx.get('name', '')))
+                for ctx in getattr(chunk, 'context_path', None) or []
+                if ctx.get('type') in self.REFERABLE_TYPES
+            )
+            if not path or path[-1][0] != getattr(chunk, 'section_type', None):
+                continue
+            keys = {path, path[-1:]} if len(path) > 1 else {path}
+            for key in keys:
+                self._entries.setdefault(key, {}).setdefault(chunk.doc_id, []).append(row)
+        self._size += len(chunks)
+
+    def sync(self, documents: List[Chunk]) -> None:
+        """Synchronizuje indeks z listą chunków pipeline'u (patrz DenseIndex.sync)."""
+        if documents is not self._source or len(documents) < self._size:
+            self.reset()
+            self._source = documents
+        if len(documents) > self._size:
+            self.add(documents[self._size:])
+
+    @classmethod
+    def parse_references(cls, query: str) -> List[Reference]:
+        """
+        Wyszukuje w pytaniu odwołania do jednostek redakcyjnych.
+
+        Kolejne odwołania rozdzielone tylko spacjami lub przecinkiem tworzą
+        jedną ścieżkę ("art. 12 ust. 3"); nowy artykuł albo powtórzona
+        jednostka zaczynają następną.
+
+        Returns:
+            Lista ścieżek, np. [(("art", "12"), ("ustep", "3"))]
+        """
+        text = cls._TOKENIZER.fold(query)
+        references: List[Reference] = []
+        current: List[Tuple[str, str]] = []
+        previous_end = 0
+        for match in cls._REFERENCE_RE.finditer(text):
+            unit = cls.UNITS['§' if match.group('unit') == '§' else match.group('unit')[:3]]
+            adjacent = not text[previous_end:match.start()].strip(" ,")
+            if current and (not adjacent or unit == 'art' or unit in (u for u, _ in current)):
+                references.append(tuple(current))
+                current = []
+            current.append((unit, match.group('number')))
+            previous_end = match.end()
+        if current:
+            references.append(tuple(current))
+        return references
+
+    def resolve(self, query: str, doc_id: Optional[str] = None,
+                exclude: Optional[Set[int]] = None) -> Optional[List[int]]:
+        """
+        Rozwiązuje odwołania z pytania na wiersze chunków.
+
+        Args:
+            query: Pytanie użytkownika
+            doc_id: Opcjonalne ograniczenie do jednego dokumentu
+            exclude: Opcjonalne wiersze pomijane (usunięte chunki)
+
+        Returns:
+            Wiersze chunków albo None, gdy pytanie nie zawiera odwołań lub któreś
+            z nich nie wskazuje dokładnie jednego chunka
+        """
+        references = self.parse_references(query)
+        if not references or not self._entries or self._ENUMERATION_RE.search(self._TOKENIZER.fold(query)):
+            return None
+
+        rows: List[int] = []
+        for reference in references:
+            by_document = self._entries.get(reference, {})
+            if doc_id is not None:
+                by_document = {doc_id: by_document.get(doc_id, [])}
+            matches = [row for doc_rows in by_document.values() for row in doc_rows
+                       if not exclude or row not in exclude]
+            if len(matches) != 1:
+                return None
+            if matches[0] not in rows:
+                rows.append(matches[0])
+        return rows
@@ -0,0 +1,59 @@
+import hashlib
+
+import numpy as np
+import pytest
+
+
+class FakeEmbedder:
+    """
+    Deterministyczny embedder testowy: wektor wyznaczany z hasha tekstu.
+    Zapamiętuje paczki tekstów przekazane do get_embeddings.
+    """
+
+    def __init__(self, dim: int = 8, use_gpu: bool = False, model_name: str = "fake-embedder"):
+        self.dim = dim
+        self.model_name = model_name
+        self.use_gpu = use_gpu
+        self.batches = []
+
+    def _vector(self, text: str) -> np.ndarray:
+        seed = int(hashlib.md5(text.encode()).hexdigest()[:8], 16)
+        return np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+
+    def get_embedding(self, text: str) -> np.ndarray:
+        self.batches.append([text])
+        return self._vector(text).reshape(1, -1)
+
+    def get_embeddings(self, texts, batch_size: int = 32) -> np.ndarray:
+        self.batches.append(list(texts))
+        if not texts:
+            return np.empty((0, self.dim), dtype=np.float32)
+        return np.vstack([self._vector(t) for t in texts])
+
+
+LEGAL_DOCUMENT = """Rozdział I
+Art. 1. Niniejsze OWU mają zastosowanie do umowy ubezpieczenia na życie.
+Art. 2. Ubezpieczony to osoba fizyczna, której życie jest przedmiotem ubezpieczenia.
+Rozdział II
+Art. 3. Ochrona ubezpieczeniowa rozpoczyna się od dnia zawarcia umowy.
+1. Składka płatna jest miesięcznie.
+2. Brak zapłaty składki powoduje wygaśnięcie umowy.
+Art. 4. Towarzystwo nie odpowiada za zdarzenia powstałe wskutek działań wojennych.
+"""
+
+
+@pytest.fixture
+def legal_pipeline(tmp_path, monkeypatch):
+    """LegalRAGPipeline z chunkerem hierarchicznym i embedderem testowym zamiast bge-m3"""
+    import src.rag.LegalRAGPipeline as module
+    from src.chunking.hierarchical_chunker import HierarchicalLegalChunker
+
+    monkeypatch.setattr(module, "PolishLegalEmbedder", FakeEmbedder)
+    monkeypatch.chdir(tmp_path)
+
+    def build(**kwargs):
+        kwargs.setdefault("cache_dir", str(tmp_path / "cache"))
+        kwargs.setdefault("chunker", HierarchicalLegalChunker())
+        return module.LegalRAGPipeline(**kwargs)
+
+    return build
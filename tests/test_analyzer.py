@@ -0,0 +1,72 @@
+from src.analyzers.legal_text_structure_analyzer import LegalTextStructureAnalyzer
+
+from tests.conftest import LEGAL_DOCUMENT
+
+
+MIXED_DOCUMENT = """Rozdział I
+Art. 1. Przepisy ogólne
+1. Pierwszy punkt numeryczny
+a) litera
+- wyliczenie
+1° punkt stopniowy
+2) punkt
+Ust. 2 ustęp
+§ 3. paragraf
+Zał. 1
+Sekcja 2
+Definicje 4
+Postanowienia Ogólne 5
+R. IV
+Art. 2. Koniec
+"""
+
+
+def brute_force_ends(markers, line_count):
+    """Końce sekcji liczone wprost: pierwszy późniejszy marker tego samego typu lub wyższego poziomu"""
+    ends = []
+    for i, marker in enumerate(markers):
+        for later in markers[i + 1:]:
+            if later['type'] == marker['type'] or later['hierarchy_level'] <= marker['hierarchy_level']:
+                ends.append(later['line'] - 1)
+                break
+        else:
+            ends.append(line_count)
+    return ends
+
+
+class TestLegalTextStructureAnalyzer:
+    def test_markers_are_recognised_in_pattern_order(self):
+        analyzer = LegalTextStructureAnalyzer(MIXED_DOCUMENT)
+
+        assert [m['id'] for m in analyzer.section_markers] == [
+            'rozdzial_I', 'art_1', 'punkt_numeryczny_1_2', 'literowy_punkt_a_3', 'wyliczenie_-_4',
+            'stopniowy_punkt_1°_5', 'punkt_2_6', 'ustep_2', 'paragraf_3', 'zalacznik_1', 'sekcja_2',
+            'definicje_4', 'postanowienia_5', 'rozdzial_IV', 'art_2',
+        ]
+        assert analyzer.section_markers[2]['hierarchy_key'] == 'punkt'
+        assert analyzer.section_markers[3]['hierarchy_level'] == 3
+
+    def test_section_ends_match_pairwise_scan(self):
+        long_document = "\n".join(
+            f"Art. {i}.\n§ 1. tekst\n1) punkt\na) litera\n2) punkt\nUst. 2 tekst\n- wyliczenie"
+            for i in range(1, 200)
+        )
+        for text in (MIXED_DOCUMENT, LEGAL_DOCUMENT, long_document):
+            analyzer = LegalTextStructureAnalyzer(text)
+            markers = analyzer.section_markers
+
+            assert [m['content_end'] for m in markers] == brute_force_ends(markers, len(analyzer.lines))
+
+    def test_context_paths_follow_parent_map(self):
+        analyzer = LegalTextStructureAnalyzer("Rozdział I\nArt. 1.\n§ 1. tekst\n§ 2. tekst\nArt. 2.\n§ 1. tekst")
+        paragraph = analyzer.section_markers[3]
+        parent_id = analyzer.child_to_parent[paragraph['id']]
+
+        path = analyzer.build_context_path(paragraph['id'])
+
+        assert [entry['id'] for entry in path][-2:] == [parent_id, paragraph['id']]
+        assert analyzer.build_context_path(parent_id) == path[:-1]
+        assert analyzer.build_context_path("brak") == []
+        # Zwracane są kopie - modyfikacja nie psuje zapamiętanych ścieżek
+        path[0]['name'] = "zmienione"
+        assert analyzer.build_context_path(paragraph['id'])[0]['name'] != "zmienione"
@@ -0,0 +1,137 @@
+import numpy as np
+
+from src.chunking import Chunk
+from src.retrieval import BM25Index, PolishLegalTokenizer, reciprocal_rank_fusion
+
+
+TEXTS = [
+    "Art. 415. Kto z winy swej wyrządził drugiemu szkodę, obowiązany jest do jej naprawienia.",
+    "Art. 471. Dłużnik obowiązany jest do naprawienia szkody wynikłej z niewykonania zobowiązania.",
+    "§ 3. Umowa sprzedaży nieruchomości powinna być zawarta w formie aktu notarialnego.",
+    "Art. 4 ust. 2. Pracodawca prowadzi dokumentację w sprawach związanych ze stosunkiem pracy.",
+]
+
+
+def chunks(texts):
+    return [Chunk(text=text, chunk_id=i) for i, text in enumerate(texts)]
+
+
+class TestPolishLegalTokenizer:
+    def test_references_become_exact_tokens(self):
+        tokens = PolishLegalTokenizer().tokenize("Zgodnie z art. 415 oraz § 3 ust. 2 pkt 1")
+
+        assert {"art:415", "par:3", "ust:2", "pkt:1"} <= set(tokens)
+        assert "z" not in tokens and "oraz" not in tokens
+
+    def test_diacritics_and_inflection_are_folded(self):
+        tokenizer = PolishLegalTokenizer()
+
+        assert tokenizer.tokenize("Szkoda") == tokenizer.tokenize("szkody")
+        assert tokenizer.tokenize("Dłużnik") == tokenizer.tokenize("dluznik")
+
+
+class TestBM25Index:
+    def test_exact_reference_ranks_first(self):
+        index = BM25Index()
+        index.sync(chunks(TEXTS))
+
+        rows, scores = index.search("co mówi art. 415?")
+        assert rows[0] == 0
+        assert np.all(np.diff(scores) <= 0)
+
+        rows, _ = index.search("naprawienie szkody")
+        assert set(rows[:2].tolist()) == {0, 1}
+
+    def test_incremental_add_matches_full_build(self):
+        documents = chunks(TEXTS * 800)
+        incremental = BM25Index()
+        corpus = []
+        # Kolejne partie trafiają najpierw do ogona, a potem są scalane z CSR
+        for start, end in ((0, 5), (5, 400), (400, 3200)):
+            corpus.extend(documents[start:end])
+            incremental.sync(corpus)
+        assert not incremental._tail
+
+        full = BM25Index()
+        full.add([chunk.text for chunk in documents])
+
+        for query in ("art. 471 dłużnik", "forma aktu notarialnego", "pracodawca"):
+            rows, scores = incremental.search(query)
+            expected_rows, expected_scores = full.search(query)
+            np.testing.assert_array_equal(rows, expected_rows)
+            np.testing.assert_allclose(scores, expected_scores, rtol=1e-6)
+
+    def test_scores_match_dense_bm25_formula(self):
+        """Sumowanie po wierszach postingów daje te same wyniki co wzór liczony dla całego korpusu"""
+        index = BM25Index()
+        index.sync(chunks(TEXTS * 3))
+        tokenized = [index.tokenizer.tokenize(text) for text in TEXTS * 3]
+        average_length = np.mean([len(tokens) for tokens in tokenized])
+
+        query = "art. 471 naprawienie szkody dłużnik"
+        expected = np.zeros(len(tokenized))
+        for term in set(index.tokenizer.tokenize(query)):
+            df = sum(term in tokens for tokens in tokenized)
+            if df == 0:
+                continue
+            idf = np.log(1 + (len(tokenized) - df + 0.5) / (df + 0.5))
+            for row, tokens in enumerate(tokenized):
+                tf = tokens.count(term)
+                norm = index.k1 * (1 - index.b + index.b * len(tokens) / average_length)
+                expected[row] += idf * tf * (index.k1 + 1) / (tf + norm)
+
+        rows, scores = index.search(query)
+        assert sorted(rows.tolist()) == np.flatnonzero(expected).tolist()
+        np.testing.assert_allclose(scores, expected[rows], rtol=1e-5)
+
+    def test_saved_index_is_adopted_only_for_same_corpus(self, tmp_path):
+        documents = chunks(TEXTS)
+        index = BM25Index()
+        index.sync(documents)
+        index.save(tmp_path / "bm25.npz")
+
+        restored = BM25Index()
+        assert restored.load(tmp_path / "bm25.npz")
+        restored.sync(documents + chunks(["Art. 5. Nowy przepis o zasiedzeniu."]))
+        assert len(restored) == 5
+        assert restored.search("art. 415")[0][0] == 0
+        assert restored.search("zasiedzenie")[0][0] == 4
+
+        stale = BM25Index()
+        stale.load(tmp_path / "bm25.npz")
+        stale.sync(chunks(["Inny tekst."] + TEXTS[1:]))
+        # Odcisk się nie zgadza - indeks jest budowany od nowa z bieżących tekstów
+        assert 0 not in stale.search("art. 415")[0]
+
+    def test_save_is_deferred_until_index_grows(self, tmp_path):
+        """Plik przepisywany jest po wzroście o ponad 25%; brakujące wiersze dokłada sync"""
+        path = tmp_path / "bm25.npz"
+        documents = chunks(TEXTS * 10)
+        index = BM25Index()
+        index.sync(documents)
+        index.save(path)
+        saved_at = path.stat().st_mtime_ns
+
+        documents.extend(chunks(["Art. 5. Nowy przepis o zasiedzeniu."]))
+        index.sync(documents)
+        index.save(path)
+        assert path.stat().st_mtime_ns == saved_at
+
+        restored = BM25Index()
+        restored.load(path)
+        restored.sync(documents)
+        assert len(restored) == len(documents)
+        assert restored.search("zasiedzenie")[0][0] == len(documents) - 1
+
+        index.save(path, force=True)
+        assert path.stat().st_mtime_ns != saved_at
+        with np.load(path) as data:
+            assert len(data['doc_lengths']) == len(documents)
+
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    fused = reciprocal_rank_fusion([[1, 2, 3], [3, 1, 4]], k=60)
+
+    assert max(fused, key=fused.get) == 1
+    assert fused[3] > fused[2]
+    assert set(fused) == {1, 2, 3, 4}
@@ -0,0 +1,239 @@
+import json
+
+import numpy as np
+import pytest
+
+from src.cache import BaseCache, MemmapCache, MemmapVectorStore, QueryEmbeddingCache, SemanticAnswerCache
+from tests.conftest import FakeEmbedder
+
+
+class TestBaseCache:
+    @pytest.fixture(params=[BaseCache, MemmapCache])
+    def cache(self, request, tmp_path):
+        return request.param(str(tmp_path / "cache"))
+
+    def test_get_embeddings_embeds_only_misses(self, cache):
+        """Tylko teksty spoza cache'u trafiają do embeddera, w jednym wywołaniu"""
+        embedder = FakeEmbedder()
+        cached = cache.get_embedding("art. 1", embedder)
+        embedder.batches.clear()
+
+        texts = ["art. 1", "art. 2", "art. 3", "art. 2"]
+        embeddings = cache.get_embeddings(texts, embedder)
+
+        assert embedder.batches == [["art. 2", "art. 3"]]
+        assert [e.shape for e in embeddings] == [(1, embedder.dim)] * 4
+        np.testing.assert_array_equal(embeddings[0], cached)
+        np.testing.assert_array_equal(embeddings[1], embeddings[3])
+
+        embedder.batches.clear()
+        cache.get_embeddings(texts, embedder)
+        assert embedder.batches == []
+
+
+class TestMemmapCache:
+    def test_migrates_npy_directory(self, tmp_path):
+        """Istniejące pliki .npy są jednorazowo przenoszone do jednego pliku"""
+        legacy = BaseCache(str(tmp_path / "cache"))
+        embedder = FakeEmbedder()
+        texts = [f"art. {i}" for i in range(5)]
+        expected = legacy.get_embeddings(texts, embedder)
+
+        cache = MemmapCache(str(tmp_path / "cache"))
+
+        assert not (tmp_path / "cache" / "embeddings").exists()
+        assert len(cache.store) == 5
+        embedder.batches.clear()
+        migrated = cache.get_embeddings(texts, embedder)
+        assert embedder.batches == []
+        for a, b in zip(migrated, expected):
+            np.testing.assert_array_equal(a, b)
+
+    def test_store_reopens_and_drops_torn_write(self, tmp_path):
+        """Po ponownym otwarciu magazyn mapuje plik i obcina niedokończony zapis"""
+        store = MemmapVectorStore(tmp_path / "vectors")
+        vectors = np.arange(12, dtype=np.float32).reshape(3, 4)
+        store.add(["a" * 32, "b" * 32, "c" * 32], list(vectors))
+
+        # Symulujemy przerwany zapis: wektor bez hasha i ucięty hash
+        with store.vectors_path.open('ab') as f:
+            f.write(np.ones(4, dtype=np.float32).tobytes())
+        with store.hashes_path.open('a') as f:
+            f.write("d" * 10)
+
+        reopened = MemmapVectorStore(tmp_path / "vectors")
+        assert len(reopened) == 3
+        assert isinstance(reopened.matrix, np.memmap)
+        np.testing.assert_array_equal(reopened.get("b" * 32), vectors[1:2])
+
+        reopened.add(["d" * 32], [np.full(4, 7, dtype=np.float32)])
+        assert len(MemmapVectorStore(tmp_path / "vectors")) == 4
+
+    def test_store_compaction_keeps_rows_and_recovers_interrupted_swap(self, tmp_path):
+        store = MemmapVectorStore(tmp_path / "vectors")
+        vectors = np.arange(12, dtype=np.float32).reshape(3, 4)
+        store.add(["a" * 32, "b" * 32, "c" * 32], list(vectors))
+
+        assert store.compact(["a" * 32, "c" * 32]) == 1
+        assert store.hashes == ["a" * 32, "c" * 32]
+        np.testing.assert_array_equal(store.get("c" * 32), vectors[2:3])
+
+        # Przerwana podmiana: stary katalog przeniesiony, nowego jeszcze nie ma
+        (tmp_path / "vectors").rename(tmp_path / "vectors.old")
+        (tmp_path / "vectors.compact").mkdir()
+        reopened = MemmapVectorStore(tmp_path / "vectors")
+        assert len(reopened) == 2 and not (tmp_path / "vectors.compact").exists()
+        assert reopened.compact([]) == 2
+        reopened.add(["d" * 32], [np.ones(4, dtype=np.float32)])
+        assert MemmapVectorStore(tmp_path / "vectors").hashes == ["d" * 32]
+
+
+class TestChunkMetadataLog:
+    @pytest.fixture
+    def chunks(self):
+        from src.chunking.hierarchical_chunker import LegalChunk
+        return [
+            LegalChunk(text=f"Art. {i}. treść {doc}", section_type="art", section_id=f"art_{i}",
+                       doc_id=doc, chunk_id=i, context_path=[], line_start=i, line_end=i + 1)
+            for doc in ("doc_a", "doc_b") for i in range(3)
+        ]
+
+    def test_chunks_with_same_id_in_different_documents_are_kept(self, tmp_path, chunks):
+        """Chunki o tym samym chunk_id z różnych dokumentów nie są traktowane jak duplikaty"""
+        cache = MemmapCache(str(tmp_path / "cache"))
+        embeddings = [np.full((1, 4), i, dtype=np.float32) for i in range(len(chunks))]
+        cache.save_cache(chunks[:3], embeddings[:3])
+        cache.save_cache(chunks, embeddings)
+
+        documents, loaded = MemmapCache(str(tmp_path / "cache")).load_cache()
+        assert [(c.doc_id, c.chunk_id) for c in documents] == [(c.doc_id, c.chunk_id) for c in chunks]
+        assert cache.metadata_log.log_records == len(chunks)
+
+    def test_torn_write_loses_only_last_record(self, tmp_path, chunks):
+        """Ucięty ostatni rekord dziennika nie niszczy pozostałych"""
+        cache = MemmapCache(str(tmp_path / "cache"))
+        cache.save_cache(chunks, [np.ones((1, 4), dtype=np.float32)] * len(chunks))
+
+        log_path = cache.metadata_log.log_path
+        data = log_path.read_bytes()
+        log_path.write_bytes(data[:-20])
+
+        documents, _ = MemmapCache(str(tmp_path / "cache")).load_cache()
+        assert len(documents) == len(chunks) - 1
+
+    def test_compaction_and_legacy_migration(self, tmp_path, chunks):
+        """Stary chunks_info.json trafia do checkpointu, a kompaktowanie czyści dziennik"""
+        cache_dir = tmp_path / "cache"
+        cache_dir.mkdir()
+        legacy = [{"text": c.text, "doc_id": c.doc_id, "chunk_id": c.chunk_id, "embedding_hash": "0" * 32,
+                   "section_type": c.section_type, "section_id": c.section_id,
+                   "line_start": c.line_start, "line_end": c.line_end, "context_path": []}
+                  for c in chunks[:3]]
+        (cache_dir / "chunks_info.json").write_text(json.dumps(legacy), encoding="utf-8")
+
+        cache = BaseCache(str(cache_dir))
+        assert not (cache_dir / "chunks_info.json").exists()
+        assert cache.metadata_log.checkpoint_records == 3
+
+        cache.metadata_log.compact_min_records = 2
+        cache.save_cache(chunks[3:], [np.ones((1, 4), dtype=np.float32)] * 3)
+        assert cache.metadata_log.log_records == 0
+        assert cache.metadata_log.checkpoint_records == 6
+
+
+class TestQueryEmbeddingCache:
+    def test_repeated_queries_hit_cache(self):
+        """Zapytania różniące się tylko białymi znakami liczone są raz, osobno dla każdego modelu"""
+        embedder = FakeEmbedder()
+        cache = QueryEmbeddingCache(max_size=10)
+
+        first = cache.get_or_compute("Co obejmuje  ubezpieczenie?", "bge", embedder.get_embedding)
+        second = cache.get_or_compute(" Co obejmuje ubezpieczenie? ", "bge", embedder.get_embedding)
+        cache.get_or_compute("Co obejmuje ubezpieczenie?", "inny-model", embedder.get_embedding)
+
+        np.testing.assert_array_equal(first, second)
+        assert embedder.batches == [["Co obejmuje ubezpieczenie?"]] * 2
+        assert cache.get_stats()["hits"] == 1
+        assert cache.get_stats()["misses"] == 2
+
+    def test_evicts_least_recently_used(self):
+        embedder = FakeEmbedder()
+        cache = QueryEmbeddingCache(max_size=2)
+        for query in ["a", "b", "a", "c"]:
+            cache.get_or_compute(query, "bge", embedder.get_embedding)
+
+        embedder.batches.clear()
+        cache.get_or_compute("a", "bge", embedder.get_embedding)
+        cache.get_or_compute("b", "bge", embedder.get_embedding)
+        assert embedder.batches == [["b"]]
+        assert len(cache) == 2
+
+    def test_persists_between_instances(self, tmp_path):
+        embedder = FakeEmbedder()
+        cache = QueryEmbeddingCache(max_size=2, store_dir=tmp_path / "queries")
+        for query in ["a", "b", "c", "d", "e"]:
+            cache.get_or_compute(query, "bge", embedder.get_embedding)
+        # Magazyn przepisywany jest po przekroczeniu 2 * max_size wpisów
+        assert len(cache.store) <= 4
+
+        embedder.batches.clear()
+        reopened = QueryEmbeddingCache(max_size=2, store_dir=tmp_path / "queries")
+        reopened.get_or_compute("e", "bge", embedder.get_embedding)
+        reopened.get_or_compute("d", "bge", embedder.get_embedding)
+        assert embedder.batches == []
+
+    def test_restart_keeps_recently_used_entries(self, tmp_path):
+        embedder = FakeEmbedder()
+        cache = QueryEmbeddingCache(max_size=2, store_dir=tmp_path / "queries")
+        for query in ["a", "b", "a", "c"]:
+            cache.get_or_compute(query, "bge", embedder.get_embedding)
+
+        embedder.batches.clear()
+        # "a" dodano najwcześniej, ale było użyte później niż "b"
+        reopened = QueryEmbeddingCache(max_size=2, store_dir=tmp_path / "queries")
+        reopened.get_or_compute("a", "bge", embedder.get_embedding)
+        reopened.get_or_compute("c", "bge", embedder.get_embedding)
+        assert embedder.batches == []
+
+
+class TestSemanticAnswerCache:
+    @pytest.fixture
+    def evidence(self):
+        return SemanticAnswerCache.evidence_key([("owu", 0), ("owu", 3)])
+
+    def test_hit_requires_similar_query_and_same_evidence(self, evidence):
+        cache = SemanticAnswerCache(similarity_threshold=0.9)
+        query = np.array([1.0, 0.0, 0.0], dtype=np.float32)
+        cache.put(query, evidence, "odpowiedź", mode="query")
+
+        assert cache.get(np.array([0.98, 0.1, 0.0]), evidence, mode="query") == "odpowiedź"
+        assert cache.get(np.array([0.5, 0.5, 0.0]), evidence, mode="query") is None
+        assert cache.get(query, SemanticAnswerCache.evidence_key([("owu", 0)]), mode="query") is None
+        assert cache.get(query, evidence, mode="large_context") is None
+        assert cache.get_stats()["hits"] == 1
+
+    def test_ttl_and_size_eviction(self, evidence, monkeypatch):
+        import src.cache.answer_cache as module
+
+        now = [1000.0]
+        monkeypatch.setattr(module.time, "time", lambda: now[0])
+        cache = SemanticAnswerCache(ttl_seconds=60, max_size=2)
+        for i in range(3):
+            cache.put(np.eye(3)[i], evidence, f"odpowiedź {i}")
+
+        assert len(cache) == 2
+        assert cache.get(np.eye(3)[0], evidence) is None
+        assert cache.get(np.eye(3)[2], evidence) == "odpowiedź 2"
+
+        now[0] += 61
+        assert cache.get(np.eye(3)[2], evidence) is None
+        assert len(cache) == 0
+
+    def test_invalidate_drops_answers_in_flight(self, evidence):
+        cache = SemanticAnswerCache()
+        generation = cache.generation
+        cache.put(np.ones(3), evidence, "stara odpowiedź")
+        cache.invalidate()
+        cache.put(np.ones(3), evidence, "odpowiedź sprzed zmiany korpusu", generation=generation)
+
+        assert len(cache) == 0
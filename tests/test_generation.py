@@ -0,0 +1,290 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.chunking import Chunk
+from src.generation.clients import ClientPool
+from src.generation.context_packer import ContextPacker, TokenCounter
+from src.generation.ollama import OllamaGenerator
+from src.generation.resilience import CircuitBreaker, CircuitOpenError, RetryableError, RetryPolicy
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    """Minimalne API Ollama z połączeniami keep-alive (HTTP/1.1)"""
+    protocol_version = "HTTP/1.1"
+
+    failures = 0  # liczba kolejnych odpowiedzi 503 przed sukcesem
+    status = 200  # kod odpowiedzi zwracany zamiast sukcesu (np. 404 dla nieznanego modelu)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if FakeOllamaHandler.status != 200:
+            self.send_response(FakeOllamaHandler.status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if FakeOllamaHandler.failures > 0:
+            FakeOllamaHandler.failures -= 1
+            self.send_response(503)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = json.dumps({"response": f"echo: {request['prompt'][-10:]}.", "done": True}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def ollama_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOllamaHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    FakeOllamaHandler.failures = 0
+    FakeOllamaHandler.status = 200
+    server.shutdown()
+    server.server_close()
+
+
+class TestClientPool:
+    def test_generators_reuse_pooled_connections(self, ollama_url):
+        pool = ClientPool(pool_size=2)
+        first = OllamaGenerator(base_url=ollama_url, clients=pool)
+        second = OllamaGenerator(base_url=ollama_url, clients=pool)
+
+        for generator in (first, second, first):
+            assert generator.generate("pytanie", [])["answer"].startswith("echo")
+
+        stats = pool.get_stats()["http"]
+        assert stats["requests"] == 3
+        assert stats["new_connections"] == 1
+        assert stats["reused_connections"] == 2
+
+    def test_async_client_is_shared_within_event_loop(self, ollama_url):
+        import asyncio
+
+        pool = ClientPool()
+        generator = OllamaGenerator(base_url=ollama_url, clients=pool)
+
+        async def ask():
+            results = await asyncio.gather(*(generator.agenerate("pytanie", []) for _ in range(3)))
+            return results, pool.async_http()
+
+        results, client = asyncio.run(ask())
+        assert all(r["answer"].startswith("echo") for r in results)
+        assert pool.get_stats()["async_http"] == {"clients": 1, "requests": 3}
+
+        # Nowa pętla dostaje nowego klienta, klient zamkniętej pętli jest usuwany
+        _, other = asyncio.run(ask())
+        assert other is not client
+        assert pool.get_stats()["async_http"]["clients"] == 1
+
+    def test_async_clients_are_closed(self, monkeypatch):
+        import asyncio
+
+        monkeypatch.setenv("ANTHROPIC_API_KEY", "klucz")
+        pool = ClientPool()
+
+        async def open_and_close():
+            client, anthropic_client = pool.async_http(), pool.async_anthropic_client()
+            await pool.aclose()
+            return client, anthropic_client
+
+        client, anthropic_client = asyncio.run(open_and_close())
+        assert client.is_closed and anthropic_client.is_closed()
+        assert pool.get_stats()["async_http"]["clients"] == 0
+
+        # close() zamyka też klienty pętli, która jeszcze nie została zamknięta
+        loop = asyncio.new_event_loop()
+        try:
+            client = loop.run_until_complete(self._make_client(pool))
+            pool.close()
+            assert client.is_closed
+        finally:
+            loop.close()
+
+    @staticmethod
+    async def _make_client(pool):
+        return pool.async_http()
+
+    def test_anthropic_client_is_cached_per_key(self, monkeypatch):
+        monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
+        pool = ClientPool()
+
+        assert pool.anthropic_client() is None
+        assert pool.anthropic_client("klucz") is pool.anthropic_client("klucz")
+        assert pool.anthropic_client("klucz") is not pool.anthropic_client("inny")
+
+
+class TestResilience:
+    def test_backoff_is_jittered_and_honours_retry_after(self):
+        policy = RetryPolicy(base_delay=1.0, max_delay=8.0, seed=0)
+
+        delays = [policy.backoff(attempt) for attempt in range(6) for _ in range(50)]
+        assert all(0 <= d <= 8.0 for d in delays)
+        assert len(set(delays)) == len(delays)
+        assert policy.backoff(0, retry_after=5.0) >= 5.0
+        assert policy.backoff(0, retry_after=60.0) <= 8.0
+
+    def test_generator_retries_server_errors(self, ollama_url):
+        FakeOllamaHandler.failures = 2
+        breaker = CircuitBreaker("test", failure_threshold=5)
+        generator = OllamaGenerator(base_url=ollama_url, clients=ClientPool(),
+                                    retry_policy=RetryPolicy(max_attempts=3, base_delay=0.01),
+                                    circuit_breaker=breaker)
+
+        assert generator.generate("pytanie", [])["answer"].startswith("echo")
+        assert generator.retry_policy.get_stats()["retries"] == 2
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_acomplete_retries_server_errors(self, ollama_url):
+        import asyncio
+
+        FakeOllamaHandler.failures = 1
+        breaker = CircuitBreaker("test", failure_threshold=5)
+        generator = OllamaGenerator(base_url=ollama_url, clients=ClientPool(),
+                                    retry_policy=RetryPolicy(max_attempts=3, base_delay=0.01),
+                                    circuit_breaker=breaker)
+
+        async def complete():
+            try:
+                return await generator.acomplete("pytanie", "system")
+            finally:
+                await generator.clients.aclose()
+
+        assert asyncio.run(complete()).startswith("echo")
+        assert generator.retry_policy.get_stats()["retries"] == 1
+        assert breaker.get_stats()["consecutive_failures"] == 0
+
+    def test_breaker_fails_fast_and_recovers(self):
+        import time
+
+        breaker = CircuitBreaker("test", failure_threshold=2, recovery_timeout=0.2)
+        policy = RetryPolicy(max_attempts=1)
+        calls = []
+
+        def failing():
+            calls.append(1)
+            raise RetryableError("503")
+
+        for _ in range(2):
+            with pytest.raises(RetryableError):
+                policy.call(failing, breaker=breaker)
+        assert breaker.state == CircuitBreaker.OPEN
+
+        with pytest.raises(CircuitOpenError):
+            policy.call(failing, breaker=breaker)
+        assert len(calls) == 2
+        assert breaker.get_stats()["rejected_calls"] == 1
+
+        time.sleep(0.25)
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert policy.call(lambda: "ok", breaker=breaker) == "ok"
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_stream_releases_half_open_trial(self, ollama_url):
+        breaker = CircuitBreaker("test", failure_threshold=1, recovery_timeout=0)
+        generator = OllamaGenerator(base_url=ollama_url, clients=ClientPool(),
+                                    retry_policy=RetryPolicy(max_attempts=3, base_delay=0.01),
+                                    circuit_breaker=breaker)
+
+        # Nieznany model: błąd nie jest ponawiany, ale zwalnia miejsce próbne
+        breaker.record_failure()
+        FakeOllamaHandler.status = 404
+        with pytest.raises(RuntimeError, match="Błąd API Ollama: 404"):
+            list(generator.stream_completion("pytanie", "system"))
+        assert breaker.state == CircuitBreaker.CLOSED
+
+        # Odbiorca przerywa strumień po pierwszym fragmencie (GeneratorExit)
+        breaker.record_failure()
+        FakeOllamaHandler.status = 200
+        stream = generator.stream_completion("pytanie", "system")
+        assert next(stream).startswith("echo")
+        stream.close()
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert breaker.allow_request()
+
+    def test_stream_retries_only_before_first_item(self, monkeypatch):
+        import src.generation.resilience as resilience
+
+        sleeps = []
+        monkeypatch.setattr(resilience.time, "sleep", sleeps.append)
+        breaker = CircuitBreaker("test", failure_threshold=5)
+        policy = RetryPolicy(max_attempts=3, base_delay=0.01, max_delay=10.0)
+        attempts = []
+
+        def flaky():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise RetryableError("429", retry_after=2.0)
+            yield "a"
+            raise RetryableError("503")
+
+        stream = policy.stream(flaky, breaker=breaker, retryable=lambda e: isinstance(e, RetryableError))
+        assert next(stream) == "a"
+        with pytest.raises(RetryableError, match="503"):
+            next(stream)
+        assert len(attempts) == 2 and sleeps[0] >= 2.0
+        assert policy.get_stats()["retries"] == 1 and policy.get_stats()["failures"] == 1
+        assert breaker.get_stats()["consecutive_failures"] == 2
+
+    def test_client_errors_are_not_retried(self):
+        policy = RetryPolicy(max_attempts=5, base_delay=0.01)
+        calls = []
+
+        def bad_request():
+            calls.append(1)
+            raise ValueError("400")
+
+        with pytest.raises(ValueError):
+            policy.call(bad_request, retryable=lambda e: isinstance(e, RetryableError))
+        assert len(calls) == 1
+
+
+class TestContextPacker:
+    def test_packs_best_chunks_into_budget_without_mutation(self):
+        chunks = [Chunk(text="a" * 400, chunk_id=0), Chunk(text="b" * 2000, chunk_id=1),
+                  Chunk(text="c" * 200, chunk_id=2)]
+        packer = ContextPacker(TokenCounter(), max_tokens=200, per_chunk_overhead=0, min_partial_tokens=1000)
+
+        packed = packer.pack(chunks)
+
+        # Za duży chunk jest pomijany, a jego miejsce zajmuje krótszy
+        assert [c.chunk_id for c in packed] == [0, 2]
+        assert packed[0] is chunks[0]
+        assert chunks[1].text == "b" * 2000
+        assert packer.get_stats()["dropped_chunks"] == 1
+
+    def test_truncated_chunk_is_a_copy(self):
+        chunks = [Chunk(text="a" * 400, chunk_id=0), Chunk(text="b" * 2000, chunk_id=1)]
+        packer = ContextPacker(TokenCounter(), max_tokens=300, per_chunk_overhead=0, min_partial_tokens=50)
+
+        packed = packer.pack(chunks)
+
+        assert [c.chunk_id for c in packed] == [0, 1]
+        assert packed[1] is not chunks[1]
+        assert packed[1].text == "b" * 800
+        assert chunks[1].text == "b" * 2000
+
+    def test_token_counts_are_cached_per_text(self):
+        class CountingTokenizer:
+            calls = 0
+
+            def encode(self, text, add_special_tokens=False):
+                CountingTokenizer.calls += 1
+                return text.split()
+
+        counter = TokenCounter(CountingTokenizer())
+        assert counter.count("Art. 1 ust. 2") == 4
+        assert counter.count("Art. 1 ust. 2") == 4
+        assert CountingTokenizer.calls == 1
+        assert counter.get_stats()["hits"] == 1
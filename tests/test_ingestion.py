@@ -0,0 +1,96 @@
+import pickle
+
+import pytest
+
+from src.cache import MemmapCache
+from src.chunking.hierarchical_chunker import HierarchicalLegalChunker
+from src.rag.ingestion import IngestionPipeline
+from tests.conftest import FakeEmbedder, LEGAL_DOCUMENT
+
+
+def documents(n: int):
+    return [(LEGAL_DOCUMENT.replace("OWU", f"OWU {i}"), f"doc_{i}") for i in range(n)]
+
+
+class FailingEmbedder(FakeEmbedder):
+    def get_embeddings(self, texts, batch_size: int = 32):
+        raise RuntimeError("model niedostępny")
+
+
+class TestIngestionPipeline:
+    @pytest.fixture
+    def build(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+
+        def build(embedder=None, **kwargs):
+            return IngestionPipeline(
+                chunker=HierarchicalLegalChunker(),
+                embedder=embedder or FakeEmbedder(),
+                cache=MemmapCache(str(tmp_path / "cache")),
+                **kwargs
+            )
+        return build
+
+    def test_parallel_chunking_preserves_order(self, build):
+        """Pula procesów daje te same chunki w tej samej kolejności co chunking na miejscu"""
+        results = {}
+        for workers in (1, 2):
+            batches = []
+            stats = build(num_workers=workers, commit_batch_size=6).run(documents(5), batches.append)
+            results[workers] = [(c.doc_id, c.chunk_id, c.text) for b in batches for c in b.chunks]
+            assert stats["stages"]["chunking"]["workers"] == workers
+
+        assert results[1] == results[2]
+        assert [doc_id for doc_id, _, _ in results[2][::4]] == [f"doc_{i}" for i in range(5)]
+
+    def test_batches_contain_whole_documents(self, build):
+        batches = []
+        stats = build(num_workers=1, commit_batch_size=6).run(documents(5), batches.append)
+
+        # Dokument ma 4 chunki, więc paczka zamyka się po dwóch dokumentach
+        assert [len(b.documents) for b in batches] == [2, 2, 1]
+        assert all(len(b.embeddings) == len(b.chunks) for b in batches)
+        assert stats["added_documents"] == 5
+        assert stats["new_chunks"] == 20
+        assert stats["stages"]["embedding"]["batches"] == 3
+        assert stats["stages"]["writing"]["chunks_per_s"] > 0
+
+    def test_stage_error_is_raised(self, build):
+        """Błąd etapu embeddingu przerywa ingestię bez zatwierdzania paczek"""
+        batches = []
+        pipeline = build(embedder=FailingEmbedder(), num_workers=1, commit_batch_size=1)
+
+        with pytest.raises(RuntimeError, match="model niedostępny"):
+            pipeline.run(documents(10), batches.append)
+        assert batches == []
+
+
+class TestChunkDumps:
+    def test_chunking_does_not_touch_filesystem_by_default(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        chunks = HierarchicalLegalChunker().split_text(LEGAL_DOCUMENT, doc_id="owu")
+
+        assert len(chunks) == 4
+        assert list(tmp_path.iterdir()) == []
+
+    def test_dumps_are_written_in_background(self, tmp_path):
+        chunker = HierarchicalLegalChunker(dump_chunks=True, chunks_dir=str(tmp_path / "chunks"))
+        chunks = chunker.split_text(LEGAL_DOCUMENT, doc_id="owu")
+        chunker.flush()
+
+        files = sorted((tmp_path / "chunks").glob("owu_*.txt"))
+        assert len(files) == len(chunks)
+        assert files[0].read_text(encoding="utf-8").endswith(chunks[0].text)
+        chunker.close()
+
+    def test_chunker_with_writer_can_be_pickled(self, tmp_path):
+        chunker = HierarchicalLegalChunker(dump_chunks=True, chunks_dir=str(tmp_path / "chunks"))
+        chunker.split_text(LEGAL_DOCUMENT, doc_id="owu")
+
+        copy = pickle.loads(pickle.dumps(chunker))
+        chunker.close()
+
+        assert copy.dump_chunks and copy.chunks_dir == chunker.chunks_dir
+        copy.split_text(LEGAL_DOCUMENT, doc_id="kopia")
+        copy.close()
+        assert len(list((tmp_path / "chunks").glob("kopia_*.txt"))) == 4
@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+
+from src.retrieval import DenseIndex, IVFIndex
+
+
+def clustered(n: int, dim: int = 32, clusters: int = 20, seed: int = 0) -> list:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=n)
+    vectors = centers[labels] + 0.5 * rng.standard_normal((n, dim)).astype(np.float32)
+    return [v.reshape(1, -1) for v in vectors]
+
+
+def top_rows(rows: np.ndarray, scores: np.ndarray, k: int) -> set:
+    return set(rows[np.argsort(-scores, kind='stable')[:k]].tolist())
+
+
+class TestIVFIndex:
+    def test_untrained_index_is_exact(self):
+        """Poniżej min_train_size indeks zwraca te same wyniki co DenseIndex"""
+        embeddings = clustered(100)
+        ivf = IVFIndex(min_train_size=1000)
+        ivf.sync(embeddings)
+        dense = DenseIndex()
+        dense.sync(embeddings)
+
+        assert not ivf.is_trained
+        rows, scores = ivf.search(embeddings[3])
+        expected_rows, expected_scores = dense.search(embeddings[3])
+        np.testing.assert_array_equal(rows, expected_rows)
+        np.testing.assert_allclose(scores, expected_scores)
+
+    def test_full_probe_matches_exact_search(self):
+        """nprobe == nlist przeszukuje wszystkie wiersze z dokładnymi podobieństwami"""
+        embeddings = clustered(2000)
+        ivf = IVFIndex(nlist=16, nprobe=16, min_train_size=100)
+        ivf.sync(embeddings)
+        dense = DenseIndex()
+        dense.sync(embeddings)
+
+        query = embeddings[42]
+        rows, scores = ivf.search(query)
+        exact = dense.scores(query)
+        assert sorted(rows.tolist()) == list(range(len(embeddings)))
+        np.testing.assert_allclose(scores, exact[rows], atol=1e-6)
+
+    def test_partial_probe_has_high_recall(self):
+        embeddings = clustered(3000, seed=1)
+        ivf = IVFIndex(nlist=20, nprobe=4, min_train_size=100)
+        ivf.sync(embeddings)
+        dense = DenseIndex()
+        dense.sync(embeddings)
+
+        hits = 0
+        for i in range(0, 3000, 100):
+            expected = top_rows(*dense.search(embeddings[i]), k=10)
+            hits += len(expected & top_rows(*ivf.search(embeddings[i]), k=10))
+        assert hits / (10 * 30) >= 0.9
+
+    def test_incremental_rows_are_searchable(self):
+        """Wiersze dodane po treningu trafiają do list bez ponownego treningu"""
+        embeddings = clustered(1000)
+        ivf = IVFIndex(nlist=10, nprobe=10, min_train_size=100)
+        ivf.sync(embeddings)
+        centroids = ivf.centroids
+
+        embeddings.extend(clustered(50, seed=5))
+        ivf.sync(embeddings)
+
+        assert ivf.centroids is centroids
+        rows, _ = ivf.search(embeddings[-1])
+        assert len(embeddings) - 1 in rows.tolist()
+
+    def test_save_and_load_round_trip(self, tmp_path):
+        embeddings = clustered(1500)
+        ivf = IVFIndex(nlist=12, min_train_size=100)
+        ivf.sync(embeddings)
+        ivf.save(tmp_path / "ivf.npz")
+
+        restored = IVFIndex(nlist=12, min_train_size=100, seed=123)
+        assert restored.load(tmp_path / "ivf.npz")
+        restored.sync(embeddings)
+
+        np.testing.assert_array_equal(restored.centroids, ivf.centroids)
+        rows, _ = restored.search(embeddings[7])
+        expected_rows, _ = ivf.search(embeddings[7])
+        np.testing.assert_array_equal(np.sort(rows), np.sort(expected_rows))
+
+    def test_restored_state_must_match_corpus(self, tmp_path):
+        """Zapis z innej kolejności wierszy jest odrzucany, a dopisanie wierszy nie przepisuje pliku"""
+        embeddings = clustered(1500)
+        path = tmp_path / "ivf.npz"
+        ivf = IVFIndex(nlist=12, min_train_size=100)
+        ivf.sync(embeddings)
+        ivf.save(path)
+        saved_at = path.stat().st_mtime_ns
+
+        embeddings.extend(clustered(20, seed=5))
+        ivf.sync(embeddings)
+        ivf.save(path)
+        assert path.stat().st_mtime_ns == saved_at
+
+        grown = IVFIndex(nlist=12, min_train_size=100, seed=123)
+        grown.load(path)
+        grown.sync(embeddings)
+        np.testing.assert_array_equal(grown.centroids, ivf.centroids)
+        np.testing.assert_array_equal(grown._assignments, ivf._assignments)
+
+        reordered = IVFIndex(nlist=12, min_train_size=100, seed=123)
+        reordered.load(path)
+        reordered.sync(embeddings[1:] + embeddings[:1])
+        assert not np.array_equal(reordered.centroids, ivf.centroids)
+
+    def test_reset_drops_training(self):
+        ivf = IVFIndex(min_train_size=100)
+        ivf.sync(clustered(500))
+        assert ivf.is_trained
+
+        ivf.reset()
+        assert not ivf.is_trained
+        assert len(ivf) == 0
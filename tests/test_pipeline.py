@@ -0,0 +1,412 @@
+import numpy as np
+import pytest
+
+from tests.conftest import LEGAL_DOCUMENT
+
+
+class TestLegalRAGPipeline:
+    def test_add_documents_skips_known_documents(self, legal_pipeline):
+        """Dokument o znanym doc_id jest pomijany, a nowe chunki liczone są jedną paczką"""
+        rag = legal_pipeline()
+        stats = rag.add_documents([LEGAL_DOCUMENT, LEGAL_DOCUMENT.replace("OWU", "Warunki")],
+                                  doc_ids=["owu", "warunki"])
+
+        assert stats["added_documents"] == 2
+        assert len(rag.embedder.batches) == 1
+        assert "owu" in rag.document_index and "warunki" in rag.document_index
+
+        stats = rag.add_documents([LEGAL_DOCUMENT], doc_ids=["owu"])
+        assert stats["skipped_documents"] == 1
+        assert stats["new_chunks"] == 0
+
+    def test_document_index_is_rebuilt_from_cache(self, legal_pipeline):
+        """Indeks dokumentów i statystyki odtwarzane są z cache'u po restarcie"""
+        rag = legal_pipeline()
+        rag.add_documents([LEGAL_DOCUMENT, "Art. 1. Inny dokument."], doc_ids=["owu", "inny"])
+        expected = rag.get_stats()["documents"]
+
+        reloaded = legal_pipeline()
+        stats = reloaded.get_stats()["documents"]
+
+        assert stats == expected
+        assert stats["per_document"]["owu"]["chunks"] == 4
+        assert reloaded.document_index.chunk_ranges("inny") == [(4, 5)]
+        assert reloaded.document_index.doc_for_content(
+            reloaded.document_index.content_hash("owu")) == "owu"
+
+    def test_clear_resets_document_index(self, legal_pipeline):
+        rag = legal_pipeline()
+        rag.add_documents([LEGAL_DOCUMENT], doc_ids=["owu"])
+        rag.clear()
+
+        assert len(rag.document_index) == 0
+        assert rag.add_documents([LEGAL_DOCUMENT], doc_ids=["owu"])["added_documents"] == 1
+
+    def test_update_document_reembeds_only_changed_chunks(self, legal_pipeline):
+        """Nowelizacja jednego artykułu liczy embedding tylko zmienionego chunka"""
+        rag = legal_pipeline()
+        rag.add_documents([LEGAL_DOCUMENT, "Art. 1. Inny dokument."], doc_ids=["owu", "inny"])
+        amended = LEGAL_DOCUMENT.replace("działań wojennych", "działań wojennych i zamieszek")
+        embedded = len(rag.embedder.batches)
+
+        stats = rag.update_document(amended, "owu")
+
+        assert (stats["new_chunks"], stats["unchanged_chunks"], stats["retired_chunks"]) == (1, 3, 1)
+        assert rag.embedder.batches[embedded:] == [[rag.documents[-1].text]]
+        assert "zamieszek" in rag.documents[-1].text
+        assert rag.document_index.chunk_ranges("owu") == [(5, 9)]
+        assert stats["total_chunks"] == 5 and rag.retriever.tombstones == {0, 1, 2, 3}
+        assert rag.update_document(amended, "owu")["updated_documents"] == 0
+
+        # Po restarcie dziennik metadanych odtwarza tylko nową wersję, w tej samej kolejności
+        reloaded = legal_pipeline()
+        assert [(c.doc_id, c.chunk_id, c.text) for c in reloaded.documents] == \
+               [(c.doc_id, c.chunk_id, c.text) for c in rag.documents[4:]]
+        assert reloaded.document_index.content_hash("owu") == rag.document_index.content_hash("owu")
+
+    def test_update_document_extends_indexes_in_place(self, legal_pipeline):
+        """Aktualizacja dopisuje wiersze do indeksów zamiast przebudowywać je od nowa"""
+        rag = legal_pipeline()
+        rag.add_documents([LEGAL_DOCUMENT, "Art. 1. Inny dokument."], doc_ids=["owu", "inny"])
+        documents, embeddings = rag.documents, rag.embeddings
+        generations = (rag.retriever.index.generation, rag.retriever.sparse_index.generation)
+
+        rag.update_document("Art. 1. Inny dokument po zmianie.", "inny")
+
+        assert rag.documents is documents and rag.embeddings is embeddings
+        assert (rag.retriever.index.generation, rag.retriever.sparse_index.generation) == generations
+        assert len(rag.retriever.index) == len(rag.retriever.sparse_index) == len(rag.documents) == 6
+        results = rag.retriever.retrieve("Inny dokument po zmianie", rag.documents, rag.embeddings, min_score=-1.0)
+        assert results and all(chunk is not rag.documents[4] for chunk, _ in results)
+
+    def test_removed_document_is_skipped_until_compaction(self, legal_pipeline):
+        rag = legal_pipeline()
+        rag.add_documents([LEGAL_DOCUMENT, "Art. 1. Inny dokument."], doc_ids=["owu", "inny"])
+        question = "Co mówi art. 3?"
+        assert rag.retriever.retrieve(question, rag.documents, rag.embeddings)[0][0].doc_id == "owu"
+
+        stats = rag.remove_document("owu")
+
+        assert stats["removed_chunks"] == 4 and "owu" not in rag.document_index
+        results = rag.retriever.retrieve(question, rag.documents, rag.embeddings, min_score=-1.0)
+        assert [chunk.doc_id for chunk, _ in results] == ["inny"]
+        assert rag.remove_document("owu")["removed_documents"] == 0
+        stored = len(rag.cache.store)
+
+        stats = rag.compact()
+
+        assert (stats["removed_chunks"], stats["removed_embeddings"]) == (4, stored - 1)
+        assert [chunk.doc_id for chunk in rag.documents] == ["inny"]
+        assert len(rag.cache.store) == 1 and not rag.retriever.tombstones
+        reloaded = legal_pipeline()
+        assert [chunk.doc_id for chunk in reloaded.documents] == ["inny"]
+        assert "owu" not in reloaded.document_index
+        np.testing.assert_array_equal(reloaded.embeddings[0], rag.embeddings[0])
+        assert reloaded.add_documents([LEGAL_DOCUMENT], doc_ids=["owu"])["added_documents"] == 1
+
+    def test_compaction_runs_in_background_above_threshold(self, legal_pipeline):
+        rag = legal_pipeline(compaction_threshold=0.5)
+        rag.add_documents([LEGAL_DOCUMENT, "Art. 1. Inny dokument."], doc_ids=["owu", "inny"])
+
+        rag.remove_document("owu")
+        rag.wait_for_compaction()
+
+        assert rag.compactions == 1
+        assert len(rag.documents) == 1
+        assert rag.get_stats()["documents"]["tombstoned_chunks"] == 0
+
+    def test_queries_see_consistent_state_during_compaction(self, legal_pipeline):
+        """Zapytania w trakcie kompaktowania nie gubią żywych chunków ani nie zwracają usuniętych"""
+        import threading
+
+        rag = legal_pipeline()
+        rag.add_documents([LEGAL_DOCUMENT, "Art. 1. Inny dokument."], doc_ids=["owu", "inny"])
+        rag.generator = FakeGenerator()
+        rag.remove_document("owu")
+        assert rag.compactions == 0
+
+        def compact_repeatedly():
+            for _ in range(20):
+                rag.compact()
+
+        compaction = threading.Thread(target=compact_repeatedly)
+        compaction.start()
+        seen = set()
+        while compaction.is_alive():
+            chunks = rag.query("Art. 1. Inny dokument.", min_score=-1.0)["chunks"]
+            seen.add(tuple(chunk["doc_id"] for chunk in chunks))
+        compaction.join()
+
+        assert seen == {("inny",)}
+        assert rag.compactions == 20 and not rag.retriever.tombstones
+
+    def test_ivf_index_is_persisted_in_cache(self, legal_pipeline):
+        """Wytrenowany indeks IVF zapisywany jest w cache'u i wczytywany po restarcie"""
+        from src.retrieval import IVFIndex
+
+        rag = legal_pipeline(retrieval_index="ivf")
+        rag.retriever.index.min_train_size = 1
+        rag.add_documents([LEGAL_DOCUMENT], doc_ids=["owu"])
+
+        assert isinstance(rag.retriever.index, IVFIndex)
+        assert rag.retriever.index.is_trained
+        assert rag._ivf_index_path.exists()
+
+        reloaded = legal_pipeline(retrieval_index="ivf")
+        reloaded.retriever.index.sync(reloaded.embeddings)
+        np.testing.assert_array_equal(reloaded.retriever.index.centroids, rag.retriever.index.centroids)
+
+    def test_add_directory_skips_indexed_files(self, legal_pipeline, tmp_path):
+        """Ponowne dodanie katalogu pomija pliki o zaindeksowanej już treści"""
+        docs = tmp_path / "docs"
+        (docs / "sub").mkdir(parents=True)
+        (docs / "a.txt").write_text(LEGAL_DOCUMENT, encoding="utf-8")
+        (docs / "sub" / "b.txt").write_text(LEGAL_DOCUMENT.replace("OWU", "Warunki"), encoding="utf-8")
+        (docs / "sub" / "kopia.txt").write_text(LEGAL_DOCUMENT, encoding="utf-8")
+        (docs / "zly.txt").write_bytes(b"\xff\xfe\xfa")
+
+        rag = legal_pipeline(commit_batch_size=1)
+        stats = rag.add_directory(docs)
+        assert stats["added_documents"] == 2
+        assert stats["skipped_documents"] == 1
+        assert stats["failed_files"] == 1
+        assert stats["stages"]["writing"]["batches"] == 2
+
+        # Wznowienie po restarcie: wszystko jest już w cache'u
+        stats = legal_pipeline().add_directory(docs)
+        assert stats["added_documents"] == 0
+        assert stats["skipped_documents"] == 3
+
+    def test_interrupted_ingestion_resumes(self, legal_pipeline, tmp_path):
+        """Paczki zatwierdzone przed przerwaniem zostają w cache'u, a ponowne uruchomienie dodaje resztę"""
+        paths = []
+        for i in range(4):
+            paths.append(tmp_path / f"doc_{i}.txt")
+            paths[-1].write_text(LEGAL_DOCUMENT.replace("OWU", f"OWU {i}"), encoding="utf-8")
+
+        def interrupted():
+            yield from paths[:2]
+            raise KeyboardInterrupt
+
+        rag = legal_pipeline(commit_batch_size=1, ingestion_workers=1)
+        with pytest.raises(KeyboardInterrupt):
+            rag.add_files(interrupted())
+        assert len(rag.document_index) == 2
+
+        resumed = legal_pipeline(commit_batch_size=1, ingestion_workers=1)
+        stats = resumed.add_files(paths)
+        assert stats["skipped_documents"] == 2
+        assert stats["added_documents"] == 2
+        assert len(resumed.document_index) == 4
+        assert resumed.retriever.index.matrix.shape[0] == len(resumed.embeddings)
+
+    def test_committed_batches_are_published_atomically(self, legal_pipeline):
+        """Zapytanie w trakcie ingestii widzi listy, indeks dokumentów i indeksy wyszukiwania w tym samym stanie"""
+        import threading
+
+        rag = legal_pipeline(commit_batch_size=1, ingestion_workers=1)
+        documents = [LEGAL_DOCUMENT.replace("OWU", f"OWU {i}") for i in range(20)]
+        done = threading.Event()
+        states = []
+
+        def observe():
+            while not done.is_set():
+                with rag._index_lock.read():
+                    indexed = sum(end - start for doc_id in rag.document_index
+                                  for start, end in rag.document_index.chunk_ranges(doc_id))
+                    states.append((len(rag.documents), indexed, len(rag.retriever.index),
+                                   len(rag.retriever.sparse_index)))
+
+        observer = threading.Thread(target=observe)
+        observer.start()
+        rag.add_documents(documents, doc_ids=[f"doc_{i}" for i in range(20)])
+        done.set()
+        observer.join()
+
+        assert states and all(len(set(state)) == 1 for state in states)
+        assert len(rag.retriever.index) == len(rag.documents)
+
+
+class FakeGenerator:
+    def __init__(self):
+        self.calls = []
+
+    def generate(self, query, contexts, max_tokens: int = 4000):
+        self.calls.append((query, [(c.doc_id, c.chunk_id) for c in contexts]))
+        return {"answer": f"odpowiedź {len(self.calls)}", "sources": [], "error": None, "processing_time": 0}
+
+
+class TestAnswerCache:
+    def test_repeated_question_reuses_answer_until_corpus_changes(self, legal_pipeline):
+        rag = legal_pipeline()
+        rag.add_documents([LEGAL_DOCUMENT], doc_ids=["owu"])
+        rag.generator = FakeGenerator()
+        question = rag.documents[0].text
+
+        first = rag.query(question)
+        second = rag.query(question + "  ")
+        assert first["answer"] == second["answer"] == "odpowiedź 1"
+        assert second["cached"] and not first["cached"]
+        assert len(rag.generator.calls) == 1
+
+        rag.add_documents(["Art. 1. Zupełnie inny dokument."], doc_ids=["inny"])
+        third = rag.query(question)
+        assert not third["cached"]
+        assert len(rag.generator.calls) == 2
+        assert rag.get_stats()["answer_cache"]["hits"] == 1
+
+    def test_failed_consolidation_is_not_cached(self, legal_pipeline, monkeypatch):
+        """Połączone odpowiedzi wsadów po błędzie konsolidacji nie trafiają do cache'u"""
+        import asyncio
+
+        rag = legal_pipeline()
+        rag.add_documents([LEGAL_DOCUMENT], doc_ids=["owu"])
+        rag.generator = FakeGenerator()
+        chunks = [(chunk, 1.0 - i / 10) for i, chunk in enumerate(rag.documents)]
+        rag.retriever.retrieve = lambda query, documents, embeddings, top_k, min_score: chunks
+        monkeypatch.setattr(rag, "_call_anthropic", lambda prompt, **kwargs: "")
+
+        first = rag.query_large_context("pytanie", batch_size=2)
+        assert first["answer"].startswith("Część 1/2")
+        assert not rag.query_large_context("pytanie", batch_size=2)["cached"]
+
+        rag.generator = AsyncGenerator(delay=0)
+        monkeypatch.setattr(rag.generator, "acomplete", lambda *args, **kwargs: asyncio.sleep(0, result=""))
+        result = asyncio.run(rag.aquery_large_context("pytanie", batch_size=2))
+        assert result["answer"].startswith("Część 1/2")
+        assert rag.get_stats()["answer_cache"]["hits"] == 0
+
+        # Udana konsolidacja jest zapamiętywana
+        monkeypatch.setattr(rag, "_call_anthropic", lambda prompt, **kwargs: "razem")
+        rag.generator = FakeGenerator()
+        rag.query_large_context("pytanie", batch_size=2)
+        assert rag.query_large_context("pytanie", batch_size=2)["cached"]
+
+
+class StreamingGenerator(FakeGenerator):
+    def generate(self, query, contexts, max_tokens: int = 4000, stream: bool = False):
+        if not stream:
+            return super().generate(query, contexts, max_tokens)
+        self.calls.append((query, [(c.doc_id, c.chunk_id) for c in contexts]))
+        return iter(["odpo", "wiedź ", str(len(self.calls))])
+
+
+class TestStreaming:
+    def test_smart_query_streams_events_and_caches_answer(self, legal_pipeline):
+        rag = legal_pipeline()
+        rag.add_documents([LEGAL_DOCUMENT], doc_ids=["owu"])
+        rag.generator = StreamingGenerator()
+        question = rag.documents[0].text
+
+        events = list(rag.smart_query(question, top_k=2, batch_threshold=3, stream=True))
+        types = [event["type"] for event in events]
+        assert types == ["retrieval", "token", "token", "token", "done"]
+        assert events[0]["sources"]
+        done = events[-1]
+        assert done["answer"] == "odpowiedź 1"
+        assert done["time_retrieval"] <= done["time_to_first_token"] <= done["total_time"]
+        assert not done["cached"]
+
+        again = list(rag.smart_query(question, top_k=2, stream=True))
+        assert [event["type"] for event in again] == ["retrieval", "token", "done"]
+        assert again[-1]["cached"] and again[-1]["answer"] == "odpowiedź 1"
+        assert len(rag.generator.calls) == 1
+
+
+class AsyncGenerator(FakeGenerator):
+    def __init__(self, delay: float):
+        super().__init__()
+        self.delay = delay
+
+    async def agenerate(self, query, contexts, max_tokens: int = 4000):
+        import asyncio
+        self.calls.append((query, [(c.doc_id, c.chunk_id) for c in contexts]))
+        await asyncio.sleep(self.delay)
+        return {"answer": f"odpowiedź {len(self.calls)}", "sources": [], "error": None, "processing_time": 0}
+
+    async def acomplete(self, prompt, system_prompt, **kwargs):
+        return "razem"
+
+
+class TestAsyncQueries:
+    def test_concurrent_questions_share_one_pipeline(self, legal_pipeline):
+        import asyncio
+        import time
+
+        rag = legal_pipeline()
+        rag.add_documents([LEGAL_DOCUMENT], doc_ids=["owu"])
+        rag.generator = AsyncGenerator(delay=0.3)
+        questions = [chunk.text for chunk in rag.documents]
+
+        async def ask_all():
+            return await asyncio.gather(*(rag.aquery(q, min_score=-1.0) for q in questions))
+
+        start = time.time()
+        results = asyncio.run(ask_all())
+        elapsed = time.time() - start
+
+        assert elapsed < 0.3 * len(questions)
+        assert all(r["answer"].startswith("odpowiedź") and r["chunks"] for r in results)
+        assert len(rag.generator.calls) == len(questions)
+
+    def test_asmart_query_uses_batches_for_large_context(self, legal_pipeline):
+        import asyncio
+
+        rag = legal_pipeline()
+        rag.add_documents([LEGAL_DOCUMENT], doc_ids=["owu"])
+        rag.generator = AsyncGenerator(delay=0)
+        chunks = [(chunk, 1.0 - i / 10) for i, chunk in enumerate(rag.documents)]
+        rag.retriever.retrieve = lambda query, documents, embeddings, top_k, min_score: chunks
+
+        result = asyncio.run(rag.asmart_query("pytanie", batch_threshold=2))
+        assert result["answer"] == "razem"
+        assert [d["status"] for d in result["batch_details"]] == ["ok", "ok"]
+
+        # Generator bez metod asynchronicznych działa w puli wątków
+        rag.generator = FakeGenerator()
+        result = asyncio.run(rag.aquery("pytanie"))
+        assert result["answer"] == "odpowiedź 1"
+
+
+class TestBatchGeneration:
+    class SlowGenerator:
+        """Generator z opóźnieniem; wsady z 'art_4' zawodzą, z 'art_1' się zawieszają"""
+
+        def __init__(self, delay: float):
+            self.delay = delay
+
+        def generate(self, query, contexts, max_tokens: int = 4000):
+            import time
+            ids = {c.section_id for c in contexts}
+            if "art_1" in ids:
+                time.sleep(2)
+            time.sleep(self.delay)
+            if "art_4" in ids:
+                return {"answer": "", "error": "Brak odpowiedzi z API", "sources": [], "processing_time": 0}
+            return {"answer": f"odpowiedź {sorted(ids)}", "error": None, "sources": [], "processing_time": 0}
+
+    def test_batches_run_concurrently_and_failures_are_dropped(self, legal_pipeline, monkeypatch):
+        import time
+
+        rag = legal_pipeline()
+        rag.add_documents([LEGAL_DOCUMENT], doc_ids=["owu"])
+        rag.generator = self.SlowGenerator(delay=0.3)
+        consolidated = []
+        monkeypatch.setattr(rag, "_call_anthropic", lambda prompt, **kwargs: consolidated.append(prompt) or "razem")
+
+        chunks = [(chunk, 1.0 - i / 10) for i, chunk in enumerate(rag.documents)]
+        details = []
+        start = time.time()
+        answer = rag.process_in_batches("pytanie", chunks, batch_size=1, max_batches=5,
+                                        max_concurrency=5, batch_timeout=0.8, batch_details=details)
+        elapsed = time.time() - start
+
+        assert answer == "razem"
+        assert elapsed < 1.5
+        section_of = {c.chunk_id: c.section_id for c in rag.documents}
+        statuses = {section_of[d["chunks"][0]["chunk_id"]]: d["status"] for d in details}
+        assert statuses["art_1"] == "timeout"
+        assert statuses["art_4"] == "error"
+        assert statuses["art_2"] == statuses["art_3"] == "ok"
+        assert all(d["latency"] is not None for d in details)
+        assert "art_4" not in consolidated[0] and "art_1" not in consolidated[0]
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from src.cache import MemmapVectorStore
+from src.retrieval import DenseIndex, QuantizedIndex
+
+from tests.test_ivf_index import clustered
+
+
+def recall(index, exact: DenseIndex, queries, k: int = 10) -> float:
+    hits = 0
+    for query in queries:
+        rows, scores = index.search(query)
+        expected_rows, expected_scores = exact.search(query)
+        found = rows[np.argsort(-scores, kind='stable')[:k]]
+        expected = expected_rows[np.argsort(-expected_scores, kind='stable')[:k]]
+        hits += len(set(found.tolist()) & set(expected.tolist()))
+    return hits / (k * len(queries))
+
+
+class TestQuantizedIndex:
+    @pytest.fixture
+    def corpus(self):
+        embeddings = clustered(3000, dim=64)
+        exact = DenseIndex()
+        exact.sync(embeddings)
+        return embeddings, exact, embeddings[:50]
+
+    @pytest.mark.parametrize("dtype,min_recall", [("int8", 0.9), ("float16", 0.99)])
+    def test_compact_scores_keep_recall(self, corpus, dtype, min_recall):
+        embeddings, exact, queries = corpus
+        index = QuantizedIndex(dtype=dtype, rescore_k=None)
+        index.sync(embeddings)
+
+        np.testing.assert_allclose(index.scores(queries[0]), exact.scores(queries[0]), atol=0.02)
+        assert recall(index, exact, queries) >= min_recall
+        assert index.memory_bytes <= exact.matrix.nbytes // (4 if dtype == "int8" else 2) + 1024
+
+    def test_pca_with_rescore_returns_exact_scores(self, corpus):
+        embeddings, exact, queries = corpus
+        index = QuantizedIndex(dim=32, rescore_k=100, min_train_size=500)
+        growing = []
+        for start in range(0, len(embeddings), 400):
+            growing.extend(embeddings[start:start + 400])
+            index.sync(growing)
+
+        assert index.code_dim == 32
+        rows, scores = index.search(queries[0])
+        assert len(rows) == 100
+        np.testing.assert_allclose(scores, exact.scores(queries[0])[rows], atol=1e-5)
+        assert recall(index, exact, queries) >= 0.9
+
+    def test_int8_scales_grow_with_new_vectors(self):
+        small = [np.full((1, 4), 0.1, dtype=np.float32) + np.eye(4, dtype=np.float32)[i] * 0.01 for i in range(4)]
+        large = [np.array([[1.0, -0.2, 0.3, 0.05]], dtype=np.float32)]
+        index = QuantizedIndex(rescore_k=None)
+        index.add(small)
+        index.add(large)
+
+        expected = DenseIndex()
+        expected.add(small + large)
+        np.testing.assert_allclose(index.matrix, expected.matrix, atol=0.01)
+
+
+def test_vector_store_float16_halves_file_size(tmp_path):
+    vectors = [np.random.default_rng(i).standard_normal((1, 32)).astype(np.float32) for i in range(10)]
+    hashes = [f"{i:032x}" for i in range(10)]
+
+    store = MemmapVectorStore(tmp_path / "f16", dtype="float16")
+    store.add(hashes, vectors)
+    reopened = MemmapVectorStore(tmp_path / "f16")
+
+    assert reopened.dtype == "float16"
+    assert reopened.vectors_path.stat().st_size == 10 * 32 * 2
+    np.testing.assert_allclose(reopened.get(hashes[3]), vectors[3], atol=1e-2)
@@ -0,0 +1,32 @@
+import threading
+import time
+
+from src.rag.rwlock import ReadWriteLock
+
+
+def test_writer_waits_for_readers_and_blocks_new_ones():
+    lock = ReadWriteLock()
+    events = []
+
+    def write():
+        with lock.write():
+            events.append("write")
+
+    def read_later():
+        time.sleep(0.05)
+        with lock.read():
+            events.append("late read")
+
+    with lock.read():
+        with lock.read():
+            writer = threading.Thread(target=write)
+            reader = threading.Thread(target=read_later)
+            writer.start()
+            reader.start()
+            time.sleep(0.1)
+            # Czytelnicy trzymają blokadę, więc pisarz i czekający za nim czytelnik stoją
+            assert events == []
+    writer.join()
+    reader.join()
+
+    assert events == ["write", "late read"]
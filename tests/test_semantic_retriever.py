@@ -0,0 +1,143 @@
+import time
+
+import numpy as np
+import pytest
+
+from src.chunking import Chunk
+from src.retrieval.reranker import CrossEncoderReranker
+from src.retrieval.semantic import SemanticRetriever
+
+
+class FakeEmbedder:
+    """Embedder zwracający z góry ustalony wektor zapytania"""
+
+    def __init__(self, query_embedding: np.ndarray):
+        self.query_embedding = query_embedding
+        self.model_name = "fake"
+
+    def get_embedding(self, text: str) -> np.ndarray:
+        return self.query_embedding
+
+
+class TestSemanticRetriever:
+    @pytest.fixture
+    def corpus(self):
+        rng = np.random.default_rng(0)
+        base = rng.standard_normal(64).astype(np.float32)
+        embeddings = [
+            (base + rng.normal(scale=s, size=64)).astype(np.float32).reshape(1, -1)
+            for s in np.linspace(0.1, 3.0, 200)
+        ]
+        embeddings.append(np.zeros((1, 64), dtype=np.float32))
+        documents = [Chunk(text=f"tekst {i}", doc_id="doc", chunk_id=i) for i in range(len(embeddings))]
+        return base.reshape(1, -1), documents, embeddings
+
+    def test_scores_match_cosine_similarity(self, corpus):
+        """Macierzowe podobieństwa są zgodne z podobieństwem liczonym wektor po wektorze"""
+        query, _, embeddings = corpus
+        retriever = SemanticRetriever(embedder=FakeEmbedder(query))
+        retriever.index.sync(embeddings)
+
+        expected = np.array([retriever.cosine_similarity(query, e) for e in embeddings], dtype=np.float32)
+        np.testing.assert_allclose(retriever.index.scores(query), expected, rtol=0, atol=1e-6)
+
+    @pytest.mark.parametrize("query_text,top_k", [
+        ("jakie są wyłączenia odpowiedzialności", 25),
+        ("jakie są wyłączenia odpowiedzialności", None),
+        ("kto jest ubezpieczonym w umowie", None),
+    ])
+    def test_retrieve_matches_reference_loop(self, corpus, query_text, top_k):
+        """Wyniki retrieve są takie same jak dla pętli po wszystkich embeddingach"""
+        query, documents, embeddings = corpus
+        retriever = SemanticRetriever(embedder=FakeEmbedder(query), min_score_threshold=0.3)
+
+        results = retriever.retrieve(query_text, documents, embeddings, top_k=top_k)
+
+        _, is_broad = retriever._calculate_query_complexity(query_text)
+        base_min_score = 0.45 if is_broad else retriever.min_score_threshold
+        threshold = retriever._adjust_min_score(query_text, base_min_score, is_broad)
+        reference = sorted(
+            ((i, retriever.cosine_similarity(query, e)) for i, e in enumerate(embeddings)),
+            key=lambda x: x[1], reverse=True,
+        )
+        reference = [(i, s) for i, s in reference if s >= threshold]
+        if is_broad:
+            reference = reference[:top_k]
+        else:
+            scores = np.array([s for _, s in reference], dtype=np.float32)
+            reference = reference[:retriever._get_optimal_top_k(scores)]
+
+        assert [chunk.chunk_id for chunk, _ in results] == [i for i, _ in reference]
+        np.testing.assert_allclose([s for _, s in results], [s for _, s in reference], atol=1e-6)
+
+    def test_index_follows_appended_embeddings(self, corpus):
+        """Indeks dokłada nowe wiersze i przebudowuje się po podmianie listy"""
+        query, _, embeddings = corpus
+        retriever = SemanticRetriever(embedder=FakeEmbedder(query))
+
+        growing = list(embeddings[:10])
+        retriever.index.sync(growing)
+        growing.extend(embeddings[10:20])
+        retriever.index.sync(growing)
+        assert len(retriever.index) == 20
+
+        retriever.index.sync(list(embeddings[:5]))
+        assert len(retriever.index) == 5
+
+
+class TestCrossEncoderReranker:
+    @staticmethod
+    def scorer_by_chunk_number(calls):
+        """Ocena odwrotna do numeru chunka - reranker odwraca kolejność retrievera"""
+        def score(pairs):
+            calls.append(len(pairs))
+            return [1.0 / (1 + int(text.split()[-1])) for _, text in pairs]
+        return score
+
+    def test_rerank_cuts_to_top_k_and_caches_pairs(self):
+        calls = []
+        reranker = CrossEncoderReranker(candidates=6, top_k=2, batch_size=4,
+                                        scorer=self.scorer_by_chunk_number(calls))
+        results = [(Chunk(text=f"tekst {i}", chunk_id=i), 0.9 - i / 100) for i in (9, 5, 1, 7, 3, 8, 2)]
+
+        reranked = reranker.rerank("pytanie", results)
+        assert [chunk.chunk_id for chunk, _ in reranked] == [1, 3]
+        assert calls == [4, 2]
+
+        reranker.rerank("pytanie", results)
+        assert calls == [4, 2]
+        assert reranker.get_stats()["cache_hits"] == 6
+
+    def test_latency_budget_keeps_unscored_candidates_in_retrieval_order(self):
+        def slow(pairs):
+            time.sleep(0.05)
+            return [0.5] * len(pairs)
+
+        reranker = CrossEncoderReranker(candidates=8, top_k=8, batch_size=2, latency_budget=0.01, scorer=slow)
+        results = [(Chunk(text=f"tekst {i}", chunk_id=i), 0.9 - i / 100) for i in range(8)]
+
+        reranked = reranker.rerank("pytanie", results)
+        assert [chunk.chunk_id for chunk, _ in reranked] == list(range(8))
+        assert [score for _, score in reranked[:2]] == [0.5, 0.5]
+        # Nieocenieni kandydaci mają wyniki w skali modelu, malejące poniżej ocenionych
+        unscored = [score for _, score in reranked[2:]]
+        assert all(0 <= score < 0.5 for score in unscored)
+        assert unscored == sorted(unscored, reverse=True) and len(set(unscored)) == len(unscored)
+        assert reranker.get_stats()["budget_exceeded"] == 1
+        assert reranker.get_stats()["pairs_scored"] == 2
+
+    def test_retriever_reranks_candidates(self):
+        rng = np.random.default_rng(1)
+        query = rng.standard_normal(16).astype(np.float32)
+        embeddings = [(query + rng.normal(scale=0.1, size=16)).astype(np.float32).reshape(1, -1) for _ in range(30)]
+        documents = [Chunk(text=f"tekst {i}", doc_id="doc", chunk_id=i) for i in range(30)]
+        reranker = CrossEncoderReranker(candidates=10, top_k=3, scorer=self.scorer_by_chunk_number([]))
+        retriever = SemanticRetriever(embedder=FakeEmbedder(query.reshape(1, -1)), min_score_threshold=0.3,
+                                      reranker=reranker)
+
+        results = retriever.retrieve("kto jest ubezpieczonym w umowie", documents, embeddings)
+
+        # Reranker ocenia 10 najlepszych wyników gęstych i zostawia 3 najwyżej ocenione
+        rows, scores = retriever.index.search(query.reshape(1, -1))
+        candidates = rows[np.argsort(-scores, kind='stable')[:10]]
+        assert [chunk.chunk_id for chunk, _ in results] == sorted(candidates.tolist())[:3]
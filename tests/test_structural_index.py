@@ -0,0 +1,84 @@
+from src.chunking.hierarchical_chunker import LegalChunk
+from src.retrieval import StructuralIndex
+
+from tests.conftest import LEGAL_DOCUMENT
+
+
+def legal_chunk(doc_id: str, chunk_id: int, *path) -> LegalChunk:
+    context_path = [{"type": "rozdzial", "id": "rozdzial_I", "name": "I", "subtype": ""}]
+    context_path += [{"type": t, "id": f"{t}_{n}", "name": n, "subtype": ""} for t, n in path]
+    return LegalChunk(text=f"{doc_id} {path}", section_type=path[-1][0], section_id=f"{path[-1][0]}_{path[-1][1]}",
+                      doc_id=doc_id, chunk_id=chunk_id, context_path=context_path, line_start=0, line_end=1)
+
+
+class TestStructuralIndex:
+    def test_parse_references(self):
+        parse = StructuralIndex.parse_references
+
+        assert parse("Co mówi art. 12 ust. 3?") == [(("art", "12"), ("ustep", "3"))]
+        assert parse("Porównaj artykuł 5 oraz § 2") == [(("art", "5"),), (("paragraf", "2"),)]
+        assert parse("Jakie są wyłączenia odpowiedzialności?") == []
+
+    def test_resolves_unambiguous_references(self):
+        documents = [
+            legal_chunk("kc", 0, ("art", "12")),
+            legal_chunk("kc", 1, ("art", "12"), ("ustep", "3")),
+            legal_chunk("kc", 2, ("art", "13"), ("ustep", "3")),
+            legal_chunk("kp", 3, ("art", "1")),
+            legal_chunk("kc", 4, ("art", "1")),
+        ]
+        index = StructuralIndex()
+        index.sync(documents)
+
+        assert index.resolve("co mówi art. 12 ust. 3") == [1]
+        assert index.resolve("Artykuł 12") == [0]
+        assert index.resolve("art. 12 i art. 13 ust. 3") == [0, 2]
+        # Ten sam numer w kilku miejscach albo wyliczenie - potrzebne zwykłe wyszukiwanie
+        assert index.resolve("ust. 3") is None
+        assert index.resolve("art. 1") is None
+        assert index.resolve("art. 1", doc_id="kp") == [3]
+        assert index.resolve("art. 12 i 13") is None
+        assert index.resolve("art. 99") is None
+
+
+def test_pipeline_answers_references_without_query_embedding(legal_pipeline):
+    rag = legal_pipeline()
+    rag.add_documents([LEGAL_DOCUMENT], doc_ids=["owu"])
+    embedded = len(rag.embedder.batches)
+
+    results = rag.retriever.retrieve("Co mówi art. 3?", rag.documents, rag.embeddings)
+
+    assert [(chunk.section_id, score) for chunk, score in results] == [("art_3", 1.0)]
+    assert len(rag.embedder.batches) == embedded
+    assert rag.get_stats()["retriever"]["structural_index"]["hits"] == 1
+
+
+def test_structural_answers_are_cached_by_evidence(legal_pipeline):
+    from tests.test_pipeline import FakeGenerator
+
+    rag = legal_pipeline()
+    rag.add_documents([LEGAL_DOCUMENT], doc_ids=["owu"])
+    rag.generator = FakeGenerator()
+    embedded = len(rag.embedder.batches)
+
+    first = rag.query("Co mówi art. 3?")
+    second = rag.query("co mówi  art. 3?")
+    assert second["cached"] and second["answer"] == first["answer"]
+    assert len(rag.generator.calls) == 1
+    assert len(rag.embedder.batches) == embedded
+
+    # Pytanie o wyliczenie omija ścieżkę strukturalną także przy szukaniu w cache'u odpowiedzi
+    assert rag.retriever.structural_rows("Wymień wszystkie wyłączenia z art. 3") is None
+    assert not rag.query("Co mówi artykuł 3?")["cached"]
+
+
+def test_unit_names_without_period_are_resolved(legal_pipeline):
+    """Nazwy jednostek ("artykuł", "art" bez kropki) nie czynią pytania szerokim"""
+    rag = legal_pipeline()
+    rag.add_documents([LEGAL_DOCUMENT], doc_ids=["owu"])
+    embedded = len(rag.embedder.batches)
+
+    for question in ("Co mówi artykuł 3?", "Co mówi art 3?"):
+        results = rag.retriever.retrieve(question, rag.documents, rag.embeddings)
+        assert [(chunk.section_id, score) for chunk, score in results] == [("art_3", 1.0)]
+    assert len(rag.embedder.batches) == embedded